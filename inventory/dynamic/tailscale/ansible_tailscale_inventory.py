@@ -23,14 +23,33 @@
 
 from __future__ import annotations
 
+import argparse
+import contextlib
+import hashlib
 import json
+import os
 import platform
 import subprocess
 import sys
+import tempfile
+import time
+from pathlib import Path
 from typing import Any, TypedDict
 
 ansible_inventory_type = dict[str, dict[str, list[str] | dict[str, Any]]]
 
+# The inventory is cached on disk so repeated invocations (every ansible-inventory
+# and playbook start) don't have to spawn `tailscale status` at all while the
+# cache is fresh. Both settings can be overridden through the environment
+CACHE_PATH_ENV_VAR = "TAILSCALE_INVENTORY_CACHE_PATH"
+CACHE_TTL_ENV_VAR = "TAILSCALE_INVENTORY_CACHE_TTL"
+DEFAULT_CACHE_PATH = Path.home() / ".cache" / "ansible" / "tailscale_inventory.json"
+DEFAULT_CACHE_TTL = 60
+
+# The host fields that end up in the inventory. The status is only re-assembled
+# into an inventory when one of these changed
+INVENTORY_HOST_FIELDS = ("HostName", "DNSName", "OS", "Online", "Tags", "TailscaleIPs")
+
 
 class InventoryType(TypedDict):
     """
@@ -210,6 +229,88 @@ def assemble_inventory(
     return inventory
 
 
+def status_fingerprint(ts_status: TailscaleStatusType) -> str:
+    """
+    Returns a hash over the parts of the tailscale status that affect the inventory,
+    so volatile fields like traffic counters and handshake times don't invalidate it
+    """
+
+    hosts = [
+        {field: host.get(field) for field in INVENTORY_HOST_FIELDS}
+        for host in assemble_all_tailscale_hosts(ts_status)
+    ]
+    hosts.sort(key=lambda host: str(host["HostName"]))
+    payload = json.dumps({"self": ts_status["Self"]["HostName"], "hosts": hosts}, sort_keys=True)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def cache_path() -> Path:
+    """
+    Returns the location of the inventory cache file
+    """
+
+    return Path(os.environ.get(CACHE_PATH_ENV_VAR) or DEFAULT_CACHE_PATH)
+
+
+def cache_ttl() -> float:
+    """
+    Returns the number of seconds a cached inventory is used without asking tailscale
+    """
+
+    try:
+        return float(os.environ.get(CACHE_TTL_ENV_VAR, DEFAULT_CACHE_TTL))
+    except ValueError:
+        return DEFAULT_CACHE_TTL
+
+
+def load_cache() -> dict[str, Any] | None:
+    """
+    Returns the cached inventory document, or None if there is no usable cache
+    """
+
+    try:
+        with cache_path().open(encoding="utf-8") as f:
+            cached: dict[str, Any] = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if not isinstance(cached, dict) or "inventory" not in cached:
+        return None
+    return cached
+
+
+def save_cache(fingerprint: str, ansible_inventory: ansible_inventory_type) -> None:
+    """
+    Atomically writes the inventory and the status fingerprint it was built from.
+    Failing to write the cache is not an error, the next run just rebuilds it
+    """
+
+    path = cache_path()
+    document = {"created": time.time(), "fingerprint": fingerprint, "inventory": ansible_inventory}
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+    except OSError:
+        return
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(document, f)
+        Path(tmp_path).replace(path)
+    except OSError:
+        with contextlib.suppress(OSError):
+            Path(tmp_path).unlink()
+
+
+def is_fresh(cached: dict[str, Any] | None) -> bool:
+    """
+    Returns True if the cached inventory is younger than the cache TTL
+    """
+
+    if cached is None:
+        return False
+    age = time.time() - float(cached.get("created", 0))
+    return 0 <= age < cache_ttl()
+
+
 def format_ansible_inventory(inventory: InventoryType) -> ansible_inventory_type:
     """
     Given an inventory object, returns the inventory formatted to be read by ansible
@@ -239,13 +340,51 @@ def tailscale_status_to_ansible_inventory(
     return format_ansible_inventory(inventory)
 
 
+def get_ansible_inventory(refresh: bool = False) -> ansible_inventory_type:
+    """
+    Returns the ansible inventory, from the cache while it is fresh. Otherwise
+    tailscale is asked for its status, and the inventory is only re-assembled
+    when the hosts in it actually changed
+    """
+
+    cached = load_cache()
+    if not refresh and cached is not None and is_fresh(cached):
+        return cached["inventory"]  # type: ignore[no-any-return]
+
+    ts_status = get_tailscale_status()
+    fingerprint = status_fingerprint(ts_status)
+    if cached is not None and cached.get("fingerprint") == fingerprint:
+        ansible_inventory: ansible_inventory_type = cached["inventory"]
+    else:
+        ansible_inventory = tailscale_status_to_ansible_inventory(ts_status)
+    save_cache(fingerprint, ansible_inventory)
+    return ansible_inventory
+
+
+def parse_args(argv: list[str] | None = None) -> argparse.Namespace:
+    """
+    Parses the arguments ansible passes to inventory scripts
+    """
+
+    parser = argparse.ArgumentParser(description="Ansible dynamic inventory of the tailnet")
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument("--list", action="store_true", help="print the whole inventory (default)")
+    group.add_argument("--host", help="print the hostvars of a single host")
+    parser.add_argument("--refresh", action="store_true", help="ignore the cache and ask tailscale")
+    return parser.parse_args(argv)
+
+
 def main() -> None:
     """
     This is the main function run when the script is executed
     """
 
-    ts_status = get_tailscale_status()
-    ansible_inventory = tailscale_status_to_ansible_inventory(ts_status)
+    args = parse_args()
+    ansible_inventory = get_ansible_inventory(refresh=args.refresh)
+    if args.host is not None:
+        hostvars = ansible_inventory["_meta"]["hostvars"]
+        print(json.dumps(hostvars.get(args.host, {}), indent=2, sort_keys=True))
+        return
     print(json.dumps(ansible_inventory, indent=2, sort_keys=True))
 
 
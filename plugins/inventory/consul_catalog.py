@@ -0,0 +1,231 @@
+# Copyright (c) George Bolo <gbolo@linuxctl.com>
+# SPDX-License-Identifier: MIT
+
+
+import os
+import runpy
+
+from ansible.errors import AnsibleParserError
+from ansible.plugins.inventory import BaseInventoryPlugin, Cacheable, Constructable
+
+# module_utils/loader.py loads the module_utils under private names, without touching sys.path
+cache, consul, parallel = runpy.run_path(
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "module_utils", "loader.py")
+)["load_all"]("cache", "consul", "parallel")
+
+DOCUMENTATION = r"""
+name: consul_catalog
+short_description: Consul catalog inventory source
+description:
+  - Builds an inventory of the Consul catalog nodes, grouped by the services they run, the service tags,
+    the node meta and the health state of the nodes and their services.
+  - A refresh reads the nodes and the health checks of the catalog, two requests whatever the size of the
+    catalog. The services of a node are the ones its health checks belong to, Consul has no documented
+    endpoint that lists the service instances of all nodes at once. A service instance without a health
+    check does not show up, and the port and meta of the services are not known.
+  - Both responses are kept in C(ANSIBLE_API_CACHE_DIR) and revalidated with a blocking query, so a
+    refresh of an unchanged catalog only costs two short requests. On top of that, the inventory cache
+    can skip the requests entirely for I(cache_timeout) seconds.
+  - The inventory file name must end with C(consul.yml), C(consul.yaml), C(consul_catalog.yml) or
+    C(consul_catalog.yaml).
+extends_documentation_fragment:
+  - constructed
+  - inventory_cache
+options:
+  plugin:
+    description: Marks the file as a consul_catalog inventory source.
+    required: true
+    choices: ["consul_catalog"]
+  url:
+    description: The Consul HTTP API address.
+    default: http://127.0.0.1:8500
+    env:
+      - name: CONSUL_HTTP_ADDR
+  token:
+    description: The Consul ACL token, needs node:read and service:read.
+    env:
+      - name: CONSUL_HTTP_TOKEN
+  validate_certs:
+    type: bool
+    default: true
+  connection_timeout:
+    type: int
+    default: 10
+  datacenter:
+    description: The datacenter to read, defaults to the datacenter of the agent at I(url).
+    default: ""
+  filter:
+    description: A Consul filter expression applied to the nodes, e.g. C(Meta.role == "client").
+    default: ""
+  group_by:
+    description: The groups to build.
+    type: list
+    elements: str
+    default: ["service", "tag", "node_meta", "health"]
+    choices: ["service", "tag", "node_meta", "health"]
+  revalidate:
+    description: Keep the last responses on disk and revalidate them with blocking queries.
+    type: bool
+    default: true
+  wait:
+    description: How long a blocking query waits for a change before the cached response is used.
+    default: 10ms
+"""
+
+EXAMPLES = r"""
+# inventory/dynamic/consul.yml
+plugin: consul_catalog
+url: https://consul.service.consul:8501
+group_by: [service, health]
+keyed_groups:
+  - key: consul_node_meta.role | default('none')
+    prefix: role
+"""
+
+# the worst status of a node or service wins
+HEALTH_ORDER = ["passing", "warning", "critical"]
+
+
+def health(checks):
+    """returns the worst status of checks, nodes and services without checks are passing"""
+    worst = 0
+    for check in checks:
+        status = check.get("Status")
+        worst = max(worst, HEALTH_ORDER.index(status) if status in HEALTH_ORDER else len(HEALTH_ORDER) - 1)
+    return HEALTH_ORDER[worst]
+
+
+class InventoryModule(BaseInventoryPlugin, Constructable, Cacheable):
+    """InventoryModule builds the inventory from the consul catalog"""
+
+    NAME = "consul_catalog"
+
+    def verify_file(self, path):
+        return super().verify_file(path) and path.endswith(
+            ("consul.yml", "consul.yaml", "consul_catalog.yml", "consul_catalog.yaml")
+        )
+
+    def parse(self, inventory, loader, path, cache=True):
+        super().parse(inventory, loader, path, cache)
+        self._read_config_data(path)
+
+        cache_key = self.get_cache_key(path)
+        use_cache = self.get_option("cache") and cache
+        update_cache = self.get_option("cache") and not cache
+
+        nodes = None
+        if use_cache:
+            try:
+                nodes = self._cache[cache_key]
+            except KeyError:
+                update_cache = True
+        if nodes is None:
+            nodes = self.fetch_nodes()
+        if update_cache:
+            self._cache[cache_key] = nodes
+
+        self.populate(nodes)
+
+    def module_params(self):
+        return {
+            "url": self.get_option("url").rstrip("/"),
+            "management_token": self.get_option("token"),
+            "validate_certs": self.get_option("validate_certs"),
+            "connection_timeout": self.get_option("connection_timeout"),
+        }
+
+    def fetch_nodes(self):
+        """returns the catalog nodes, each with the services and health checks of its checks"""
+        datacenter = self.get_option("datacenter")
+        api = consul.ConsulAPI(parallel.ModuleShim(self.module_params()))
+        api.read_cache = cache.ReadCache(
+            "consul-inventory",
+            self.get_option("token"),
+            enabled=self.get_option("revalidate"),
+            wait=self.get_option("wait"),
+        )
+        try:
+            nodes = api.get_catalog_nodes(datacenter, self.get_option("filter")) or []
+            checks = api.get_health_state(datacenter) or []
+        except parallel.APIError as e:
+            raise AnsibleParserError(f"could not read the consul catalog: {e.msg}") from e
+
+        checks_by_node = {}
+        services_by_node = {}
+        for check in checks:
+            checks_by_node.setdefault(check.get("Node"), []).append(check)
+            if check.get("ServiceID"):
+                services_by_node.setdefault(check.get("Node"), {})[check["ServiceID"]] = {
+                    "ID": check["ServiceID"],
+                    "Service": check.get("ServiceName"),
+                    "Tags": check.get("ServiceTags"),
+                }
+
+        return [
+            {
+                "Node": node["Node"],
+                "Address": node.get("Address"),
+                "Datacenter": node.get("Datacenter"),
+                "TaggedAddresses": node.get("TaggedAddresses"),
+                "Meta": node.get("Meta"),
+                "Services": list(services_by_node.get(node["Node"], {}).values()),
+                "Checks": checks_by_node.get(node["Node"], []),
+            }
+            for node in nodes
+        ]
+
+    def add_to_group(self, group, host):
+        group = self.inventory.add_group(self._sanitize_group_name(group))
+        self.inventory.add_host(host, group=group)
+
+    def populate(self, nodes):
+        group_by = self.get_option("group_by")
+        strict = self.get_option("strict")
+
+        for node in nodes:
+            host = self.inventory.add_host(node["Node"])
+            checks = node.get("Checks") or []
+            node_checks = [c for c in checks if not c.get("ServiceID")]
+
+            services = []
+            for service in node.get("Services") or []:
+                service_checks = node_checks + [c for c in checks if c.get("ServiceID") == service["ID"]]
+                services.append(
+                    {
+                        "id": service["ID"],
+                        "name": service["Service"],
+                        "tags": service.get("Tags") or [],
+                        "health": health(service_checks),
+                    }
+                )
+
+            hostvars = {
+                "ansible_host": node.get("Address"),
+                "consul_node": node["Node"],
+                "consul_address": node.get("Address"),
+                "consul_datacenter": node.get("Datacenter"),
+                "consul_tagged_addresses": node.get("TaggedAddresses") or {},
+                "consul_node_meta": node.get("Meta") or {},
+                "consul_health": health(node_checks),
+                "consul_services": services,
+            }
+            for name, value in hostvars.items():
+                self.inventory.set_variable(host, name, value)
+
+            if "service" in group_by:
+                for service in services:
+                    self.add_to_group(f"service_{service['name']}", host)
+            if "tag" in group_by:
+                for tag in {tag for service in services for tag in service["tags"]}:
+                    self.add_to_group(f"tag_{tag}", host)
+            if "node_meta" in group_by:
+                for key, value in hostvars["consul_node_meta"].items():
+                    self.add_to_group(f"meta_{key}_{value}", host)
+            if "health" in group_by:
+                self.add_to_group(f"health_{hostvars['consul_health']}", host)
+                for service in services:
+                    self.add_to_group(f"service_{service['name']}_{service['health']}", host)
+
+            self._set_composite_vars(self.get_option("compose"), hostvars, host, strict=strict)
+            self._add_host_to_composed_groups(self.get_option("groups"), hostvars, host, strict=strict)
+            self._add_host_to_keyed_groups(self.get_option("keyed_groups"), hostvars, host, strict=strict)
@@ -0,0 +1,218 @@
+# Copyright (c) George Bolo <gbolo@linuxctl.com>
+# SPDX-License-Identifier: MIT
+
+
+import asyncio
+import os
+import runpy
+
+from ansible.errors import AnsibleParserError
+from ansible.plugins.inventory import BaseInventoryPlugin, Cacheable, Constructable
+
+# module_utils/loader.py loads the module_utils under private names, without touching sys.path
+aio, cache, nomad, parallel = runpy.run_path(
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "module_utils", "loader.py")
+)["load_all"]("aio", "cache", "nomad", "parallel")
+
+DOCUMENTATION = r"""
+name: nomad_nodes
+short_description: Nomad client node inventory source
+description:
+  - Builds an inventory of the Nomad client nodes, grouped by datacenter, node class, node pool, status,
+    scheduling eligibility, drain state and healthy task drivers.
+  - The node list is read in one request. The details of the nodes (attributes, meta, drivers) are kept
+    in C(ANSIBLE_API_CACHE_DIR) and only fetched again, concurrently, for the nodes whose ModifyIndex moved.
+    The node list itself is revalidated with a blocking query.
+  - On top of that, the inventory cache can skip the requests entirely for I(cache_timeout) seconds.
+  - The inventory file name must end with C(nomad.yml), C(nomad.yaml), C(nomad_nodes.yml) or
+    C(nomad_nodes.yaml).
+extends_documentation_fragment:
+  - constructed
+  - inventory_cache
+options:
+  plugin:
+    description: Marks the file as a nomad_nodes inventory source.
+    required: true
+    choices: ["nomad_nodes"]
+  url:
+    description: The Nomad HTTP API address.
+    default: http://127.0.0.1:4646
+    env:
+      - name: NOMAD_ADDR
+  token:
+    description: The Nomad ACL token, needs node:read.
+    env:
+      - name: NOMAD_TOKEN
+  validate_certs:
+    type: bool
+    default: true
+  connection_timeout:
+    type: int
+    default: 10
+  max_workers:
+    description: How many node details are fetched at once.
+    type: int
+    default: 8
+  group_by:
+    description: The groups to build.
+    type: list
+    elements: str
+    default: ["datacenter", "node_class", "node_pool", "status", "eligibility", "drain", "driver"]
+    choices: ["datacenter", "node_class", "node_pool", "status", "eligibility", "drain", "driver"]
+  revalidate:
+    description: Revalidate the node list with a blocking query instead of reading it again.
+    type: bool
+    default: true
+  wait:
+    description: How long the blocking query waits for a change before the cached node list is used.
+    default: 10ms
+"""
+
+EXAMPLES = r"""
+# inventory/dynamic/nomad.yml
+plugin: nomad_nodes
+url: https://nomad.service.consul:4646
+group_by: [datacenter, node_class, eligibility]
+keyed_groups:
+  - key: nomad_meta.rack | default('none')
+    prefix: rack
+"""
+
+# the parts of the node details kept in the cache and exposed as host vars
+NODE_DETAIL_FIELDS = ["HTTPAddr", "Attributes", "Meta", "Drivers", "DrainStrategy"]
+
+
+class InventoryModule(BaseInventoryPlugin, Constructable, Cacheable):
+    """InventoryModule builds the inventory from the nomad client nodes"""
+
+    NAME = "nomad_nodes"
+
+    def verify_file(self, path):
+        return super().verify_file(path) and path.endswith(
+            ("nomad.yml", "nomad.yaml", "nomad_nodes.yml", "nomad_nodes.yaml")
+        )
+
+    def parse(self, inventory, loader, path, cache=True):
+        super().parse(inventory, loader, path, cache)
+        self._read_config_data(path)
+
+        cache_key = self.get_cache_key(path)
+        use_cache = self.get_option("cache") and cache
+        update_cache = self.get_option("cache") and not cache
+
+        nodes = None
+        if use_cache:
+            try:
+                nodes = self._cache[cache_key]
+            except KeyError:
+                update_cache = True
+        if nodes is None:
+            nodes = self.fetch_nodes()
+        if update_cache:
+            self._cache[cache_key] = nodes
+
+        self.populate(nodes)
+
+    def module_params(self):
+        return {
+            "url": self.get_option("url").rstrip("/"),
+            "management_token": self.get_option("token"),
+            "validate_certs": self.get_option("validate_certs"),
+            "connection_timeout": self.get_option("connection_timeout"),
+            "namespace": "default",
+        }
+
+    def fetch_nodes(self):
+        """returns the node stubs merged with their (cached or fetched) details"""
+        params = self.module_params()
+        api = nomad.NomadAPI(parallel.ModuleShim(params))
+        api.read_cache = cache.ReadCache(
+            "nomad-inventory",
+            params["management_token"],
+            enabled=self.get_option("revalidate"),
+            wait=self.get_option("wait"),
+        )
+        try:
+            stubs = api.get_nodes() or []
+        except parallel.APIError as e:
+            raise AnsibleParserError(f"could not list the nomad nodes: {e.msg}") from e
+
+        # node details by node ID, each with the ModifyIndex of the stub it was fetched for
+        details_cache = cache.FileCache("nomad-inventory-nodes", (params["management_token"] or "") + params["url"])
+        details = details_cache.load() or {}
+        stale = [stub["ID"] for stub in stubs if details.get(stub["ID"], {}).get("ModifyIndex") != stub["ModifyIndex"]]
+
+        async def fetch():
+            async with aio.AsyncNomadAPI(params, max_concurrency=self.get_option("max_workers")) as api:
+                return await api.map("get_node", stale)
+
+        for outcome in asyncio.run(fetch()) if stale else []:
+            if outcome.failed or outcome.result is None:
+                self.display.warning(f"could not read nomad node {outcome.item}: {outcome.error or 'not found'}")
+                details.pop(outcome.item, None)
+                continue
+            node = outcome.result
+            details[outcome.item] = dict({k: node.get(k) for k in NODE_DETAIL_FIELDS}, ModifyIndex=node["ModifyIndex"])
+
+        # drop the nodes that were garbage collected
+        details = {stub["ID"]: details[stub["ID"]] for stub in stubs if stub["ID"] in details}
+        if stale:
+            details_cache.save(details)
+
+        return [{**stub, **details.get(stub["ID"], {}), "ModifyIndex": stub["ModifyIndex"]} for stub in stubs]
+
+    def add_to_group(self, group, host):
+        group = self.inventory.add_group(self._sanitize_group_name(group))
+        self.inventory.add_host(host, group=group)
+
+    def populate(self, nodes):
+        group_by = self.get_option("group_by")
+        strict = self.get_option("strict")
+
+        for node in nodes:
+            host = self.inventory.add_host(node["Name"])
+            drivers = sorted(
+                name
+                for name, driver in (node.get("Drivers") or {}).items()
+                if driver.get("Detected") and driver.get("Healthy")
+            )
+            address = node.get("Address") or (node.get("HTTPAddr") or "").rsplit(":", 1)[0]
+
+            hostvars = {
+                "ansible_host": address,
+                "nomad_node_id": node["ID"],
+                "nomad_address": address,
+                "nomad_datacenter": node.get("Datacenter"),
+                "nomad_node_class": node.get("NodeClass") or "",
+                "nomad_node_pool": node.get("NodePool") or "",
+                "nomad_status": node.get("Status"),
+                "nomad_eligibility": node.get("SchedulingEligibility"),
+                "nomad_drain": bool(node.get("Drain")),
+                "nomad_drain_strategy": node.get("DrainStrategy"),
+                "nomad_drivers": drivers,
+                "nomad_version": node.get("Version"),
+                "nomad_attributes": node.get("Attributes") or {},
+                "nomad_meta": node.get("Meta") or {},
+            }
+            for name, value in hostvars.items():
+                self.inventory.set_variable(host, name, value)
+
+            if "datacenter" in group_by and hostvars["nomad_datacenter"]:
+                self.add_to_group(f"dc_{hostvars['nomad_datacenter']}", host)
+            if "node_class" in group_by and hostvars["nomad_node_class"]:
+                self.add_to_group(f"class_{hostvars['nomad_node_class']}", host)
+            if "node_pool" in group_by and hostvars["nomad_node_pool"]:
+                self.add_to_group(f"pool_{hostvars['nomad_node_pool']}", host)
+            if "status" in group_by and hostvars["nomad_status"]:
+                self.add_to_group(f"status_{hostvars['nomad_status']}", host)
+            if "eligibility" in group_by and hostvars["nomad_eligibility"]:
+                self.add_to_group(hostvars["nomad_eligibility"], host)
+            if "drain" in group_by and hostvars["nomad_drain"]:
+                self.add_to_group("draining", host)
+            if "driver" in group_by:
+                for driver in drivers:
+                    self.add_to_group(f"driver_{driver}", host)
+
+            self._set_composite_vars(self.get_option("compose"), hostvars, host, strict=strict)
+            self._add_host_to_composed_groups(self.get_option("groups"), hostvars, host, strict=strict)
+            self._add_host_to_keyed_groups(self.get_option("keyed_groups"), hostvars, host, strict=strict)
@@ -0,0 +1,112 @@
+# Copyright (c) George Bolo <gbolo@linuxctl.com>
+# SPDX-License-Identifier: MIT
+
+
+import asyncio
+import functools
+import inspect
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import consul
+import nomad
+import parallel
+
+#
+# asyncio variants of NomadAPI and ConsulAPI for code that runs on the control
+# node (action, lookup and inventory plugins) and wants to fetch hundreds of
+# objects at once. They have the same methods as the sync classes, as
+# coroutines, the ones that return generators (iter_list, ...) return lists:
+#
+#   async with AsyncNomadAPI({"url": ..., "management_token": ...}) as api:
+#       jobs = await asyncio.gather(*(api.get_job(id) for id in ids))
+#
+# The calls run on a bounded thread pool, each worker thread with its own API
+# object (they keep per request state like last_index), all sharing the
+# pooled connections of transport.get_transport(). Errors are raised as
+# parallel.APIError. Plugins load this file with module_utils/loader.py, like
+# the nomad_nodes inventory does to fetch the details of its nodes.
+#
+
+DEFAULT_PARAMS = {
+    "validate_certs": True,
+    "connection_timeout": 10,
+    "namespace": "default",
+}
+
+
+class AsyncAPI:
+    """AsyncAPI exposes the methods of api_class as coroutines"""
+
+    api_class = None
+
+    def __init__(self, params, max_concurrency=parallel.DEFAULT_MAX_WORKERS):
+        self.params = dict(DEFAULT_PARAMS, **params)
+        self.max_concurrency = max_concurrency
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency)
+        self._local = threading.local()
+
+    def _api(self):
+        api = getattr(self._local, "api", None)
+        if api is None:
+            api = self.api_class(parallel.ModuleShim(self.params))
+            self._local.api = api
+        return api
+
+    def _call(self, name, args, kwargs):
+        result = getattr(self._api(), name)(*args, **kwargs)
+        # methods like iter_list return generators, which would do their requests on the event loop
+        if inspect.isgenerator(result):
+            return list(result)
+        return result
+
+    def __getattr__(self, name):
+        method = getattr(self.api_class, name, None)
+        if name.startswith("_") or not callable(method):
+            raise AttributeError(f"{type(self).__name__} has no method {name}")
+
+        @functools.wraps(method)
+        async def call(*args, **kwargs):
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._executor, self._call, name, args, kwargs)
+
+        return call
+
+    async def map(self, name, items):
+        """
+        Calls the method name(item) for every item concurrently.
+        Returns a list of parallel.Outcome in the same order as items.
+        """
+
+        async def call(item):
+            start = time.monotonic()
+            try:
+                result = await getattr(self, name)(item)
+                return parallel.Outcome(item, result=result, elapsed=time.monotonic() - start)
+            except parallel.APIError as e:
+                return parallel.Outcome(item, error=e.msg, elapsed=time.monotonic() - start)
+
+        return await asyncio.gather(*(call(item) for item in items))
+
+    async def close(self):
+        """waits for the running calls without blocking the event loop"""
+        await asyncio.get_running_loop().run_in_executor(None, self._executor.shutdown)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+
+class AsyncNomadAPI(AsyncAPI):
+    """AsyncNomadAPI is the asyncio variant of NomadAPI"""
+
+    api_class = nomad.NomadAPI
+
+
+class AsyncConsulAPI(AsyncAPI):
+    """AsyncConsulAPI is the asyncio variant of ConsulAPI"""
+
+    api_class = consul.ConsulAPI
@@ -0,0 +1,168 @@
+# Copyright (c) George Bolo <gbolo@linuxctl.com>
+# SPDX-License-Identifier: MIT
+
+
+import contextlib
+import hashlib
+import json
+import os
+import stat
+import tempfile
+
+#
+# Every module invocation is a fresh process, so anything worth remembering
+# between tasks (or playbook runs) has to live on disk. The cache is kept on
+# the host that runs the module, which for these API modules usually is the
+# control node. It is best effort: a missing, corrupt or unwritable cache
+# file simply behaves like an empty cache.
+#
+# The modules act on what they find in the cache (e.g. skip a job
+# registration), so it lives in the user's cache directory and a directory
+# that is not owned by the user, or that the group or others can access, is
+# never used.
+#
+# Set ANSIBLE_API_CACHE_DIR to move the cache, or to an empty string to
+# disable it entirely:
+#
+# - name: create nomad acl token
+#   nomad_acl_token:
+#     ...
+#   environment:
+#     ANSIBLE_API_CACHE_DIR: /var/cache/ansible-api
+#
+
+ENV_VAR = "ANSIBLE_API_CACHE_DIR"
+DEFAULT_CACHE_DIR = os.path.join(
+    os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache"),
+    "ansible-api-cache",
+)
+
+
+def cache_dir():
+    return os.environ.get(ENV_VAR, DEFAULT_CACHE_DIR)
+
+
+def private_dir(path):
+    """returns True if path is a directory (not a symlink) owned by the current user, without group or other access"""
+    try:
+        st = os.lstat(path)
+    except OSError:
+        return False
+    return stat.S_ISDIR(st.st_mode) and st.st_uid == os.getuid() and st.st_mode & 0o077 == 0
+
+
+class FileCache:
+    """FileCache persists a single json document, identified by a namespace and a key"""
+
+    def __init__(self, namespace, key):
+        directory = cache_dir()
+        self.enabled = bool(directory)
+        self.root = directory
+        self.path = None
+        if self.enabled:
+            digest = hashlib.sha256(key.encode("utf-8")).hexdigest()
+            self.path = os.path.join(directory, namespace, f"{digest}.json")
+
+    def trusted(self):
+        """returns True if both the cache directory and the namespace directory in it are private to the user"""
+        return private_dir(self.root) and private_dir(os.path.dirname(self.path))
+
+    def load(self):
+        if not self.enabled or not self.trusted():
+            return None
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def save(self, data):
+        if not self.enabled:
+            return
+        directory = os.path.dirname(self.path)
+        try:
+            # makedirs only applies mode to the last directory it creates
+            os.makedirs(self.root, mode=0o700, exist_ok=True)
+            os.makedirs(directory, mode=0o700, exist_ok=True)
+        except OSError:
+            return
+        if not self.trusted():
+            return
+        try:
+            fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        except OSError:
+            return
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(data, f)
+            os.replace(tmp_path, self.path)
+        except (OSError, TypeError, ValueError):
+            with contextlib.suppress(OSError):
+                os.remove(tmp_path)
+
+    def clear(self):
+        if not self.enabled:
+            return
+        try:
+            os.remove(self.path)
+        except OSError:
+            return
+
+
+#
+# The read cache keeps the last body and index of GET requests on disk and
+# revalidates them with a blocking query (?index=<last index>&wait=<wait>).
+# When nothing changed, the server answers with the same index once the short
+# wait expires and the cached object is returned without decoding the body
+# again. Since it stores response bodies, it is opt-in:
+#
+#   environment:
+#     ANSIBLE_API_READ_CACHE_ENABLED: true
+#     ANSIBLE_API_READ_CACHE_WAIT: 10ms
+#
+
+READ_CACHE_ENV_VAR = "ANSIBLE_API_READ_CACHE_ENABLED"
+READ_CACHE_WAIT_ENV_VAR = "ANSIBLE_API_READ_CACHE_WAIT"
+DEFAULT_READ_CACHE_WAIT = "10ms"
+
+
+class ReadCache:
+    """ReadCache revalidates cached GET responses with blocking queries"""
+
+    def __init__(self, namespace, token, enabled=None, wait=None):
+        """enabled and wait default to the environment variables above"""
+        self.namespace = namespace
+        self.token = token or ""
+        if enabled is None:
+            enabled = os.environ.get(READ_CACHE_ENV_VAR, "").lower() in ["yes", "true"]
+        self.enabled = bool(cache_dir()) and enabled
+        self.wait = wait or os.environ.get(READ_CACHE_WAIT_ENV_VAR, DEFAULT_READ_CACHE_WAIT)
+
+    def get(self, url, fetch):
+        """
+        Returns the decoded json object at url.
+        fetch(url) must return a tuple of (raw response body or None, response index).
+        Raises ValueError if the response body is not valid json.
+        """
+        if not self.enabled:
+            body, _ = fetch(url)
+            return None if body is None else json.loads(body)
+
+        entry = FileCache(self.namespace, self.token + url)
+        cached = entry.load()
+        if cached is not None and cached.get("index") is not None:
+            separator = "&" if "?" in url else "?"
+            body, index = fetch(f"{url}{separator}index={cached['index']}&wait={self.wait}")
+            if body is not None and index == cached["index"]:
+                return cached["body"]
+        else:
+            body, index = fetch(url)
+
+        if body is None:
+            entry.clear()
+            return None
+
+        data = json.loads(body)
+        if index is not None:
+            entry.save({"index": index, "body": data})
+        return data
@@ -3,12 +3,17 @@
 
 
 import json
+import time
+from http.client import HTTPException
 
+import cache
 import debug
+import retry
+import transport
+import utils
 from ansible.module_utils.common.text.converters import to_native
 from ansible.module_utils.six.moves.urllib.error import HTTPError
-from ansible.module_utils.six.moves.urllib.parse import quote_plus
-from ansible.module_utils.urls import open_url
+from ansible.module_utils.six.moves.urllib.parse import quote, quote_plus, urlencode
 
 URL_ACL_POLICIES = "{url}/v1/acl/policies"
 URL_ACL_POLICY_ID = "{url}/v1/acl/policy/{id}"
@@ -19,8 +24,32 @@ URL_ACL_TOKENS = "{url}/v1/acl/tokens"
 URL_ACL_TOKEN = "{url}/v1/acl/token"
 URL_ACL_TOKEN_ID = "{url}/v1/acl/token/{id}"
 URL_ACL_TOKEN_SELF = "{url}/v1/acl/token/self"
+URL_CONNECT_INTENTIONS = "{url}/v1/connect/intentions"
 URL_CONNECT_INTENTION = "{url}/v1/connect/intentions/exact?source={src}&destination={dst}"
 URL_SERVICE_NAME = "{url}/v1/catalog/service/{name}"
+URL_HEALTH_SERVICE = "{url}/v1/health/service/{name}"
+URL_CATALOG_NODES = "{url}/v1/catalog/nodes?dc={dc}&filter={filter}"
+URL_HEALTH_STATE = "{url}/v1/health/state/any?dc={dc}"
+URL_KV = "{url}/v1/kv/{key}"
+URL_KV_RECURSE = "{url}/v1/kv/{key}?recurse=true"
+URL_KV_CAS = "{url}/v1/kv/{key}?cas={cas}"
+URL_TXN = "{url}/v1/txn"
+
+INDEX_HEADER = "X-Consul-Index"
+
+# consul caps the wait of a blocking query at 10 minutes
+MAX_BLOCKING_WAIT = 600
+
+# the delay between two reads of a watch that has no index to block on, e.g.
+# when a proxy in front of consul drops the X-Consul-Index header
+UNBLOCKED_POLL_INTERVAL = 1
+
+# consul rejects transactions with more operations, or a larger body, than this
+TXN_MAX_OPS = 64
+TXN_MAX_BYTES = 512 * 1024
+
+# maps request urls back to the URL_* templates above for the request metrics
+endpoint_template = debug.endpoint_matcher([v for k, v in list(globals().items()) if k.startswith("URL_")])
 
 
 class ConsulAPI:
@@ -28,15 +57,26 @@ class ConsulAPI:
 
     def __init__(self, module):
         self.module = module
-        self.url = self.module.params.get("url")
+        # url may be a comma separated list of servers, see retry.Endpoints
+        self.endpoints = retry.Endpoints(self.module.params.get("url"))
+        self.url = self.endpoints.current
         self.management_token = self.module.params.get("management_token")
         self.validate_certs = self.module.params.get("validate_certs")
         self.connection_timeout = self.module.params.get("connection_timeout")
+        self.transport = retry.RetryingTransport(
+            transport.get_transport(self.validate_certs),
+            self.endpoints,
+            endpoint=endpoint_template,
+        )
+        debug.attach_metrics(self.module)
         self.headers = {
             "Content-Type": "application/json",
             "X-Consul-Token": self.management_token,
             "User-Agent": "ansible-module-consul",
         }
+        # the X-Consul-Index of the last successful request
+        self.last_index = None
+        self.read_cache = cache.ReadCache("consul-reads", self.management_token)
 
     def api_request(
         self,
@@ -46,21 +86,40 @@ class ConsulAPI:
         body=None,
         json_response=True,
         ignore_codes=None,
+        accept_codes=None,
+        timeout=None,
     ):
+        """
+        ignore_codes: error status codes for which None is returned
+        accept_codes: error status codes for which the response is returned like a successful one
+        timeout: socket timeout in seconds, connection_timeout by default
+        """
         if ignore_codes is None:
             ignore_codes = []
+        if accept_codes is None:
+            accept_codes = []
         if headers is None:
             headers = self.headers
+        start = time.monotonic()
         try:
-            response = open_url(
-                url=url,
-                method=method,
-                data=body,
+            response = self.transport.request(
+                url,
+                method,
+                body=body,
                 headers=headers,
-                timeout=self.connection_timeout,
-                validate_certs=self.validate_certs,
+                timeout=timeout or self.connection_timeout,
+            )
+            response_bytes = response.read()
+            debug.log_metrics(
+                method,
+                url,
+                response.getcode(),
+                body,
+                len(response_bytes),
+                time.monotonic() - start,
+                endpoint=endpoint_template,
             )
-            response_body = response.read().decode("utf-8")
+            response_body = response_bytes.decode("utf-8")
             debug.log_request(
                 self.module,
                 url,
@@ -69,6 +128,7 @@ class ConsulAPI:
                 response.getcode(),
                 response_body,
             )
+            self.last_index = parse_index(response.headers)
             if json_response:
                 try:
                     return json.loads(to_native(response_body))
@@ -77,7 +137,17 @@ class ConsulAPI:
             return response_body
 
         except HTTPError as e:
-            response_body = e.read().decode("utf-8")
+            response_bytes = e.read()
+            debug.log_metrics(
+                method,
+                url,
+                e.code,
+                body,
+                len(response_bytes),
+                time.monotonic() - start,
+                endpoint=endpoint_template,
+            )
+            response_body = response_bytes.decode("utf-8")
             debug.log_request(
                 self.module,
                 url,
@@ -88,6 +158,13 @@ class ConsulAPI:
             )
             if e.code in ignore_codes:
                 return None
+            if e.code in accept_codes:
+                if json_response:
+                    try:
+                        return json.loads(to_native(response_body))
+                    except ValueError as e:
+                        self.module.fail_json(msg=f"API returned invalid JSON: {str(e)}")
+                return response_body
 
             if e.code == 401 or e.code == 403:
                 self.module.fail_json(msg=f"Not Authorized: status={e.code} [{method}] {url} ->\n{response_body}")
@@ -95,9 +172,79 @@ class ConsulAPI:
             self.module.fail_json(msg=f"Error: status={e.code} [{method}] {url} ->\n{response_body}")
 
         except Exception as e:
+            debug.log_metrics(method, url, None, body, 0, time.monotonic() - start, endpoint=endpoint_template)
             print("here")
             self.module.fail_json(msg=f"Could not make API call: [{method}] {url} ->\n{str(e)}")
 
+    def cached_get(self, url, ignore_codes=None):
+        """GET url as json, revalidating a locally cached copy with a blocking query (see cache.ReadCache)"""
+
+        def fetch(request_url):
+            body = self.api_request(
+                url=request_url,
+                method="GET",
+                json_response=False,
+                ignore_codes=ignore_codes,
+            )
+            return body, self.last_index
+
+        try:
+            return self.read_cache.get(url, fetch)
+        except ValueError as e:
+            self.module.fail_json(msg=f"API returned invalid JSON: {str(e)}")
+
+    def iter_list(self, url, ignore_codes=None):
+        """
+        Yields the items of the json list at url while the response is still being read,
+        so peak memory does not grow with the list. Stop iterating to skip the rest of it.
+        """
+        if ignore_codes is None:
+            ignore_codes = []
+        start = time.monotonic()
+        try:
+            response = self.transport.stream(url, "GET", headers=self.headers, timeout=self.connection_timeout)
+        except HTTPError as e:
+            response_bytes = e.read()
+            response_body = response_bytes.decode("utf-8")
+            debug.log_metrics(
+                "GET",
+                url,
+                e.code,
+                None,
+                len(response_bytes),
+                time.monotonic() - start,
+                endpoint=endpoint_template,
+            )
+            debug.log_request(self.module, url, "GET", None, e.code, response_body)
+            if e.code in ignore_codes:
+                return
+            if e.code == 401 or e.code == 403:
+                self.module.fail_json(msg=f"Not Authorized: status={e.code} [GET] {url} ->\n{response_body}")
+            self.module.fail_json(msg=f"Error: status={e.code} [GET] {url} ->\n{response_body}")
+        except Exception as e:
+            debug.log_metrics("GET", url, None, None, 0, time.monotonic() - start, endpoint=endpoint_template)
+            self.module.fail_json(msg=f"Could not make API call: [GET] {url} ->\n{str(e)}")
+
+        self.last_index = parse_index(response.headers)
+        try:
+            yield from utils.iter_json_list(response.read)
+        except ValueError as e:
+            self.module.fail_json(msg=f"API returned invalid JSON: {str(e)}")
+        except (HTTPException, OSError) as e:
+            self.module.fail_json(msg=f"Could not make API call: [GET] {url} ->\n{str(e)}")
+        finally:
+            response.close()
+            debug.log_metrics(
+                "GET",
+                url,
+                response.getcode(),
+                None,
+                response.bytes_read,
+                time.monotonic() - start,
+                endpoint=endpoint_template,
+            )
+            debug.log_request(self.module, url, "GET", None, response.getcode(), "<streamed list>")
+
     #
     # ACL Policies
     #
@@ -109,18 +256,14 @@ class ConsulAPI:
         )
 
     def get_acl_policy(self, policy_id):
-        return self.api_request(
-            url=URL_ACL_POLICY_ID.format(url=self.url, id=policy_id),
-            method="GET",
-            json_response=True,
+        return self.cached_get(
+            URL_ACL_POLICY_ID.format(url=self.url, id=policy_id),
             ignore_codes=[404],
         )
 
     def get_acl_policy_by_name(self, policy_name):
-        return self.api_request(
-            url=URL_ACL_POLICY_NAME.format(url=self.url, name=policy_name),
-            method="GET",
-            json_response=True,
+        return self.cached_get(
+            URL_ACL_POLICY_NAME.format(url=self.url, name=policy_name),
             ignore_codes=[404],
         )
 
@@ -148,6 +291,13 @@ class ConsulAPI:
             json_response=True,
         )
 
+    def acl_policy_cache(self):
+        """
+        returns the FileCache entry that maps policy names to the ModifyIndex they were
+        last written (or verified) at and the digest of the desired policy at that time
+        """
+        return cache.FileCache("consul-acl-policies", self.url)
+
     #
     # ACL Tokens
     #
@@ -163,11 +313,10 @@ class ConsulAPI:
         )
 
     def get_acl_tokens(self):
-        return self.api_request(
-            url=URL_ACL_TOKENS.format(url=self.url),
-            method="GET",
-            json_response=True,
-        )
+        return list(self.iter_acl_tokens())
+
+    def iter_acl_tokens(self):
+        return self.iter_list(URL_ACL_TOKENS.format(url=self.url))
 
     def get_acl_token(self, accessor_id):
         return self.api_request(
@@ -215,15 +364,16 @@ class ConsulAPI:
     #
     # CONNECT INTENTIONS
     #
+    def get_connect_intentions(self):
+        return list(self.iter_list(URL_CONNECT_INTENTIONS.format(url=self.url)))
+
     def get_connect_intention(self, source, destination):
-        return self.api_request(
-            url=URL_CONNECT_INTENTION.format(
+        return self.cached_get(
+            URL_CONNECT_INTENTION.format(
                 url=self.url,
                 src=quote_plus(source),
                 dst=quote_plus(destination),
             ),
-            method="GET",
-            json_response=True,
             ignore_codes=[404],
         )
 
@@ -255,11 +405,140 @@ class ConsulAPI:
     # Services
     #
     def get_service(self, name):
+        url = URL_SERVICE_NAME.format(url=self.url, name=name)
+        # the read cache needs the raw body, otherwise the list is streamed
+        if self.read_cache.enabled:
+            return self.cached_get(url)
+        return list(self.iter_list(url))
+
+    def iter_service(self, name):
+        return self.iter_list(URL_SERVICE_NAME.format(url=self.url, name=name))
+
+    def get_health_service(self, name, passing=True, index=None, wait=None):
+        """
+        Returns the instances of a service with their node and health checks, with passing
+        only the ones whose checks all pass. With an index this is a blocking query: it returns
+        once the X-Consul-Index moved past index, or after wait seconds. See last_index.
+        """
+        query = {}
+        if passing:
+            query["passing"] = "true"
+        timeout = None
+        if index:
+            query["index"] = index
+            query["wait"] = f"{int(wait * 1000)}ms"
+            # consul adds up to wait/16 of jitter to a blocking query
+            timeout = self.connection_timeout + wait + wait / 16
+        url = URL_HEALTH_SERVICE.format(url=self.url, name=quote(name, safe=""))
+        if query:
+            url = f"{url}?{urlencode(query)}"
+        return self.api_request(url=url, method="GET", timeout=timeout)
+
+    def wait_for_health_service(self, name, min_instances, deadline, passing=True, index=None):
+        """
+        Watches a service with blocking queries from index (a fresh read without one) until it
+        has at least min_instances instances, or until deadline, a time.monotonic() value.
+        Returns the instances last read and the number of requests it took.
+        """
+        instances = []
+        requests = 0
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 and requests:
+                break
+            if index:
+                wait = min(max(remaining, 0.001), MAX_BLOCKING_WAIT)
+                instances = self.get_health_service(name, passing=passing, index=index, wait=wait)
+            else:
+                if requests:
+                    time.sleep(min(UNBLOCKED_POLL_INTERVAL, max(remaining, 0)))
+                instances = self.get_health_service(name, passing=passing)
+            requests += 1
+            if len(instances) >= min_instances:
+                break
+            # an index that went backwards is reset, see the consul docs on blocking queries
+            index = self.last_index if (self.last_index or 0) >= (index or 0) else 0
+        return instances, requests
+
+    def get_catalog_nodes(self, datacenter="", node_filter=""):
+        """returns the nodes of the catalog (address, tagged addresses, meta), without their services"""
+        url = URL_CATALOG_NODES.format(url=self.url, dc=quote_plus(datacenter), filter=quote_plus(node_filter))
+        if self.read_cache.enabled:
+            return self.cached_get(url)
+        return list(self.iter_list(url))
+
+    def get_health_state(self, datacenter=""):
+        """returns every health check of the catalog with its node and service, node checks have no ServiceID"""
+        url = URL_HEALTH_STATE.format(url=self.url, dc=quote_plus(datacenter))
+        if self.read_cache.enabled:
+            return self.cached_get(url)
+        return list(self.iter_list(url))
+
+    #
+    # KV
+    #
+    def get_kv(self, key, recurse=False):
+        """returns the list of KV entries (with base64 encoded values) at key, or None"""
         return self.api_request(
-            url=URL_SERVICE_NAME.format(
-                url=self.url,
-                name=name,
-            ),
+            url=(URL_KV_RECURSE if recurse else URL_KV).format(url=self.url, key=quote(key)),
             method="GET",
             json_response=True,
+            ignore_codes=[404],
         )
+
+    def put_kv(self, key, value, cas=None):
+        """writes value (str or bytes) to key, returns False if the check-and-set index did not match"""
+        if cas is None:
+            url = URL_KV.format(url=self.url, key=quote(key))
+        else:
+            url = URL_KV_CAS.format(url=self.url, key=quote(key), cas=cas)
+        return self.api_request(
+            url=url,
+            method="PUT",
+            body=value,
+            json_response=True,
+        )
+
+    def delete_kv_tree(self, prefix):
+        return self.api_request(
+            url=URL_KV_RECURSE.format(url=self.url, key=quote(prefix)),
+            method="DELETE",
+            json_response=True,
+        )
+
+    def txn(self, ops):
+        """
+        Runs a transaction of at most TXN_MAX_OPS operations and returns the response,
+        with a non empty "Errors" list if it was rolled back.
+        """
+        return self.api_request(
+            url=URL_TXN.format(url=self.url),
+            method="PUT",
+            body=json.dumps(ops),
+            json_response=True,
+            accept_codes=[409],
+        )
+
+
+def chunk_txn_ops(ops):
+    """splits a list of transaction operations into chunks that fit into a single transaction"""
+    chunk = []
+    size = 2
+    for op in ops:
+        op_size = len(json.dumps(op)) + 1
+        if chunk and (len(chunk) == TXN_MAX_OPS or size + op_size > TXN_MAX_BYTES):
+            yield chunk
+            chunk = []
+            size = 2
+        chunk.append(op)
+        size += op_size
+    if chunk:
+        yield chunk
+
+
+def parse_index(headers):
+    """returns the X-Consul-Index from response headers as an int, or None"""
+    try:
+        return int(headers.get(INDEX_HEADER))
+    except (AttributeError, TypeError, ValueError):
+        return None
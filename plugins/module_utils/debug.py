@@ -2,10 +2,16 @@
 # SPDX-License-Identifier: MIT
 
 
+import atexit
 import inspect
+import json
 import logging
 import os
+import re
+import threading
+import time
 from pathlib import Path
+from urllib.parse import urlsplit
 
 #
 # This logger can only be enabled if env var ANSIBLE_DEBUG_LOGGER_ENABLED
@@ -57,3 +63,200 @@ def log_request(module, url, method, request_body=None, status=None, response_bo
                 response_body=response_body,
             )
         )
+
+
+#
+# The metrics mode is a lighter alternative to the debug logger above. When
+# ANSIBLE_DEBUG_METRICS_ENABLED is set to true or yes, every API call records
+# its method, endpoint template, status, request/response size and latency.
+# No bodies are kept and no frames are inspected. The records are appended to
+# /tmp/DEBUG_ANSIBLE_METRICS.jsonl (override with ANSIBLE_DEBUG_METRICS_FILE)
+# as JSON lines when the module exits, and an aggregated summary is added to
+# the module result as "api_metrics":
+#
+# - name: deploy nomad job
+#   nomad_job:
+#     ...
+#   environment:
+#     ANSIBLE_DEBUG_METRICS_ENABLED: true
+#
+# Attempts that failed and were retried (see retry.py) are recorded with
+# "retry": true and the delay before the next attempt. They are counted as
+# "retries" and "retry_ms" in the summary instead of as requests, since the
+# latency of the request that finally succeeded or failed covers them.
+#
+
+METRICS_ENV_VAR = "ANSIBLE_DEBUG_METRICS_ENABLED"
+METRICS_FILE_ENV_VAR = "ANSIBLE_DEBUG_METRICS_FILE"
+METRICS_LOG_FILE = "/tmp/DEBUG_ANSIBLE_METRICS.jsonl"
+METRICS_ENABLED = os.environ.get(METRICS_ENV_VAR, "").lower() in ["yes", "true"]
+
+
+def endpoint_matcher(templates):
+    """
+    Returns a function that maps a request url back to the first matching
+    URL_* template (e.g. /v1/job/{id}). Templates with fewer placeholders are
+    tried first so /v1/acl/token/self wins over /v1/acl/token/{id}.
+    A {key} placeholder (consul KV keys) may span several path segments.
+    """
+    paths = sorted({t.replace("{url}", "").split("?")[0] for t in templates}, key=lambda p: (p.count("{"), -len(p)))
+
+    def to_regex(path):
+        regex = re.escape(path).replace(r"\{key\}", ".+")
+        return re.compile("^" + re.sub(r"\\{\w+\\}", "[^/]+", regex) + "$")
+
+    patterns = [(p, to_regex(p)) for p in paths]
+
+    def match(url):
+        path = urlsplit(url).path
+        for template, pattern in patterns:
+            if pattern.match(path):
+                return template
+        return path
+
+    return match
+
+
+class RequestMetrics:
+    """RequestMetrics collects the per request metrics of a module run"""
+
+    def __init__(self):
+        self.records = []
+        self.module_name = None
+        self._lock = threading.Lock()
+        self._flushed = 0
+
+    def record(self, method, endpoint, status, request_bytes, response_bytes, latency, retry_delay=None):
+        record = {
+            "ts": round(time.time(), 3),
+            "module": self.module_name,
+            "method": method,
+            "endpoint": endpoint,
+            "status": status,
+            "request_bytes": request_bytes,
+            "response_bytes": response_bytes,
+            "latency_ms": round(latency * 1000, 3),
+        }
+        if retry_delay is not None:
+            record["retry"] = True
+            record["delay_ms"] = round(retry_delay * 1000, 3)
+        with self._lock:
+            self.records.append(record)
+
+    def summary(self):
+        """aggregates the records per method and endpoint, slowest (by total time) first"""
+        with self._lock:
+            records = [r for r in self.records if not r.get("retry")]
+            retries = [r for r in self.records if r.get("retry")]
+
+        calls = {}
+        for r in records + retries:
+            key = f"{r['method']} {r['endpoint']}"
+            call = calls.setdefault(
+                key,
+                {"count": 0, "errors": 0, "retries": 0, "total_ms": 0.0, "max_ms": 0.0, "response_bytes": 0},
+            )
+            if r.get("retry"):
+                call["retries"] += 1
+                continue
+            call["count"] += 1
+            call["errors"] += 0 if r["status"] is not None and r["status"] < 400 else 1
+            call["total_ms"] += r["latency_ms"]
+            call["max_ms"] = max(call["max_ms"], r["latency_ms"])
+            call["response_bytes"] += r["response_bytes"]
+        for call in calls.values():
+            call["total_ms"] = round(call["total_ms"], 3)
+
+        return {
+            "requests": len(records),
+            "total_ms": round(sum(r["latency_ms"] for r in records), 3),
+            "response_bytes": sum(r["response_bytes"] for r in records),
+            "retries": len(retries),
+            "retry_ms": round(sum(r["latency_ms"] + r["delay_ms"] for r in retries), 3),
+            "calls": dict(sorted(calls.items(), key=lambda c: c[1]["total_ms"], reverse=True)),
+        }
+
+    def flush(self):
+        """appends the records that were not written yet to the metrics file"""
+        with self._lock:
+            records = self.records[self._flushed :]
+            self._flushed = len(self.records)
+        if not records:
+            return
+        try:
+            with open(os.environ.get(METRICS_FILE_ENV_VAR, METRICS_LOG_FILE), "a", encoding="utf-8") as f:
+                f.writelines(json.dumps(r) + "\n" for r in records)
+        except OSError:
+            return
+
+
+metrics = RequestMetrics()
+if METRICS_ENABLED:
+    atexit.register(metrics.flush)
+
+
+def body_length(body):
+    """returns the size of a request body in bytes, str bodies are sent utf-8 encoded"""
+    if body is None:
+        return 0
+    if isinstance(body, str):
+        return len(body.encode("utf-8"))
+    return len(body)
+
+
+def log_metrics(method, url, status, request_body, response_length, latency, endpoint=None):
+    """records a request. endpoint maps the url to its template and is only called in metrics mode"""
+    if METRICS_ENABLED:
+        request_length = body_length(request_body)
+        metrics.record(
+            method,
+            endpoint(url) if endpoint is not None else url,
+            status,
+            request_length,
+            response_length,
+            latency,
+        )
+
+
+def log_retry(method, url, status, request_body, latency, delay, endpoint=None):
+    """records a failed attempt that is sent again after delay seconds. status is None for connection errors"""
+    if METRICS_ENABLED:
+        request_length = body_length(request_body)
+        metrics.record(
+            method,
+            endpoint(url) if endpoint is not None else url,
+            status,
+            request_length,
+            0,
+            latency,
+            retry_delay=delay,
+        )
+
+
+def attach_metrics(module):
+    """
+    Adds the metrics summary to the result of exit_json and fail_json.
+    Only AnsibleModule objects are wrapped, and only once.
+    """
+    if not METRICS_ENABLED or getattr(module, "_api_metrics_attached", False):
+        return
+    if not hasattr(module, "exit_json"):
+        return
+
+    metrics.module_name = getattr(module, "_name", None)
+    exit_json = module.exit_json
+    fail_json = module.fail_json
+
+    def exit_with_metrics(**kwargs):
+        kwargs.setdefault("api_metrics", metrics.summary())
+        metrics.flush()
+        exit_json(**kwargs)
+
+    def fail_with_metrics(msg=None, **kwargs):
+        kwargs.setdefault("api_metrics", metrics.summary())
+        metrics.flush()
+        fail_json(msg=msg, **kwargs)
+
+    module.exit_json = exit_with_metrics
+    module.fail_json = fail_with_metrics
+    module._api_metrics_attached = True
@@ -0,0 +1,78 @@
+# Copyright (c) George Bolo <gbolo@linuxctl.com>
+# SPDX-License-Identifier: MIT
+
+
+import ast
+import importlib.util
+import os
+import sys
+import threading
+
+#
+# The module_utils import their siblings by bare name (e.g. "import debug").
+# A controller side plugin (e.g. an inventory) that put this directory on
+# sys.path would register generic names like "nomad", "cache" or "utils" for
+# the whole ansible process, shadowing packages of the same name (python-nomad
+# for one) or being shadowed by them, whichever is imported first.
+#
+# load() loads a module_utils file, and the siblings it imports, under private
+# names instead. The bare sibling names only point at the private modules
+# while a file is executed, sys.path is never touched. A plugin runs this file
+# by path and loads what it needs in one call:
+#
+#   nomad, parallel = runpy.run_path(".../module_utils/loader.py")["load_all"]("nomad", "parallel")
+#
+# The loaded modules are kept in sys.modules, every plugin gets the same ones.
+#
+
+PREFIX = "ansible_api_module_utils_"
+DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+
+_lock = threading.RLock()
+
+
+def _sibling_imports(path):
+    """returns the names of the module_utils imported by bare name in the file at path"""
+    with open(path, encoding="utf-8") as f:
+        tree = ast.parse(f.read(), filename=path)
+    names = []
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            for alias in node.names:
+                if os.path.isfile(os.path.join(DIRECTORY, f"{alias.name}.py")) and alias.name not in names:
+                    names.append(alias.name)
+    return names
+
+
+def load(name):
+    """returns the module_utils file name (e.g. "nomad"), loaded under a private name"""
+    private_name = PREFIX + name
+    with _lock:
+        if private_name in sys.modules:
+            return sys.modules[private_name]
+
+        path = os.path.join(DIRECTORY, f"{name}.py")
+        siblings = {sibling: load(sibling) for sibling in _sibling_imports(path)}
+
+        spec = importlib.util.spec_from_file_location(private_name, path)
+        module = importlib.util.module_from_spec(spec)
+        sys.modules[private_name] = module
+        shadowed = {sibling: sys.modules.get(sibling) for sibling in siblings}
+        sys.modules.update(siblings)
+        try:
+            spec.loader.exec_module(module)
+        except BaseException:
+            del sys.modules[private_name]
+            raise
+        finally:
+            for sibling, previous in shadowed.items():
+                if previous is None:
+                    sys.modules.pop(sibling, None)
+                else:
+                    sys.modules[sibling] = previous
+        return module
+
+
+def load_all(*names):
+    """returns the module_utils files names, see load()"""
+    return tuple(load(name) for name in names)
@@ -0,0 +1,292 @@
+# Copyright (c) George Bolo <gbolo@linuxctl.com>
+# SPDX-License-Identifier: MIT
+
+
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+
+import cache
+import debug
+import parallel
+import retry
+import transport
+from ansible.module_utils.common.text.converters import to_native
+from ansible.module_utils.six.moves.urllib.error import HTTPError
+from ansible.module_utils.six.moves.urllib.parse import parse_qsl, quote, urlencode, urlsplit
+
+URL_DNS_ZONES = "{url}/api/plugins/netbox-dns/zones/?limit={limit}&ordering=id"
+URL_DNS_RECORDS = "{url}/api/plugins/netbox-dns/records/?limit={limit}&ordering=id"
+URL_DNS_RECORDS_SINCE = "{url}/api/plugins/netbox-dns/records/?limit={limit}&ordering=id&last_updated__gte={since}"
+URL_DNS_RECORD_IDS = "{url}/api/plugins/netbox-dns/records/?limit={limit}&ordering=id&brief=1"
+URL_DNS_RECORDS_BY_ID = "{url}/api/plugins/netbox-dns/records/?limit={limit}&ordering=id&{ids}"
+
+# the default MAX_PAGE_SIZE of netbox, larger limits are capped to it
+PAGE_SIZE = 1000
+
+# how many ids are looked up in a single request, bounded by the length of the url
+IDS_PER_REQUEST = 100
+
+# how far the watermark of a delta is set back from the start of the fetch, covers
+# the records updated while it ran and a skew between the local and the netbox clock
+WATERMARK_MARGIN = timedelta(minutes=5)
+
+#
+# NetBox lists are read ordered by id, page by page with id__gt of the last id
+# of the previous page (keyset paging): unlike limit/offset, a record deleted
+# while the list is read does not shift the records after it onto a page that
+# was already read. The first page carries the total count, with the last id
+# of the list the rest of the ids is split into one range per expected page
+# and iter_pages(max_workers=N) reads up to N ranges at once, each worker
+# thread with its own NetboxAPI. The results are still yielded in order, range
+# by range, and at most N ranges are held in memory.
+#
+# sync_dns_records keeps a local copy of all DNS records up to date: only the
+# records with a last_updated at or after the watermark of the previous run
+# are transferred. The watermark is the newest last_updated seen, but never
+# later than the start of the fetch (minus WATERMARK_MARGIN): a record updated
+# while the pages are read may be on a page that was already read, with an
+# older last_updated than records on later ones. Deleted records do not show
+# up in such a delta, they are detected by comparing the total count with the
+# local copy, and only when the two differ the (brief) ids of all records are
+# listed, to drop the deleted records and fetch the ones missing locally.
+# NetBox has no ETags or conditional requests on its lists to do this with.
+#
+
+# maps request urls back to the URL_* templates above for the request metrics
+endpoint_template = debug.endpoint_matcher([v for k, v in list(globals().items()) if k.startswith("URL_")])
+
+
+class NetboxAPI:
+    """NetboxAPI is used to interact with the NetBox REST API"""
+
+    def __init__(self, module):
+        self.module = module
+        # url may be a comma separated list of servers, see retry.Endpoints
+        self.endpoints = retry.Endpoints(self.module.params.get("netbox_url"))
+        self.url = self.endpoints.current
+        self.token = self.module.params.get("netbox_token")
+        self.validate_certs = self.module.params.get("netbox_validate_certs")
+        self.connection_timeout = self.module.params.get("connection_timeout")
+        self.transport = retry.RetryingTransport(
+            transport.get_transport(self.validate_certs),
+            self.endpoints,
+            endpoint=endpoint_template,
+        )
+        debug.attach_metrics(self.module)
+        self.headers = {
+            "Accept": "application/json",
+            "Content-Type": "application/json",
+            "Authorization": f"Token {self.token}",
+            "User-Agent": "ansible-module-netbox",
+        }
+
+    def api_request(self, url, method, body=None):
+        start = time.monotonic()
+        try:
+            response = self.transport.request(
+                url,
+                method,
+                body=body,
+                headers=self.headers,
+                timeout=self.connection_timeout,
+            )
+            response_bytes = response.read()
+            debug.log_metrics(
+                method,
+                url,
+                response.getcode(),
+                body,
+                len(response_bytes),
+                time.monotonic() - start,
+                endpoint=endpoint_template,
+            )
+            response_body = response_bytes.decode("utf-8")
+            debug.log_request(self.module, url, method, body, response.getcode(), response_body)
+            try:
+                return json.loads(to_native(response_body))
+            except ValueError as e:
+                self.module.fail_json(msg=f"API returned invalid JSON: {str(e)}")
+
+        except HTTPError as e:
+            response_bytes = e.read()
+            debug.log_metrics(
+                method,
+                url,
+                e.code,
+                body,
+                len(response_bytes),
+                time.monotonic() - start,
+                endpoint=endpoint_template,
+            )
+            response_body = response_bytes.decode("utf-8")
+            debug.log_request(self.module, url, method, body, e.code, response_body)
+            if e.code == 401 or e.code == 403:
+                self.module.fail_json(msg=f"Not Authorized: status={e.code} [{method}] {url} ->\n{response_body}")
+
+            self.module.fail_json(msg=f"Error: status={e.code} [{method}] {url} ->\n{response_body}")
+
+        except Exception as e:
+            debug.log_metrics(method, url, None, body, 0, time.monotonic() - start, endpoint=endpoint_template)
+            self.module.fail_json(msg=f"Could not make API call: [{method}] {url} ->\n{str(e)}")
+
+    def list_url(self, url, **params):
+        """returns url with its query parameters updated by params"""
+        parts = urlsplit(url)
+        query = dict(parse_qsl(parts.query), **params)
+        return f"{self.url}{parts.path}?{urlencode(query)}"
+
+    def iter_id_range(self, url, after, last=None):
+        """yields the results of a list ordered by id with an id above after (up to last), page by page"""
+        while True:
+            params = {"id__gt": after} if last is None else {"id__gt": after, "id__lte": last}
+            page = self.api_request(url=self.list_url(url, **params), method="GET")
+            results = page.get("results") or []
+            yield from results
+            # netbox caps the limit at its MAX_PAGE_SIZE, only the next link tells whether there is more
+            if not page.get("next") or not results:
+                return
+            after = results[-1]["id"]
+
+    def iter_pages(self, url, max_workers=1):
+        """
+        Yields the results of a paginated list ordered by id, in order. With
+        max_workers above 1 the id ranges after the first page are fetched concurrently.
+        """
+        page = self.api_request(url=url, method="GET")
+        results = page.get("results") or []
+        yield from results
+        if not page.get("next") or not results:
+            return
+
+        after = results[-1]["id"]
+        if max_workers <= 1:
+            yield from self.iter_id_range(url, after)
+            return
+
+        # records created after this request have higher ids, a delta picks them up
+        newest = self.api_request(url=self.list_url(url, ordering="-id", limit=1, brief=1), method="GET")
+        if not newest.get("results"):
+            return
+        last = newest["results"][0]["id"]
+        ranges = max(1, -(-(page["count"] - len(results)) // len(results)))
+        width = max(1, -(-(last - after) // ranges))
+        bounds = [(lower, min(lower + width, last)) for lower in range(after, last, width)]
+
+        local = threading.local()
+
+        def fetch(bound):
+            api = getattr(local, "api", None)
+            if api is None:
+                api = local.api = NetboxAPI(parallel.ModuleShim({}, parent=self.module))
+            try:
+                return list(api.iter_id_range(url, *bound))
+            except parallel.APIError as e:
+                return e
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            # a sliding window of max_workers ranges, so memory does not grow with the list
+            futures = [executor.submit(fetch, b) for b in bounds[:max_workers]]
+            for i in range(len(bounds)):
+                results = futures[i].result()
+                futures[i] = None
+                if i + max_workers < len(bounds):
+                    futures.append(executor.submit(fetch, bounds[i + max_workers]))
+                if isinstance(results, parallel.APIError):
+                    for future in futures[i:]:
+                        if future is not None:
+                            future.cancel()
+                    self.module.fail_json(msg=results.msg)
+                yield from results
+
+    def count(self, url):
+        """returns the total count of a list, with a single one item page"""
+        parts = urlsplit(url)
+        query = dict(parse_qsl(parts.query), limit=1)
+        return self.api_request(url=f"{self.url}{parts.path}?{urlencode(query)}", method="GET").get("count", 0)
+
+    #
+    # DNS plugin (netbox-dns)
+    #
+    def iter_dns_zones(self, max_workers=1):
+        return self.iter_pages(URL_DNS_ZONES.format(url=self.url, limit=PAGE_SIZE), max_workers=max_workers)
+
+    def get_dns_zones(self, max_workers=1):
+        return list(self.iter_dns_zones(max_workers=max_workers))
+
+    def iter_dns_records(self, since=None, max_workers=1):
+        """yields the records of all zones (any status), only the ones last updated at or after since if given"""
+        if since:
+            url = URL_DNS_RECORDS_SINCE.format(url=self.url, limit=PAGE_SIZE, since=quote(since))
+        else:
+            url = URL_DNS_RECORDS.format(url=self.url, limit=PAGE_SIZE)
+        return self.iter_pages(url, max_workers=max_workers)
+
+    def get_dns_records(self, max_workers=1):
+        return list(self.iter_dns_records(max_workers=max_workers))
+
+    def iter_dns_records_by_id(self, ids):
+        """yields the records with the given ids that still exist"""
+        ids = list(ids)
+        for i in range(0, len(ids), IDS_PER_REQUEST):
+            query = urlencode([("id", record_id) for record_id in ids[i : i + IDS_PER_REQUEST]])
+            yield from self.iter_pages(URL_DNS_RECORDS_BY_ID.format(url=self.url, limit=PAGE_SIZE, ids=query))
+
+    def dns_record_cache(self):
+        """returns the FileCache entry for the state of sync_dns_records"""
+        return cache.FileCache("netbox-dns-records", self.token + self.url)
+
+    def sync_dns_records(self, state=None, max_workers=1):
+        """
+        Brings state, the result of a previous call (e.g. loaded from
+        dns_record_cache), up to date with the records in netbox. Without a
+        state all records are fetched. Returns the new state, as
+        {"last_updated": watermark, "records": {id: record}}, and the
+        changes as a list of (before, after) records, None for a created or
+        deleted one. The state is not saved.
+        """
+        records = {}
+        since = None
+        if state and state.get("records") is not None and state.get("last_updated"):
+            records = dict(state["records"])
+            since = state["last_updated"]
+
+        started = datetime.now(timezone.utc)
+        changes = []
+        newest = since
+        for record in self.iter_dns_records(since=since, max_workers=max_workers):
+            record_id = str(record["id"])
+            before = records.get(record_id)
+            records[record_id] = record
+            updated = record.get("last_updated")
+            if updated and (newest is None or parse_time(updated) > parse_time(newest)):
+                newest = updated
+            if before != record:
+                changes.append((before, record))
+
+        # a delta does not carry the deleted records, a count that differs from the local copy gives them away
+        if since is not None and self.count(URL_DNS_RECORDS.format(url=self.url, limit=1)) != len(records):
+            url = URL_DNS_RECORD_IDS.format(url=self.url, limit=PAGE_SIZE)
+            existing = {str(record["id"]) for record in self.iter_pages(url, max_workers=max_workers)}
+            for record_id in [i for i in records if i not in existing]:
+                changes.append((records.pop(record_id), None))
+            for record in self.iter_dns_records_by_id(sorted((i for i in existing if i not in records), key=int)):
+                records[str(record["id"])] = record
+                changes.append((None, record))
+
+        watermark = started - WATERMARK_MARGIN
+        if newest is not None and parse_time(newest) < watermark:
+            watermark = parse_time(newest)
+        return {"last_updated": format_time(watermark), "records": records}, changes
+
+
+def parse_time(value):
+    """parses a netbox timestamp, e.g. 2024-05-07T14:03:11.534225Z"""
+    return datetime.fromisoformat(value.replace("Z", "+00:00"))
+
+
+def format_time(value):
+    """formats a datetime as a netbox timestamp"""
+    return value.astimezone(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%fZ")
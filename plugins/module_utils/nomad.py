@@ -3,16 +3,22 @@
 
 
 import json
+import time
+from http.client import HTTPException
 
+import cache
 import debug
+import retry
+import transport
+import utils
 from ansible.module_utils.common.text.converters import to_native
 from ansible.module_utils.six.moves.urllib.error import HTTPError
 from ansible.module_utils.six.moves.urllib.parse import quote_plus
-from ansible.module_utils.urls import open_url
 
 URL_ACL_POLICIES = "{url}/v1/acl/policies"
 URL_ACL_POLICY = "{url}/v1/acl/policy/{name}"
 URL_ACL_TOKENS = "{url}/v1/acl/tokens"
+URL_ACL_TOKENS_PAGE = "{url}/v1/acl/tokens?per_page={per_page}"
 URL_ACL_TOKEN = "{url}/v1/acl/token"
 URL_ACL_TOKEN_ID = "{url}/v1/acl/token/{id}"
 URL_ACL_TOKEN_SELF = "{url}/v1/acl/token/self"
@@ -30,6 +36,32 @@ URL_JOB_DELETE = "{url}/v1/job/{id}?purge={purge}&namespace={namespace}"
 URL_JOB_PARSE = "{url}/v1/jobs/parse?namespace={namespace}"
 URL_JOB_PLAN = "{url}/v1/job/{id}/plan?namespace={namespace}"
 URL_JOB_SUBMISSION = "{url}/v1/job/{id}/submission?namespace={namespace}&version={version}"
+URL_JOB_EVALUATIONS = "{url}/v1/job/{id}/evaluations?namespace={namespace}"
+URL_JOB_DEPLOYMENT = "{url}/v1/job/{id}/deployment?namespace={namespace}"
+URL_EVALUATION = "{url}/v1/evaluation/{id}?namespace={namespace}"
+URL_EVENT_STREAM = "{url}/v1/event/stream?namespace={namespace}&index={index}"
+URL_NODES = "{url}/v1/nodes"
+URL_NODE = "{url}/v1/node/{id}"
+
+INDEX_HEADER = "X-Nomad-Index"
+
+# nomad sends a {} heartbeat every 10s on an idle event stream, a stream
+# that stays silent for longer than this is considered broken and reopened
+EVENT_STREAM_READ_TIMEOUT = 30
+EVENT_STREAM_RETRY_DELAY = 1
+
+# nomad caps the wait of a blocking query at 10 minutes
+MAX_BLOCKING_WAIT = 600
+
+# the delay between two reads of a watch that has no index to block on, e.g.
+# when a proxy in front of nomad drops the X-Nomad-Index header
+UNBLOCKED_POLL_INTERVAL = 1
+
+# deployment status -> did it succeed
+DEPLOYMENT_TERMINAL_STATUS = {"successful": True, "failed": False, "cancelled": False}
+
+# maps request urls back to the URL_* templates above for the request metrics
+endpoint_template = debug.endpoint_matcher([v for k, v in list(globals().items()) if k.startswith("URL_")])
 
 
 class NomadAPI:
@@ -37,30 +69,53 @@ class NomadAPI:
 
     def __init__(self, module):
         self.module = module
-        self.url = self.module.params.get("url")
+        # url may be a comma separated list of servers, see retry.Endpoints
+        self.endpoints = retry.Endpoints(self.module.params.get("url"))
+        self.url = self.endpoints.current
         self.management_token = self.module.params.get("management_token")
         self.namespace = self.module.params.get("namespace")
         self.validate_certs = self.module.params.get("validate_certs")
         self.connection_timeout = self.module.params.get("connection_timeout")
+        self.transport = retry.RetryingTransport(
+            transport.get_transport(self.validate_certs),
+            self.endpoints,
+            endpoint=endpoint_template,
+        )
+        debug.attach_metrics(self.module)
         self.headers = {
             "Content-Type": "application/json",
             "X-Nomad-Token": self.management_token,
             "User-Agent": "ansible-module-nomad",
         }
+        # the X-Nomad-Index of the last successful request
+        self.last_index = None
+        self._acl_token_names = None
+        self.read_cache = cache.ReadCache("nomad-reads", self.management_token)
 
-    def api_request(self, url, method, headers=None, body=None, json_response=True, accept_404=False):
+    def api_request(self, url, method, headers=None, body=None, json_response=True, accept_404=False, timeout=None):
+        """timeout: socket timeout in seconds, connection_timeout by default"""
         if headers is None:
             headers = self.headers
+        start = time.monotonic()
         try:
-            response = open_url(
-                url=url,
-                method=method,
-                data=body,
+            response = self.transport.request(
+                url,
+                method,
+                body=body,
                 headers=headers,
-                timeout=self.connection_timeout,
-                validate_certs=self.validate_certs,
+                timeout=timeout or self.connection_timeout,
+            )
+            response_bytes = response.read()
+            debug.log_metrics(
+                method,
+                url,
+                response.getcode(),
+                body,
+                len(response_bytes),
+                time.monotonic() - start,
+                endpoint=endpoint_template,
             )
-            response_body = response.read().decode("utf-8")
+            response_body = response_bytes.decode("utf-8")
             debug.log_request(
                 self.module,
                 url,
@@ -69,6 +124,7 @@ class NomadAPI:
                 response.getcode(),
                 response_body,
             )
+            self.last_index = parse_index(response.headers)
             if json_response:
                 try:
                     return json.loads(to_native(response_body))
@@ -77,7 +133,17 @@ class NomadAPI:
             return response_body
 
         except HTTPError as e:
-            response_body = e.read().decode("utf-8")
+            response_bytes = e.read()
+            debug.log_metrics(
+                method,
+                url,
+                e.code,
+                body,
+                len(response_bytes),
+                time.monotonic() - start,
+                endpoint=endpoint_template,
+            )
+            response_body = response_bytes.decode("utf-8")
             debug.log_request(
                 self.module,
                 url,
@@ -94,8 +160,26 @@ class NomadAPI:
             self.module.fail_json(msg=f"Error: status={e.code} [{method}] {url} ->\n{response_body}")
 
         except Exception as e:
+            debug.log_metrics(method, url, None, body, 0, time.monotonic() - start, endpoint=endpoint_template)
             self.module.fail_json(msg=f"Could not make API call: [{method}] {url} ->\n{str(e)}")
 
+    def cached_get(self, url, accept_404=False):
+        """GET url as json, revalidating a locally cached copy with a blocking query (see cache.ReadCache)"""
+
+        def fetch(request_url):
+            body = self.api_request(
+                url=request_url,
+                method="GET",
+                json_response=False,
+                accept_404=accept_404,
+            )
+            return body, self.last_index
+
+        try:
+            return self.read_cache.get(url, fetch)
+        except ValueError as e:
+            self.module.fail_json(msg=f"API returned invalid JSON: {str(e)}")
+
     #
     # ACL Policies
     #
@@ -107,10 +191,8 @@ class NomadAPI:
         )
 
     def get_acl_policy(self, policy_name):
-        return self.api_request(
-            url=URL_ACL_POLICY.format(url=self.url, name=policy_name),
-            method="GET",
-            json_response=True,
+        return self.cached_get(
+            URL_ACL_POLICY.format(url=self.url, name=policy_name),
             accept_404=True,
         )
 
@@ -130,15 +212,21 @@ class NomadAPI:
             json_response=False,
         )
 
+    def acl_policy_cache(self):
+        """
+        returns the FileCache entry that maps policy names to the ModifyIndex they were
+        last written (or verified) at and the digest of the desired policy at that time
+        """
+        return cache.FileCache("nomad-acl-policies", self.url)
+
     #
     # ACL Tokens
     #
     def get_acl_tokens(self):
-        return self.api_request(
-            url=URL_ACL_TOKENS.format(url=self.url),
-            method="GET",
-            json_response=True,
-        )
+        return list(self.iter_acl_tokens())
+
+    def iter_acl_tokens(self):
+        return self.iter_list(URL_ACL_TOKENS.format(url=self.url))
 
     def get_acl_token(self, accessor_id):
         return self.api_request(
@@ -148,10 +236,49 @@ class NomadAPI:
             accept_404=True,
         )
 
+    def get_acl_tokens_index(self):
+        """returns the current X-Nomad-Index of the acl tokens table without listing every token"""
+        self.api_request(
+            url=URL_ACL_TOKENS_PAGE.format(url=self.url, per_page=1),
+            method="GET",
+            json_response=True,
+        )
+        return self.last_index
+
+    def get_acl_token_names(self):
+        """
+        Returns a dict of token name -> accessor id.
+        The dict is cached on disk per cluster and only rebuilt when the
+        X-Nomad-Index of the acl tokens table has moved on.
+        """
+        if self._acl_token_names is not None:
+            return self._acl_token_names
+
+        token_cache = cache.FileCache("nomad-acl-token-names", self.url)
+        cached = token_cache.load()
+        if cached is not None and cached.get("index") is not None:
+            if self.get_acl_tokens_index() == cached["index"]:
+                self._acl_token_names = cached["names"]
+                return self._acl_token_names
+
+        names = {}
+        for token in self.iter_acl_tokens():
+            # the first token wins when names are not unique
+            if token.get("Name"):
+                names.setdefault(token["Name"], token.get("AccessorID"))
+        if self.last_index is not None:
+            token_cache.save({"index": self.last_index, "names": names})
+        self._acl_token_names = names
+        return names
+
     def find_acl_token_by_name(self, name):
-        for token in self.get_acl_tokens():
-            if token.get("Name") == name:
-                return self.get_acl_token(token.get("AccessorID"))
+        if self._acl_token_names is None and not cache.FileCache("nomad-acl-token-names", self.url).enabled:
+            # without a cache to keep the name index in, stop at the first match
+            accessor_id = next((t.get("AccessorID") for t in self.iter_acl_tokens() if t.get("Name") == name), None)
+        else:
+            accessor_id = self.get_acl_token_names().get(name)
+        if accessor_id is not None:
+            return self.get_acl_token(accessor_id)
 
     def delete_acl_token(self, accessor_id):
         return self.api_request(
@@ -204,10 +331,8 @@ class NomadAPI:
         )
 
     def get_namespace(self, name):
-        return self.api_request(
-            url=URL_NAMESPACE.format(url=self.url, name=name),
-            method="GET",
-            json_response=True,
+        return self.cached_get(
+            URL_NAMESPACE.format(url=self.url, name=name),
             accept_404=True,
         )
 
@@ -231,10 +356,8 @@ class NomadAPI:
     # Operator
     #
     def get_scheduler_config(self):
-        return self.api_request(
-            url=URL_OPERATOR_SCHEDULER.format(url=self.url),
-            method="GET",
-            json_response=True,
+        return self.cached_get(
+            URL_OPERATOR_SCHEDULER.format(url=self.url),
         )
 
     def update_scheduler_config(self, body):
@@ -249,17 +372,14 @@ class NomadAPI:
     # CSI Volumes
     #
     def get_csi_volumes(self):
-        return self.api_request(
-            url=URL_CSI_VOLUMES.format(url=self.url, namespace=quote_plus(self.namespace)),
-            method="GET",
-            json_response=True,
-        )
+        return list(self.iter_csi_volumes())
+
+    def iter_csi_volumes(self):
+        return self.iter_list(URL_CSI_VOLUMES.format(url=self.url, namespace=quote_plus(self.namespace)))
 
     def get_csi_volume(self, id):
-        return self.api_request(
-            url=URL_CSI_VOLUME.format(url=self.url, id=id, namespace=quote_plus(self.namespace)),
-            method="GET",
-            json_response=True,
+        return self.cached_get(
+            URL_CSI_VOLUME.format(url=self.url, id=id, namespace=quote_plus(self.namespace)),
             accept_404=True,
         )
 
@@ -271,6 +391,13 @@ class NomadAPI:
             accept_404=True,
         )
 
+    def csi_volume_cache(self):
+        """
+        returns the FileCache entry that maps the ids of the csi volumes in the current namespace to
+        the ModifyIndex they were created (or verified) at and the digest of the desired volume at that time
+        """
+        return cache.FileCache("nomad-csi-volumes", "\n".join([self.url, self.namespace]))
+
     def create_csi_volume(self, id, body):
         return self.api_request(
             url=URL_CSI_VOLUME_CREATE.format(url=self.url, id=id, namespace=quote_plus(self.namespace)),
@@ -313,14 +440,47 @@ class NomadAPI:
             json_response=True,
         )
 
-    def get_job(self, id):
-        return self.api_request(
-            url=URL_JOB.format(url=self.url, id=id, namespace=quote_plus(self.namespace)),
-            method="GET",
-            json_response=True,
+    def get_job(self, id, namespace=None):
+        return self.cached_get(
+            URL_JOB.format(url=self.url, id=id, namespace=quote_plus(namespace or self.namespace)),
             accept_404=True,
         )
 
+    def job_spec_cache(self, hcl_spec):
+        """returns the FileCache entry of an HCL job spec submitted from the current namespace"""
+        return cache.FileCache("nomad-job-specs", "\n".join([self.url, self.namespace, hcl_spec]))
+
+    def remember_job_spec(self, hcl_spec, job, job_modify_index):
+        """
+        records that the parsed job was registered with, or planned without a diff against, hcl_spec.
+        The job lives in the namespace declared in the HCL, which is not necessarily the current one
+        """
+        self.job_spec_cache(hcl_spec).save(
+            {
+                "id": job["ID"],
+                "namespace": job.get("Namespace") or self.namespace,
+                "job_modify_index": job_modify_index,
+            }
+        )
+
+    def get_unchanged_job(self, hcl_spec):
+        """
+        Returns the job if hcl_spec was remembered for it and the job was not
+        modified since, otherwise None. Costs a single GET instead of a parse and a plan.
+        """
+        entry = self.job_spec_cache(hcl_spec).load()
+        if entry is None or entry.get("id") is None or entry.get("namespace") is None:
+            return None
+        job = self.get_job(entry["id"], namespace=entry["namespace"])
+        if (
+            job is None
+            or job.get("Stop")
+            or job.get("Namespace", entry["namespace"]) != entry["namespace"]
+            or job.get("JobModifyIndex") != entry.get("job_modify_index")
+        ):
+            return None
+        return job
+
     def get_job_submission(self, id, version=1):
         return self.api_request(
             url=URL_JOB_SUBMISSION.format(
@@ -333,3 +493,226 @@ class NomadAPI:
             json_response=True,
             accept_404=True,
         )
+
+    def get_job_evaluations(self, id):
+        return self.api_request(
+            url=URL_JOB_EVALUATIONS.format(url=self.url, id=id, namespace=quote_plus(self.namespace)),
+            method="GET",
+            json_response=True,
+        )
+
+    def get_job_deployment(self, id, index=None, wait=None):
+        """
+        Returns the most recent deployment of a job, or None. With an index this is a blocking
+        query: it returns once the X-Nomad-Index moved past index, or after wait seconds.
+        """
+        url = URL_JOB_DEPLOYMENT.format(url=self.url, id=id, namespace=quote_plus(self.namespace))
+        timeout = None
+        if index:
+            url = f"{url}&index={index}&wait={int(wait * 1000)}ms"
+            # nomad adds up to wait/16 of jitter to a blocking query
+            timeout = self.connection_timeout + wait + wait / 16
+        return self.api_request(
+            url=url,
+            method="GET",
+            json_response=True,
+            accept_404=True,
+            timeout=timeout,
+        )
+
+    def wait_for_job_deployment(self, id, job_modify_index, deadline):
+        """
+        Watches the deployment of a job version (the first with at least job_modify_index)
+        with blocking queries until it reached a terminal status, see DEPLOYMENT_TERMINAL_STATUS,
+        or until deadline, a time.monotonic() value. Returns the deployment last read, or None,
+        and the number of requests it took.
+        """
+        deployment = None
+        index = None
+        requests = 0
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 and requests:
+                break
+            if index:
+                wait = min(max(remaining, 0.001), MAX_BLOCKING_WAIT)
+                deployment = self.get_job_deployment(id, index=index, wait=wait)
+            else:
+                if requests:
+                    time.sleep(min(UNBLOCKED_POLL_INTERVAL, max(remaining, 0)))
+                deployment = self.get_job_deployment(id)
+            requests += 1
+            if deployment is not None and deployment.get("JobModifyIndex", 0) < job_modify_index:
+                # the deployment of an older version, the one of job_modify_index is not created yet
+                deployment = None
+            if deployment is not None and deployment.get("Status") in DEPLOYMENT_TERMINAL_STATUS:
+                break
+            index = self.last_index if (self.last_index or 0) >= (index or 0) else 0
+        return deployment, requests
+
+    def get_evaluation(self, id):
+        return self.api_request(
+            url=URL_EVALUATION.format(url=self.url, id=id, namespace=quote_plus(self.namespace)),
+            method="GET",
+            json_response=True,
+            accept_404=True,
+        )
+
+    #
+    # Nodes
+    #
+    def get_nodes(self):
+        """returns the node stubs, each with a ModifyIndex that moves when the node changes"""
+        url = URL_NODES.format(url=self.url)
+        # the read cache needs the raw body, otherwise the list is streamed
+        if self.read_cache.enabled:
+            return self.cached_get(url)
+        return list(self.iter_list(url))
+
+    def get_node(self, id):
+        return self.api_request(
+            url=URL_NODE.format(url=self.url, id=id),
+            method="GET",
+            json_response=True,
+            accept_404=True,
+        )
+
+    #
+    # Streaming
+    #
+    def open_stream(self, url, accept_404=False):
+        """
+        Sends a GET and returns a transport.StreamResponse to read the body as it arrives,
+        or None on a 404 with accept_404. The caller closes it and records its metrics.
+        """
+        start = time.monotonic()
+        try:
+            return self.transport.stream(url, "GET", headers=self.headers, timeout=self.connection_timeout)
+
+        except HTTPError as e:
+            response_bytes = e.read()
+            response_body = response_bytes.decode("utf-8")
+            debug.log_metrics(
+                "GET",
+                url,
+                e.code,
+                None,
+                len(response_bytes),
+                time.monotonic() - start,
+                endpoint=endpoint_template,
+            )
+            debug.log_request(self.module, url, "GET", None, e.code, response_body)
+            if e.code == 401 or e.code == 403:
+                self.module.fail_json(msg=f"Not Authorized: status={e.code} [GET] {url} ->\n{response_body}")
+            if e.code == 404 and accept_404:
+                return None
+            self.module.fail_json(msg=f"Error: status={e.code} [GET] {url} ->\n{response_body}")
+
+        except Exception as e:
+            debug.log_metrics("GET", url, None, None, 0, time.monotonic() - start, endpoint=endpoint_template)
+            self.module.fail_json(msg=f"Could not make API call: [GET] {url} ->\n{str(e)}")
+
+    def iter_list(self, url, accept_404=False):
+        """
+        Yields the items of the json list at url while the response is still being read,
+        so peak memory does not grow with the list. Stop iterating to skip the rest of it.
+        """
+        start = time.monotonic()
+        response = self.open_stream(url, accept_404=accept_404)
+        if response is None:
+            return
+        self.last_index = parse_index(response.headers)
+        try:
+            yield from utils.iter_json_list(response.read)
+        except ValueError as e:
+            self.module.fail_json(msg=f"API returned invalid JSON: {str(e)}")
+        except (HTTPException, OSError) as e:
+            self.module.fail_json(msg=f"Could not make API call: [GET] {url} ->\n{str(e)}")
+        finally:
+            response.close()
+            debug.log_metrics(
+                "GET",
+                url,
+                response.getcode(),
+                None,
+                response.bytes_read,
+                time.monotonic() - start,
+                endpoint=endpoint_template,
+            )
+            debug.log_request(self.module, url, "GET", None, response.getcode(), "<streamed list>")
+
+    #
+    # Events
+    #
+    def open_event_stream(self, topics, index=0):
+        """returns a transport.StreamResponse of /v1/event/stream for the topics (e.g. Deployment:<id>)"""
+        url = URL_EVENT_STREAM.format(url=self.url, namespace=quote_plus(self.namespace), index=index)
+        url += "".join(f"&topic={quote_plus(topic)}" for topic in topics)
+        start = time.monotonic()
+        response = self.open_stream(url)
+        debug.log_metrics(
+            "GET",
+            url,
+            response.getcode(),
+            None,
+            0,
+            time.monotonic() - start,
+            endpoint=endpoint_template,
+        )
+        debug.log_request(self.module, url, "GET", None, response.getcode(), "<event stream>")
+        return response
+
+    def stream_events(self, topics, index=0, timeout=None):
+        """
+        Yields the event batches ({"Index": ..., "Events": [...]}) of the event stream as they arrive.
+        Each NDJSON line is decoded on its own, so a batch is handed over as soon as its line is complete.
+        A stream that breaks or misses its heartbeats is reopened from the last index seen.
+        The generator ends once timeout seconds have passed.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            response = self.open_event_stream(topics, index)
+            try:
+                while True:
+                    read_timeout = EVENT_STREAM_READ_TIMEOUT
+                    if deadline is not None:
+                        read_timeout = min(read_timeout, deadline - time.monotonic())
+                        if read_timeout <= 0:
+                            return
+                    response.settimeout(read_timeout)
+                    try:
+                        line = response.readline()
+                    except (HTTPException, OSError):
+                        break
+                    if not line:
+                        break
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        batch = json.loads(line)
+                    except ValueError as e:
+                        self.module.fail_json(msg=f"API returned invalid JSON in event stream: {str(e)}")
+                    # heartbeats are empty objects
+                    if batch.get("Index") is not None:
+                        self.last_index = batch["Index"]
+                        index = batch["Index"] + 1
+                    if batch.get("Events"):
+                        yield batch
+            finally:
+                response.close()
+
+            delay = EVENT_STREAM_RETRY_DELAY
+            if deadline is not None:
+                delay = min(delay, deadline - time.monotonic())
+                if delay <= 0:
+                    return
+            time.sleep(delay)
+
+
+def parse_index(headers):
+    """returns the X-Nomad-Index from response headers as an int, or None"""
+    try:
+        return int(headers.get(INDEX_HEADER))
+    except (AttributeError, TypeError, ValueError):
+        return None
@@ -0,0 +1,82 @@
+# Copyright (c) George Bolo <gbolo@linuxctl.com>
+# SPDX-License-Identifier: MIT
+
+
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+#
+# Helpers for modules that fan out API calls over a bounded thread pool.
+#
+# NomadAPI and ConsulAPI take an AnsibleModule and call fail_json on errors,
+# which would print a result and exit the whole process from a worker thread.
+# Workers get a ModuleShim instead: it carries its own params (so each item
+# can target e.g. a different namespace) and turns fail_json into an
+# APIError that is collected with the item's result.
+#
+
+DEFAULT_MAX_WORKERS = 8
+
+
+class APIError(Exception):
+    """APIError is raised by ModuleShim.fail_json"""
+
+    def __init__(self, msg, **kwargs):
+        super().__init__(msg)
+        self.msg = msg
+        self.kwargs = kwargs
+
+
+class ModuleShim:
+    """ModuleShim provides the parts of AnsibleModule used by the API classes"""
+
+    def __init__(self, params, parent=None):
+        self.parent = parent
+        self.params = dict(parent.params) if parent is not None else {}
+        self.params.update(params)
+        self.check_mode = parent.check_mode if parent is not None else False
+        self.warnings = []
+
+    def fail_json(self, msg, **kwargs):
+        raise APIError(msg, **kwargs)
+
+    def warn(self, warning):
+        if self.parent is not None:
+            self.parent.warn(warning)
+        else:
+            self.warnings.append(warning)
+
+
+class Outcome:
+    """Outcome is the result of running a function on one item"""
+
+    def __init__(self, item, result=None, error=None, elapsed=0.0):
+        self.item = item
+        self.result = result
+        self.error = error
+        self.elapsed = elapsed
+
+    @property
+    def failed(self):
+        return self.error is not None
+
+
+def run_parallel(func, items, max_workers=DEFAULT_MAX_WORKERS):
+    """
+    Calls func(item) for every item on a bounded thread pool.
+    Returns a list of Outcome in the same order as items. An APIError raised
+    by func is recorded on its Outcome instead of being propagated.
+    """
+
+    def call(item):
+        start = time.monotonic()
+        try:
+            return Outcome(item, result=func(item), elapsed=time.monotonic() - start)
+        except APIError as e:
+            return Outcome(item, error=e.msg, elapsed=time.monotonic() - start)
+
+    items = list(items)
+    if not items:
+        return []
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(items)))) as executor:
+        return list(executor.map(call, items))
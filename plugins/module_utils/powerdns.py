@@ -0,0 +1,132 @@
+# Copyright (c) George Bolo <gbolo@linuxctl.com>
+# SPDX-License-Identifier: MIT
+
+
+import json
+import time
+
+import debug
+import retry
+import transport
+from ansible.module_utils.common.text.converters import to_native
+from ansible.module_utils.six.moves.urllib.error import HTTPError
+from ansible.module_utils.six.moves.urllib.parse import quote
+
+URL_ZONES = "{url}/servers/{server}/zones"
+URL_ZONE = "{url}/servers/{server}/zones/{zone}"
+
+# maps request urls back to the URL_* templates above for the request metrics
+endpoint_template = debug.endpoint_matcher([v for k, v in list(globals().items()) if k.startswith("URL_")])
+
+
+class PowerDNSAPI:
+    """PowerDNSAPI is used to interact with the PowerDNS authoritative server API (the /api/v1 url)"""
+
+    def __init__(self, module):
+        self.module = module
+        # url may be a comma separated list of servers, see retry.Endpoints
+        self.endpoints = retry.Endpoints(self.module.params.get("powerdns_url"))
+        self.url = self.endpoints.current
+        self.server = self.module.params.get("powerdns_server") or "localhost"
+        self.validate_certs = self.module.params.get("powerdns_validate_certs")
+        self.connection_timeout = self.module.params.get("connection_timeout")
+        self.transport = retry.RetryingTransport(
+            transport.get_transport(self.validate_certs),
+            self.endpoints,
+            endpoint=endpoint_template,
+        )
+        debug.attach_metrics(self.module)
+        self.headers = {
+            "Accept": "application/json",
+            "Content-Type": "application/json",
+            "X-API-Key": self.module.params.get("powerdns_api_key"),
+            "User-Agent": "ansible-module-powerdns",
+        }
+
+    def api_request(self, url, method, body=None, json_response=True, ignore_codes=None):
+        """ignore_codes: error status codes for which None is returned"""
+        if ignore_codes is None:
+            ignore_codes = []
+        start = time.monotonic()
+        try:
+            response = self.transport.request(
+                url,
+                method,
+                body=body,
+                headers=self.headers,
+                timeout=self.connection_timeout,
+            )
+            response_bytes = response.read()
+            debug.log_metrics(
+                method,
+                url,
+                response.getcode(),
+                body,
+                len(response_bytes),
+                time.monotonic() - start,
+                endpoint=endpoint_template,
+            )
+            response_body = response_bytes.decode("utf-8")
+            debug.log_request(self.module, url, method, body, response.getcode(), response_body)
+            if json_response and response_body:
+                try:
+                    return json.loads(to_native(response_body))
+                except ValueError as e:
+                    self.module.fail_json(msg=f"API returned invalid JSON: {str(e)}")
+            return response_body
+
+        except HTTPError as e:
+            response_bytes = e.read()
+            debug.log_metrics(
+                method,
+                url,
+                e.code,
+                body,
+                len(response_bytes),
+                time.monotonic() - start,
+                endpoint=endpoint_template,
+            )
+            response_body = response_bytes.decode("utf-8")
+            debug.log_request(self.module, url, method, body, e.code, response_body)
+            if e.code in ignore_codes:
+                return None
+            if e.code == 401 or e.code == 403:
+                self.module.fail_json(msg=f"Not Authorized: status={e.code} [{method}] {url} ->\n{response_body}")
+
+            self.module.fail_json(msg=f"Error: status={e.code} [{method}] {url} ->\n{response_body}")
+
+        except Exception as e:
+            debug.log_metrics(method, url, None, body, 0, time.monotonic() - start, endpoint=endpoint_template)
+            self.module.fail_json(msg=f"Could not make API call: [{method}] {url} ->\n{str(e)}")
+
+    #
+    # Zones
+    #
+    def zone_url(self, zone):
+        return URL_ZONE.format(url=self.url, server=quote(self.server), zone=quote(canonical_name(zone)))
+
+    def get_zone(self, zone):
+        """returns the zone with its rrsets, or None if it does not exist"""
+        # older servers answer an unknown zone with a 422
+        return self.api_request(url=self.zone_url(zone), method="GET", ignore_codes=[404, 422])
+
+    def create_zone(self, body):
+        return self.api_request(
+            url=URL_ZONES.format(url=self.url, server=quote(self.server)),
+            method="POST",
+            body=json.dumps(body),
+        )
+
+    def patch_zone(self, zone, rrsets):
+        """applies all rrset changes (changetype REPLACE or DELETE) of a zone in a single request"""
+        return self.api_request(
+            url=self.zone_url(zone),
+            method="PATCH",
+            body=json.dumps({"rrsets": rrsets}),
+            json_response=False,
+        )
+
+
+def canonical_name(name):
+    """returns name as an absolute (dot terminated) domain name"""
+    return name if name.endswith(".") else name + "."
@@ -0,0 +1,144 @@
+# Copyright (c) George Bolo <gbolo@linuxctl.com>
+# SPDX-License-Identifier: MIT
+
+
+import hashlib
+import json
+import time
+
+import parallel
+
+#
+# The planner shared by the reconciler modules (nomad_acl_reconcile,
+# consul_acl_reconcile). A change is a tuple of (action, name, body, before,
+# mismatches), action being create, update or delete, and the changes of a
+# module are passed around as (kind, change), kind being e.g. "policy".
+#
+# Objects that carry a ModifyIndex are only read with a GET when the module
+# did not write (or verify) them from the same desired body at the
+# ModifyIndex of their stub in the list. The versions a module knows are kept
+# in a cache.FileCache as {name: version(modify_index, body)}.
+#
+
+
+def digest(body):
+    """returns the sha256 of the json body, independent of the order of its keys"""
+    return hashlib.sha256(json.dumps(body, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def version(modify_index, body):
+    """returns the known version of an object written or verified from body"""
+    return {"modify_index": modify_index, "digest": digest(body)}
+
+
+def plan_versioned(module, what, desired, existing, known, get, diff):
+    """
+    Returns the create and update changes of desired, a list of (name, body), against existing,
+    the listed stubs by name, and the number of objects that were read. Only the objects whose
+    known version does not match their stub are read, get(name, stub) is called concurrently.
+    diff(body, current) returns the mismatches of an object, the matching ones are added to known.
+    """
+    changes = []
+    to_check = []
+    for name, body in desired:
+        stub = existing.get(name)
+        if stub is None:
+            changes.append(("create", name, body, None, None))
+        elif known.get(name) != version(stub.get("ModifyIndex"), body):
+            to_check.append((name, body, stub))
+
+    outcomes = parallel.run_parallel(
+        lambda check: get(check[0], check[2]),
+        to_check,
+        max_workers=module.params.get("max_workers"),
+    )
+    for outcome in outcomes:
+        name, body, _ = outcome.item
+        if outcome.failed:
+            module.fail_json(msg=f"could not read {what} {name}: {outcome.error}")
+        current = outcome.result
+        if current is None:
+            changes.append(("create", name, body, None, None))
+            continue
+        mismatches = diff(body, current)
+        if mismatches:
+            changes.append(("update", name, body, current, mismatches))
+        else:
+            known[name] = version(current.get("ModifyIndex"), body)
+
+    return changes, len(to_check)
+
+
+def plan_deletes(existing, keep):
+    """returns a delete change for every (name, object) in existing for which keep(name, object) is false"""
+    return [("delete", name, None, current, None) for name, current in existing if not keep(name, current)]
+
+
+def report(result, changes):
+    """adds the planned changes, and their diff, to the module result"""
+    result["changed"] = len(changes) > 0
+    result["changes"] = [
+        dict({"kind": kind, "action": c[0], "name": c[1]}, **({"fields": [m["path"] for m in c[4]]} if c[4] else {}))
+        for kind, c in changes
+    ]
+    if changes:
+        result["diff"] = {
+            "before": {f"{kind}/{c[1]}": c[3] for kind, c in changes if c[3] is not None},
+            "after": {f"{kind}/{c[1]}": c[2] for kind, c in changes if c[2] is not None},
+        }
+
+
+def apply(module, changes, apply_change, applied=None):
+    """
+    Applies the changes, max_workers at a time: policies before the tokens that link them,
+    deletes last, and nothing is deleted once a create or update failed. apply_change(kind, change)
+    runs in a worker thread, applied(kind, change, result) is called with what it returned.
+    Returns the count of applied changes by action and the errors. In check mode nothing is
+    applied and the planned changes are counted.
+    """
+    counts = {"create": 0, "update": 0, "delete": 0}
+    if module.check_mode:
+        for _, change in changes:
+            counts[change[0]] += 1
+        return counts, []
+
+    phases = [
+        [(kind, c) for kind, c in changes if kind != "token" and c[0] != "delete"],
+        [(kind, c) for kind, c in changes if kind == "token" and c[0] != "delete"],
+        [(kind, c) for kind, c in changes if kind != "policy" and c[0] == "delete"],
+        [(kind, c) for kind, c in changes if kind == "policy" and c[0] == "delete"],
+    ]
+    errors = []
+    for phase in phases:
+        if errors:
+            break
+        outcomes = parallel.run_parallel(
+            lambda change: apply_change(*change),
+            phase,
+            max_workers=module.params.get("max_workers"),
+        )
+        for outcome in outcomes:
+            kind, change = outcome.item
+            if outcome.failed:
+                errors.append(f"{change[0]} {kind} {change[1]}: {outcome.error}")
+                continue
+            counts[change[0]] += 1
+            if applied is not None:
+                applied(kind, change, outcome.result)
+    return counts, errors
+
+
+def stats(module, kinds, checked, counts, errors, start):
+    """returns the stats of a reconciler run, the desired objects of every kind in kinds are counted"""
+    result = {kind: len(module.params.get(kind)) for kind in kinds}
+    result.update(
+        {
+            "policies_checked": checked,
+            "created": counts["create"],
+            "updated": counts["update"],
+            "deleted": counts["delete"],
+            "failed": len(errors),
+            "total_ms": round((time.monotonic() - start) * 1000, 1),
+        }
+    )
+    return result
@@ -0,0 +1,235 @@
+# Copyright (c) George Bolo <gbolo@linuxctl.com>
+# SPDX-License-Identifier: MIT
+
+
+import email.utils
+import os
+import random
+import socket
+import time
+from http.client import HTTPException
+
+import cache
+import debug
+from ansible.module_utils.six.moves.urllib.error import HTTPError, URLError
+
+#
+# A leader election or a restarting server answers with a 5xx or refuses the
+# connection for a few seconds. Instead of failing the task right away, the
+# RetryingTransport sends the request again after an exponential backoff with
+# full jitter (or after the Retry-After the server asked for).
+#
+# Only idempotent methods are retried after the server may have seen the
+# request. Requests that never reached a server (connection refused, unknown
+# host) are safe to send again whatever the method.
+#
+# The url parameter of the modules can be a comma separated list of servers.
+# Connection errors and 502/503/504 move on to the next one, and the server
+# that answered last is remembered on disk (see cache.py), so the following
+# tasks go straight to it:
+#
+# - name: deploy nomad job
+#   nomad_job:
+#     url: https://nomad-1:4646,https://nomad-2:4646,https://nomad-3:4646
+#     ...
+#   environment:
+#     ANSIBLE_API_RETRIES: 5
+#     ANSIBLE_API_RETRY_BACKOFF: 0.5
+#     ANSIBLE_API_RETRY_MAX_DELAY: 10
+#     ANSIBLE_API_RETRY_METHODS: GET,HEAD,OPTIONS
+#     ANSIBLE_API_RETRY_STATUSES: 429,500,502,503,504
+#
+# Every failed attempt is recorded in the debug metrics (see debug.py).
+#
+
+RETRIES_ENV_VAR = "ANSIBLE_API_RETRIES"
+BACKOFF_ENV_VAR = "ANSIBLE_API_RETRY_BACKOFF"
+MAX_DELAY_ENV_VAR = "ANSIBLE_API_RETRY_MAX_DELAY"
+METHODS_ENV_VAR = "ANSIBLE_API_RETRY_METHODS"
+STATUSES_ENV_VAR = "ANSIBLE_API_RETRY_STATUSES"
+
+DEFAULT_RETRIES = 4
+DEFAULT_BACKOFF = 0.5
+DEFAULT_MAX_DELAY = 10.0
+DEFAULT_METHODS = "GET,HEAD,OPTIONS"
+DEFAULT_STATUSES = "429,500,502,503,504"
+
+# statuses that point at the server (or the proxy in front of it), not the cluster
+FAILOVER_STATUSES = [502, 503, 504]
+
+
+def _split(value):
+    return [v.strip() for v in value.split(",") if v.strip()]
+
+
+class RetryPolicy:
+    """RetryPolicy decides whether, and after how long, a failed request is sent again"""
+
+    def __init__(
+        self,
+        retries=DEFAULT_RETRIES,
+        backoff=DEFAULT_BACKOFF,
+        max_delay=DEFAULT_MAX_DELAY,
+        methods=None,
+        statuses=None,
+    ):
+        self.retries = retries
+        self.backoff = backoff
+        self.max_delay = max_delay
+        self.methods = [m.upper() for m in (methods or _split(DEFAULT_METHODS))]
+        self.statuses = statuses or [int(s) for s in _split(DEFAULT_STATUSES)]
+
+    @classmethod
+    def from_env(cls):
+        """returns the policy configured by the environment variables above, falling back to the defaults"""
+        try:
+            return cls(
+                retries=int(os.environ.get(RETRIES_ENV_VAR, DEFAULT_RETRIES)),
+                backoff=float(os.environ.get(BACKOFF_ENV_VAR, DEFAULT_BACKOFF)),
+                max_delay=float(os.environ.get(MAX_DELAY_ENV_VAR, DEFAULT_MAX_DELAY)),
+                methods=_split(os.environ.get(METHODS_ENV_VAR, DEFAULT_METHODS)),
+                statuses=[int(s) for s in _split(os.environ.get(STATUSES_ENV_VAR, DEFAULT_STATUSES))],
+            )
+        except ValueError:
+            return cls()
+
+    def delay(self, attempt, error):
+        """
+        Returns the seconds to wait before attempt number attempt (1 for the first retry)
+        after error, or None if the request must not be sent again.
+        """
+        if attempt > self.retries:
+            return None
+        retry_after = retry_after_seconds(error) if isinstance(error, HTTPError) else None
+        if retry_after is not None:
+            return min(retry_after, self.max_delay)
+        return random.uniform(0, min(self.max_delay, self.backoff * 2 ** (attempt - 1)))
+
+    def should_retry(self, method, error):
+        if isinstance(error, HTTPError):
+            return error.code in self.statuses and method.upper() in self.methods
+        if not_sent(error):
+            return True
+        return method.upper() in self.methods
+
+
+def not_sent(error):
+    """returns True if error happened before the request could reach a server"""
+    if isinstance(error, URLError) and not isinstance(error, HTTPError):
+        error = error.reason
+    return isinstance(error, (ConnectionRefusedError, socket.gaierror))
+
+
+def retry_after_seconds(error):
+    """returns the Retry-After of an HTTPError in seconds, or None"""
+    value = error.headers.get("Retry-After") if error.headers is not None else None
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class Endpoints:
+    """Endpoints is the list of servers behind a comma separated url parameter, starting at the last good one"""
+
+    def __init__(self, url):
+        self.urls = [u.rstrip("/") for u in _split(url or "")] or [url]
+        self._cache = cache.FileCache("api-endpoints", ",".join(self.urls)) if len(self.urls) > 1 else None
+        self.index = 0
+        if self._cache is not None:
+            last = (self._cache.load() or {}).get("url")
+            if last in self.urls:
+                self.index = self.urls.index(last)
+        self._good = self.index
+
+    @property
+    def current(self):
+        return self.urls[self.index]
+
+    def rebase(self, url):
+        """moves url over to the current server"""
+        for base in self.urls:
+            if base != self.current and url.startswith(base):
+                return self.current + url[len(base) :]
+        return url
+
+    def failover(self):
+        """switches to the next server, returns False if there is only one"""
+        if len(self.urls) == 1:
+            return False
+        self.index = (self.index + 1) % len(self.urls)
+        return True
+
+    def succeeded(self):
+        """remembers the current server once it answered"""
+        if self.index != self._good:
+            self._good = self.index
+            if self._cache is not None:
+                self._cache.save({"url": self.current})
+
+
+class RetryingTransport:
+    """RetryingTransport sends the requests of one API object through a transport, retrying them per policy"""
+
+    def __init__(self, transport, endpoints, policy=None, endpoint=None, sleep=time.sleep):
+        self.transport = transport
+        self.endpoints = endpoints
+        self.policy = policy or RetryPolicy.from_env()
+        self.endpoint = endpoint
+        self.sleep = sleep
+
+    def stats(self):
+        return self.transport.stats()
+
+    def close(self):
+        self.transport.close()
+
+    def _call(self, send, url, method, body):
+        attempt = 0
+        tried = set()
+        while True:
+            tried.add(self.endpoints.current)
+            request_url = self.endpoints.rebase(url)
+            start = time.monotonic()
+            try:
+                response = send(request_url)
+                self.endpoints.succeeded()
+                return response
+            except (HTTPError, URLError, HTTPException, OSError) as e:
+                attempt += 1
+                delay = self.policy.delay(attempt, e) if self.policy.should_retry(method, e) else None
+                if delay is None:
+                    if isinstance(e, HTTPError):
+                        # the server answered, just not with a success
+                        self.endpoints.succeeded()
+                    raise
+                status = e.code if isinstance(e, HTTPError) else None
+                # a server that was not tried yet is asked right away
+                if (status is None or status in FAILOVER_STATUSES) and self.endpoints.failover():
+                    if self.endpoints.current not in tried:
+                        delay = 0
+                debug.log_retry(method, request_url, status, body, time.monotonic() - start, delay, self.endpoint)
+                self.sleep(delay)
+
+    def request(self, url, method, body=None, headers=None, timeout=None):
+        return self._call(
+            lambda u: self.transport.request(u, method, body=body, headers=headers, timeout=timeout),
+            url,
+            method,
+            body,
+        )
+
+    def stream(self, url, method, body=None, headers=None, timeout=None):
+        """retries opening the stream, reading it is up to the caller"""
+        return self._call(
+            lambda u: self.transport.stream(u, method, body=body, headers=headers, timeout=timeout),
+            url,
+            method,
+            body,
+        )
@@ -0,0 +1,346 @@
+# Copyright (c) George Bolo <gbolo@linuxctl.com>
+# SPDX-License-Identifier: MIT
+
+
+import io
+import socket
+import ssl
+import threading
+from http.client import HTTPConnection, HTTPException, HTTPSConnection, RemoteDisconnected
+
+from ansible.module_utils.common.text.converters import to_bytes
+from ansible.module_utils.six.moves.urllib.error import HTTPError
+from ansible.module_utils.six.moves.urllib.parse import urlsplit
+from ansible.module_utils.six.moves.urllib.request import getproxies, proxy_bypass
+from ansible.module_utils.urls import open_url
+
+#
+# open_url opens a fresh TCP (and TLS) connection for every single call, so a
+# module like nomad_job pays for five handshakes per run. The PooledTransport
+# keeps connections alive per host and resumes the last TLS session when it
+# does have to reconnect. Both NomadAPI and ConsulAPI share the transports
+# returned by get_transport(), so every API object in a process (threads
+# included) reuses the same connections.
+#
+# Requests that need to go through a proxy are handed over to open_url since
+# it already knows how to deal with them.
+#
+
+DEFAULT_POOL_SIZE = 10
+
+# a server that closed an idle keep-alive connection makes the next request on it fail with
+# one of these before any byte of a response arrived, the request was not processed
+CLOSED_CONNECTION_ERRORS = (RemoteDisconnected, ConnectionResetError, BrokenPipeError, ConnectionAbortedError)
+
+# other failures on a reused connection are only sent again for methods without side effects
+SAFE_METHODS = ["GET", "HEAD", "OPTIONS"]
+
+
+class Response:
+    """Response is a fully read HTTP response with the same accessors as the one returned by open_url"""
+
+    def __init__(self, url, status, reason, headers, body):
+        self.url = url
+        self.status = status
+        self.reason = reason
+        self.headers = headers
+        self._body = body
+
+    def read(self):
+        return self._body
+
+    def getcode(self):
+        return self.status
+
+
+class StreamResponse:
+    """StreamResponse is an HTTP response whose body is read as it arrives, in chunks or line by line (e.g. NDJSON)"""
+
+    def __init__(self, url, response, conn=None, pool=None):
+        self.url = url
+        self.status = response.status
+        self.reason = response.reason
+        self.headers = response.headers
+        self.bytes_read = 0
+        self._response = response
+        self._conn = conn
+        self._pool = pool
+
+    def getcode(self):
+        return self.status
+
+    def read(self, size=-1):
+        data = self._response.read(size)
+        self.bytes_read += len(data)
+        return data
+
+    def readline(self):
+        line = self._response.readline()
+        self.bytes_read += len(line)
+        return line
+
+    def __iter__(self):
+        while True:
+            line = self.readline()
+            if not line:
+                return
+            yield line
+
+    def settimeout(self, timeout):
+        """sets the read timeout for the following lines"""
+        sock = self._conn.sock if self._conn is not None else None
+        if sock is not None:
+            sock.settimeout(timeout)
+
+    def close(self):
+        """returns the connection to its pool if the body was read completely, otherwise closes it"""
+        conn, self._conn = self._conn, None
+        done = conn is not None and self._response.isclosed() and not self._response.will_close
+        self._response.close()
+        if conn is None:
+            return
+        if done and self._pool is not None:
+            self._pool.release(conn)
+        else:
+            conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class _TLSSessionHTTPSConnection(HTTPSConnection):
+    """HTTPSConnection that resumes the last TLS session negotiated by its pool"""
+
+    def __init__(self, host, port, timeout, context, pool):
+        super().__init__(host, port, timeout=timeout, context=context)
+        self._pool = pool
+
+    def connect(self):
+        HTTPConnection.connect(self)
+        self.sock = self._context.wrap_socket(
+            self.sock,
+            server_hostname=self.host,
+            session=self._pool.tls_session,
+        )
+        if self.sock.session_reused:
+            self._pool.count("tls_sessions_reused")
+
+
+class _HostPool:
+    """_HostPool holds the idle keep-alive connections of a single scheme://host:port"""
+
+    def __init__(self, scheme, host, port, context, maxsize):
+        self.scheme = scheme
+        self.host = host
+        self.port = port
+        self.context = context
+        self.maxsize = maxsize
+        self.tls_session = None
+        self.stats = {"connections": 0, "requests": 0, "tls_sessions_reused": 0}
+        self._idle = []
+        self._lock = threading.Lock()
+
+    def acquire(self, timeout):
+        """returns a tuple of (connection, reused)"""
+        with self._lock:
+            self.stats["requests"] += 1
+            if self._idle:
+                conn = self._idle.pop()
+                conn.timeout = timeout
+                if conn.sock is not None:
+                    conn.sock.settimeout(timeout)
+                return conn, True
+            self.stats["connections"] += 1
+
+        if self.scheme == "https":
+            return _TLSSessionHTTPSConnection(self.host, self.port, timeout, self.context, self), False
+        return HTTPConnection(self.host, self.port, timeout=timeout), False
+
+    def count(self, key):
+        with self._lock:
+            self.stats[key] += 1
+
+    def release(self, conn):
+        with self._lock:
+            # TLS 1.3 session tickets only arrive after the handshake, so the
+            # session is picked up once a response has been read.
+            if isinstance(conn, _TLSSessionHTTPSConnection) and conn.sock is not None:
+                self.tls_session = conn.sock.session
+            if len(self._idle) < self.maxsize:
+                self._idle.append(conn)
+                return
+        conn.close()
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.close()
+
+
+class PooledTransport:
+    """PooledTransport sends requests over keep-alive connections, pooled per host"""
+
+    def __init__(self, validate_certs=True, maxsize=DEFAULT_POOL_SIZE):
+        self.validate_certs = validate_certs
+        self.maxsize = maxsize
+        self.context = ssl.create_default_context()
+        if not validate_certs:
+            self.context.check_hostname = False
+            self.context.verify_mode = ssl.CERT_NONE
+        self._fallback = OpenUrlTransport(validate_certs)
+        self._pools = {}
+        self._lock = threading.Lock()
+
+    def _pool_for(self, scheme, host, port):
+        key = (scheme, host, port)
+        with self._lock:
+            pool = self._pools.get(key)
+            if pool is None:
+                pool = _HostPool(scheme, host, port, self.context, self.maxsize)
+                self._pools[key] = pool
+            return pool
+
+    def stats(self):
+        """returns the connection statistics of every host pool, keyed by scheme://host:port"""
+        with self._lock:
+            pools = list(self._pools.values())
+        return {f"{p.scheme}://{p.host}:{p.port}": dict(p.stats) for p in pools}
+
+    def close(self):
+        with self._lock:
+            pools, self._pools = list(self._pools.values()), {}
+        for pool in pools:
+            pool.close()
+
+    def _send(self, url, method, body, headers, timeout):
+        """sends a request and returns a tuple of (pool, connection, response) with the response body unread"""
+        parts = urlsplit(url)
+        port = parts.port or (443 if parts.scheme == "https" else 80)
+        pool = self._pool_for(parts.scheme, parts.hostname, port)
+        path = parts.path or "/"
+        if parts.query:
+            path = f"{path}?{parts.query}"
+        if body is not None:
+            body = to_bytes(body)
+        headers = {k: v for k, v in (headers or {}).items() if v is not None}
+
+        conn, reused = pool.acquire(timeout)
+        try:
+            conn.request(method, path, body=body, headers=headers)
+            return pool, conn, conn.getresponse()
+        except (HTTPException, OSError) as e:
+            conn.close()
+            if not reused or not _resendable(method, e):
+                raise
+        # the server most likely closed an idle keep-alive connection, see _resendable
+        conn, reused = pool.acquire(timeout)
+        try:
+            conn.request(method, path, body=body, headers=headers)
+            return pool, conn, conn.getresponse()
+        except (HTTPException, OSError):
+            conn.close()
+            raise
+
+    def request(self, url, method, body=None, headers=None, timeout=None):
+        parts = urlsplit(url)
+        if parts.scheme not in ("http", "https") or _use_proxy(parts):
+            return self._fallback.request(url, method, body=body, headers=headers, timeout=timeout)
+
+        pool, conn, response = self._send(url, method, body, headers, timeout)
+        try:
+            response_body = response.read()
+        except (HTTPException, OSError):
+            conn.close()
+            raise
+
+        if response.will_close:
+            conn.close()
+        else:
+            pool.release(conn)
+
+        if response.status >= 400:
+            raise HTTPError(url, response.status, response.reason, response.headers, io.BytesIO(response_body))
+
+        return Response(url, response.status, response.reason, response.headers, response_body)
+
+    def stream(self, url, method, body=None, headers=None, timeout=None):
+        """
+        Sends a request and returns a StreamResponse to read the body as it arrives.
+        The connection only goes back to the pool if the body is read completely.
+        """
+        parts = urlsplit(url)
+        if parts.scheme not in ("http", "https") or _use_proxy(parts):
+            return self._fallback.stream(url, method, body=body, headers=headers, timeout=timeout)
+
+        pool, conn, response = self._send(url, method, body, headers, timeout)
+        if response.status >= 400:
+            try:
+                response_body = response.read()
+            finally:
+                conn.close()
+            raise HTTPError(url, response.status, response.reason, response.headers, io.BytesIO(response_body))
+
+        return StreamResponse(url, response, conn, pool)
+
+
+class OpenUrlTransport:
+    """OpenUrlTransport opens a new connection per request via open_url"""
+
+    def __init__(self, validate_certs=True):
+        self.validate_certs = validate_certs
+
+    def stats(self):
+        return {}
+
+    def close(self):
+        pass
+
+    def request(self, url, method, body=None, headers=None, timeout=None):
+        return open_url(
+            url=url,
+            method=method,
+            data=body,
+            headers=headers,
+            timeout=timeout,
+            validate_certs=self.validate_certs,
+        )
+
+    def stream(self, url, method, body=None, headers=None, timeout=None):
+        return StreamResponse(url, self.request(url, method, body=body, headers=headers, timeout=timeout))
+
+
+def _resendable(method, error):
+    """returns True if a request that failed with error on a reused connection can be sent again"""
+    # a timeout says nothing about whether the server got the request, it may still be processing it
+    if isinstance(error, socket.timeout):
+        return False
+    # the server hung up without answering: on request(), or in getresponse() before the response was read
+    if isinstance(error, CLOSED_CONNECTION_ERRORS):
+        return True
+    return method.upper() in SAFE_METHODS
+
+
+def _use_proxy(parts):
+    proxies = getproxies()
+    if parts.scheme not in proxies:
+        return False
+    return not proxy_bypass(parts.netloc)
+
+
+_transports = {}
+_transports_lock = threading.Lock()
+
+
+def get_transport(validate_certs=True):
+    """returns the process wide PooledTransport for the given certificate validation setting"""
+    validate_certs = validate_certs is not False
+    with _transports_lock:
+        transport = _transports.get(validate_certs)
+        if transport is None:
+            transport = PooledTransport(validate_certs=validate_certs)
+            _transports[validate_certs] = transport
+        return transport
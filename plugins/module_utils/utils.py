@@ -2,18 +2,37 @@
 # SPDX-License-Identifier: MIT
 
 
+import codecs
+import json
+import operator
+
+
 def del_none(d):
     """
-    Delete keys with the value ``None`` in a dictionary, recursively.
-    Returns a copy of the input d.
+    Delete keys with the value ``None`` in a dictionary, recursively, also in the
+    dicts inside lists and tuples. Returns a cleaned copy built in a single pass,
+    the input d is left untouched. ``None`` elements of lists are kept.
     """
-    cloned = d.copy()
-    for key, value in list(cloned.items()):
-        if value is None:
-            del cloned[key]
-        elif isinstance(value, dict):
-            del_none(value)
-    return cloned
+    if isinstance(d, dict):
+        return {k: del_none(v) if isinstance(v, _CONTAINERS) else v for k, v in d.items() if v is not None}
+    if isinstance(d, list):
+        return [del_none(v) if isinstance(v, _CONTAINERS) else v for v in d]
+    if isinstance(d, tuple):
+        return tuple(del_none(v) if isinstance(v, _CONTAINERS) else v for v in d)
+    return d
+
+
+_CONTAINERS = (dict, list, tuple)
+
+
+# list elements that are dicts are matched by the first of these keys they
+# carry, so comparing long lists (e.g. token policy links) does not have to
+# try every pair of elements. Elements without any of these keys are first
+# looked up by their canonical json form (e.g. intention permissions).
+LIST_MATCH_KEYS = ("ID", "AccessorID", "Name")
+
+# below this many superset elements a plain scan is cheaper than an index
+LIST_INDEX_THRESHOLD = 8
 
 
 def is_subset(subset, superset):
@@ -36,7 +55,345 @@ def is_subset(subset, superset):
     if isinstance(subset, dict):
         return all(key in superset and is_subset(val, superset[key]) for key, val in subset.items())
     elif isinstance(subset, list):
+        if isinstance(superset, list) and len(superset) > LIST_INDEX_THRESHOLD:
+            return _is_list_subset_indexed(subset, superset)
         return all(any(is_subset(subitem, superitem) for superitem in superset) for subitem in subset)
     # assume that subset is a plain value if none of the above match
     else:
         return subset == superset
+
+
+def _is_list_subset_indexed(subset, superset):
+    """
+    Same result as the pairwise list comparison in is_subset, in near linear time.
+    Plain values are looked up in a set of the hashable superset elements, dicts
+    only get compared with the superset dicts that share their match key and
+    anything else is looked up by its canonical form before falling back to a scan.
+    """
+    scalars = None
+    canonical = None
+    keyed = {}
+
+    for subitem in subset:
+        if _is_hashable(subitem):
+            if scalars is None:
+                scalars = {superitem for superitem in superset if _is_hashable(superitem)}
+            if subitem in scalars:
+                continue
+            # unhashable superset elements can never equal a plain value
+            return False
+
+        candidates = superset
+        if isinstance(subitem, dict):
+            key = next((k for k in LIST_MATCH_KEYS if _is_hashable(subitem.get(k, []))), None)
+            if key is not None:
+                if key not in keyed:
+                    keyed[key] = _index_by(superset, key)
+                candidates = keyed[key].get(subitem[key], ())
+
+        if candidates is superset:
+            if canonical is None:
+                canonical = {_canonical(superitem) for superitem in superset}
+            if _canonical(subitem) in canonical:
+                continue
+
+        if not any(is_subset(subitem, superitem) for superitem in candidates):
+            return False
+    return True
+
+
+def _index_by(items, key):
+    """groups the dict items by their (hashable) value of key"""
+    index = {}
+    for item in items:
+        if isinstance(item, dict) and _is_hashable(item.get(key, [])):
+            index.setdefault(item[key], []).append(item)
+    return index
+
+
+def _canonical(value):
+    return json.dumps(value, sort_keys=True, default=str)
+
+
+def _is_hashable(value):
+    return isinstance(value, (str, int, float, bool, type(None)))
+
+
+# marks a key that is missing in the existing object
+_MISSING = object()
+
+
+class Comparator:
+    """
+    Comparator is a desired object compiled once into the checks is_subset would make,
+    so it can be compared with many existing objects, or the same one several times,
+    without walking the desired object again. None values are dropped like del_none
+    does, also in dicts nested in lists, and tuples are compared as lists.
+
+    matches(existing) gives the same answer as is_subset(desired, existing), with list
+    elements matched by LIST_MATCH_KEYS. diff(existing) lists the mismatching paths only.
+    """
+
+    __slots__ = ("desired", "is_dict", "keys", "values", "getter", "present", "nested", "list_check")
+
+    def __init__(self, desired):
+        self.desired = desired
+        self.is_dict = isinstance(desired, dict)
+        # the plain values of a dict are fetched with getter and compared in one go
+        self.keys = ()
+        self.values = ()
+        self.getter = None
+        # keys of empty dicts and lists, they only need to be there
+        self.present = ()
+        # (key, Comparator or _ListCheck) of the nested dicts and lists
+        self.nested = ()
+        self.list_check = None
+        if not self.is_dict:
+            if isinstance(desired, (list, tuple)):
+                self.list_check = _ListCheck(desired)
+            return
+
+        keys = []
+        values = []
+        for key, value in desired.items():
+            if value is None:
+                continue
+            if not isinstance(value, (dict, list, tuple)):
+                keys.append(key)
+                values.append(value)
+            elif not value:
+                self.present += (key,)
+            elif isinstance(value, dict):
+                self.nested += ((key, Comparator(value)),)
+            else:
+                self.nested += ((key, _ListCheck(value)),)
+        if keys:
+            self.keys = keys
+            self.getter = operator.itemgetter(*keys)
+            # itemgetter returns a plain value, not a tuple, for a single key
+            self.values = tuple(values) if len(values) > 1 else values[0]
+
+    def matches(self, existing):
+        """returns True if the desired object is part of existing"""
+        if not self.is_dict:
+            if self.list_check is not None:
+                return not self.list_check.desired or self.list_check.matches(existing)
+            return self.desired == existing
+        if not isinstance(existing, dict):
+            return not (self.getter or self.present or self.nested)
+        if self.getter is not None:
+            try:
+                if self.getter(existing) != self.values:
+                    return False
+            except KeyError:
+                return False
+        for key in self.present:
+            if key not in existing:
+                return False
+        for key, check in self.nested:
+            if key not in existing or not check.matches(existing[key]):
+                return False
+        return True
+
+    def diff(self, existing):
+        """
+        Returns the mismatches as a list of {"path", "desired", "existing"} dicts, empty if
+        matches(existing). existing is None for the paths (or list elements) it lacks.
+        """
+        return [dict(m, path=_format_path(m["path"])) for m in self._diff(existing)]
+
+    def _diff(self, existing):
+        if self.matches(existing):
+            return []
+        if self.list_check is not None:
+            return self.list_check._diff(existing)
+        if not self.is_dict or not isinstance(existing, dict):
+            return [{"path": (), "desired": self.desired, "existing": existing}]
+        mismatches = []
+        for key in self.keys:
+            value = self.desired[key]
+            current = existing.get(key, _MISSING)
+            if current != value:
+                mismatches.append({"path": (key,), "desired": value, "existing": existing.get(key)})
+        for key in self.present:
+            if key not in existing:
+                mismatches.append({"path": (key,), "desired": self.desired[key], "existing": None})
+        for key, check in self.nested:
+            if key not in existing:
+                mismatches.append({"path": (key,), "desired": check.desired, "existing": None})
+            else:
+                mismatches.extend(dict(m, path=(key,) + m["path"]) for m in check._diff(existing[key]))
+        return mismatches
+
+
+class _ListCheck:
+    """the desired elements of a list, grouped by how they are looked up in the existing list"""
+
+    __slots__ = ("desired", "scalars", "keyed", "other", "_canonical")
+
+    def __init__(self, desired):
+        self.desired = list(desired)
+        self.scalars = []
+        # (match key, key value, Comparator) of the dict elements that carry a match key
+        self.keyed = []
+        # (index, Comparator) of the other elements
+        self.other = []
+        # canonical forms of the other elements, see matches
+        self._canonical = None
+        for i, item in enumerate(self.desired):
+            if _is_hashable(item):
+                self.scalars.append(item)
+                continue
+            key = None
+            if isinstance(item, dict):
+                for match_key in LIST_MATCH_KEYS:
+                    if isinstance(item.get(match_key), (str, int, float, bool)):
+                        key = match_key
+                        break
+            if key is not None:
+                self.keyed.append((key, item[key], Comparator(item)))
+            else:
+                self.other.append((i, Comparator(item)))
+
+    def matches(self, existing):
+        if not isinstance(existing, (list, tuple)):
+            return False
+        large = len(existing) > LIST_INDEX_THRESHOLD
+        if self.scalars:
+            present = {item for item in existing if _is_hashable(item)} if large else existing
+            for item in self.scalars:
+                if item not in present:
+                    return False
+        index = {}
+        for key, key_value, comparator in self.keyed:
+            if large:
+                if key not in index:
+                    index[key] = _index_by(existing, key)
+                candidates = index[key].get(key_value, ())
+            else:
+                candidates = existing
+            if not any(comparator.matches(item) for item in candidates):
+                return False
+        if self.other:
+            # equal elements are found by their canonical form before falling back to a scan
+            if self._canonical is None:
+                self._canonical = [_canonical(del_none(comparator.desired)) for _, comparator in self.other]
+            canonical = {_canonical(item) for item in existing}
+            for (_, comparator), form in zip(self.other, self._canonical):
+                if form not in canonical and not any(comparator.matches(item) for item in existing):
+                    return False
+        return True
+
+    def _diff(self, existing):
+        """mismatches with paths relative to the list, list elements are selected by [key=value] or [index]"""
+        if self.matches(existing):
+            return []
+        if not isinstance(existing, (list, tuple)):
+            return [{"path": (), "desired": self.desired, "existing": existing}]
+        mismatches = []
+        present = {item for item in existing if _is_hashable(item)}
+        for item in self.scalars:
+            if item not in present:
+                mismatches.append({"path": ((item,),), "desired": item, "existing": None})
+        index = {}
+        for key, key_value, comparator in self.keyed:
+            if key not in index:
+                index[key] = _index_by(existing, key)
+            found = index[key].get(key_value, ())
+            if any(comparator.matches(item) for item in found):
+                continue
+            selector = ((key, key_value),)
+            if not found:
+                mismatches.append({"path": selector, "desired": comparator.desired, "existing": None})
+                continue
+            # the element is there, only some of its fields differ
+            mismatches.extend(dict(m, path=selector + m["path"]) for m in comparator._diff(found[0]))
+        for i, comparator in self.other:
+            if not any(comparator.matches(item) for item in existing):
+                mismatches.append({"path": ((i,),), "desired": comparator.desired, "existing": None})
+        return mismatches
+
+
+def _format_path(path):
+    """formats a path like Policies[Name=policy-1].Rules"""
+    formatted = ""
+    for segment in path:
+        if isinstance(segment, tuple):
+            formatted += "[" + "=".join(str(s) for s in segment) + "]"
+        else:
+            formatted += ("." if formatted else "") + str(segment)
+    return formatted
+
+
+# bytes read from a streamed response at a time by iter_json_list
+JSON_STREAM_CHUNK_SIZE = 64 * 1024
+JSON_WHITESPACE = " \t\n\r"
+JSON_NUMBER_CHARS = "0123456789+-.eE"
+
+
+def iter_json_list(read, chunk_size=JSON_STREAM_CHUNK_SIZE):
+    """
+    Yields the items of a json list while it is being read with read(size) -> bytes.
+    Only the unparsed part of the current chunk and the current item are kept in
+    memory, so the caller can stop early and peak memory does not grow with the
+    size of the list. A null body yields nothing. Raises ValueError on invalid json.
+    """
+    decoder = json.JSONDecoder()
+    utf8 = codecs.getincrementaldecoder("utf-8")()
+    buffer = ""
+    pos = 0
+    eof = False
+
+    def fill():
+        nonlocal buffer, pos, eof
+        chunk = read(chunk_size)
+        eof = not chunk
+        buffer = buffer[pos:] + utf8.decode(chunk, final=eof)
+        pos = 0
+
+    def next_char():
+        """skips whitespace and returns the next character, or None at the end of the body"""
+        nonlocal pos
+        while True:
+            while pos < len(buffer) and buffer[pos] in JSON_WHITESPACE:
+                pos += 1
+            if pos < len(buffer) or eof:
+                return buffer[pos] if pos < len(buffer) else None
+            fill()
+
+    first = next_char()
+    if first != "[":
+        # nomad and consul answer some empty lists with null
+        if first == "n":
+            while len(buffer) - pos < 4 and not eof:
+                fill()
+            if buffer[pos:].strip() == "null":
+                return
+        raise ValueError(f"expected a json list, got {buffer[pos:pos + 20]!r}")
+    pos += 1
+
+    if next_char() == "]":
+        return
+    while True:
+        if next_char() is None:
+            raise ValueError("unexpected end of json list")
+        try:
+            item, end = decoder.raw_decode(buffer, pos)
+        except ValueError:
+            if eof:
+                raise
+            fill()
+            continue
+        if not eof and isinstance(item, (int, float)) and (end == len(buffer) or buffer[end] in JSON_NUMBER_CHARS):
+            # the number could continue in the next chunk
+            fill()
+            continue
+        pos = end
+        yield item
+
+        separator = next_char()
+        if separator == "]":
+            return
+        if separator != ",":
+            raise ValueError(f"expected , or ] in json list, got {separator!r}")
+        pos += 1
@@ -0,0 +1,387 @@
+#!/usr/bin/python
+# Copyright (c) George Bolo <gbolo@linuxctl.com>
+# SPDX-License-Identifier: MIT
+
+
+import fnmatch
+import json
+import time
+
+from ansible.module_utils.basic import AnsibleModule, env_fallback
+
+from ..module_utils import reconcile
+from ..module_utils.consul import ConsulAPI
+from ..module_utils.parallel import DEFAULT_MAX_WORKERS, ModuleShim
+from ..module_utils.utils import Comparator, del_none
+
+#
+# Reconciles the full set of consul ACL policies, ACL tokens and connect
+# intentions in a single task. The existing policies, tokens and intentions
+# are listed once (three requests), the diff is computed in memory and only
+# the changes are applied, max_workers at a time. Policies are compared
+# without a GET when they were last written (or verified) by this module from
+# the same desired policy and their ModifyIndex did not move since. Tokens are
+# matched by description, intentions by source and destination.
+#
+# With prune, the policies, tokens and intentions that are not in the desired
+# set are deleted. Builtin policies, tokens linked to global-management, the
+# anonymous token and the token the module runs with never are. prune_exclude
+# takes shell style patterns of policy names, token descriptions and
+# "source -> destination" intentions to keep as well:
+#
+# - name: consul acls and intentions
+#   consul_acl_reconcile:
+#     policies:
+#       - name: nomad-service-identity
+#         description: Policy for Nomad to create service identity tokens
+#         rules: "{{ lookup('file', 'nomad-service-identity.hcl') }}"
+#     tokens:
+#       - description: nomad server lloyd
+#         policies: [nomad-service-identity]
+#     intentions: "{{ intention_matrix }}"
+#     prune: [intentions]
+#     prune_exclude: ["_nomad_si *"]
+#
+
+GLOBAL_MANAGEMENT_POLICY_ID = "00000000-0000-0000-0000-000000000001"
+# global-management and builtin/global-read-only
+BUILTIN_POLICY_IDS = [GLOBAL_MANAGEMENT_POLICY_ID, "00000000-0000-0000-0000-000000000002"]
+ANONYMOUS_TOKEN_ID = "00000000-0000-0000-0000-000000000002"
+
+POLICY_SPEC = {
+    "name": {"type": "str", "required": True},
+    "description": {"type": "str"},
+    "rules": {"type": "str", "required": True},
+    "datacenters": {"type": "list", "elements": "str"},
+}
+
+TOKEN_SPEC = {
+    "description": {"type": "str", "required": True},
+    "policies": {"type": "list", "elements": "str", "default": []},
+    "roles": {"type": "list", "elements": "str", "default": []},
+    "service_identities": {
+        "type": "list",
+        "elements": "dict",
+        "default": [],
+        "options": {
+            "service_name": {"type": "str", "required": True},
+            "datacenters": {"type": "list", "elements": "str"},
+        },
+    },
+    "is_local": {"type": "bool", "default": False},
+    "expiration_ttl": {"type": "str"},
+}
+
+INTENTION_SPEC = {
+    "source": {"type": "str", "required": True},
+    "destination": {"type": "str", "required": True},
+    "description": {"type": "str"},
+    "action": {"type": "str", "choices": ["allow", "deny"]},
+    "permissions": {"type": "list", "elements": "dict"},
+}
+
+
+def policy_body(item):
+    return del_none(
+        {
+            "Name": item["name"],
+            "Description": item.get("description"),
+            "Rules": item["rules"],
+            "Datacenters": item.get("datacenters"),
+        }
+    )
+
+
+def token_body(item):
+    return del_none(
+        {
+            "Description": item["description"],
+            "Policies": [{"Name": name} for name in item["policies"]],
+            "Roles": [{"Name": name} for name in item["roles"]],
+            "ServiceIdentities": [
+                del_none({"ServiceName": s["service_name"], "Datacenters": s.get("datacenters")})
+                for s in item["service_identities"]
+            ],
+            "Local": item["is_local"],
+        }
+    )
+
+
+def intention_name(source, destination):
+    return f"{source} -> {destination}"
+
+
+def intention_body(item):
+    return del_none(
+        {
+            "SourceType": "consul",
+            "Description": item.get("description"),
+            "Action": item.get("action"),
+            "Permissions": item.get("permissions"),
+        }
+    )
+
+
+def token_diff(body, existing):
+    """
+    Returns the mismatches of the token, see utils.Comparator.diff. The links of a token
+    are compared by name as consul adds their IDs, and as a whole, since a link removed
+    from the desired token is a change.
+    """
+
+    def names(links):
+        return sorted(link.get("Name") for link in links or [])
+
+    def identities(links):
+        return sorted((s.get("ServiceName"), sorted(s.get("Datacenters") or [])) for s in links or [])
+
+    mismatches = []
+    for field, key in (("Policies", names), ("Roles", names), ("ServiceIdentities", identities)):
+        if key(body[field]) != key(existing.get(field)):
+            mismatches.append({"path": field, "desired": body[field], "existing": existing.get(field)})
+    if body["Local"] != bool(existing.get("Local")):
+        mismatches.append({"path": "Local", "desired": body["Local"], "existing": existing.get("Local")})
+    return mismatches
+
+
+def excluded(module, name):
+    return any(fnmatch.fnmatchcase(name, pattern) for pattern in module.params.get("prune_exclude"))
+
+
+def plan_policies(module, consul, desired, prune):
+    """returns the policy changes, the known policy versions and the number of policies read"""
+    existing = {p["Name"]: p for p in consul.get_acl_policies() or []}
+    known = consul.acl_policy_cache().load() or {}
+
+    def get_policy(name, stub):
+        return ConsulAPI(ModuleShim({}, parent=module)).get_acl_policy(stub["ID"])
+
+    changes, checked = reconcile.plan_versioned(
+        module,
+        "consul acl policy",
+        [(item["name"], policy_body(item)) for item in desired],
+        existing,
+        known,
+        get_policy,
+        lambda body, current: Comparator(body).diff(current),
+    )
+
+    if prune:
+        desired_names = {item["name"] for item in desired}
+
+        def keep(name, stub):
+            return name in desired_names or stub["ID"] in BUILTIN_POLICY_IDS or excluded(module, name)
+
+        changes += reconcile.plan_deletes(sorted(existing.items()), keep)
+
+    return changes, known, checked
+
+
+def plan_tokens(module, consul, desired, prune):
+    """returns the token changes as (action, description, body, before, mismatches)"""
+    existing = {}
+    undescribed = []
+    for token in consul.get_acl_tokens():
+        if token.get("Description"):
+            # the first token wins when descriptions are not unique
+            existing.setdefault(token["Description"], token)
+        else:
+            undescribed.append(token)
+
+    changes = []
+    for item in desired:
+        body = token_body(item)
+        current = existing.get(item["description"])
+        if current is None:
+            if item.get("expiration_ttl") is not None:
+                body["ExpirationTTL"] = item["expiration_ttl"]
+            changes.append(("create", item["description"], body, None, None))
+            continue
+        mismatches = token_diff(body, current)
+        if mismatches:
+            update = dict(body, AccessorID=current["AccessorID"])
+            changes.append(("update", item["description"], update, current, mismatches))
+
+    if prune:
+        desired_descriptions = {item["description"] for item in desired}
+        self_token = consul.get_self_token() or {}
+
+        def keep(name, token):
+            return (
+                token["AccessorID"] in (ANONYMOUS_TOKEN_ID, self_token.get("AccessorID"))
+                or any(p.get("ID") == GLOBAL_MANAGEMENT_POLICY_ID for p in token.get("Policies") or [])
+                or name in desired_descriptions
+                or excluded(module, name)
+            )
+
+        tokens = sorted(existing.values(), key=lambda t: t["Description"]) + undescribed
+        changes += reconcile.plan_deletes([(t.get("Description") or t["AccessorID"], t) for t in tokens], keep)
+
+    return changes
+
+
+def plan_intentions(module, consul, desired, prune):
+    """returns the intention changes as (action, "source -> destination", body, before, mismatches)"""
+    existing = {
+        intention_name(i["SourceName"], i["DestinationName"]): i for i in consul.get_connect_intentions() or []
+    }
+
+    changes = []
+    for item in desired:
+        name = intention_name(item["source"], item["destination"])
+        body = intention_body(item)
+        current = existing.get(name)
+        if current is None:
+            changes.append(("create", name, body, None, None))
+            continue
+        mismatches = Comparator(body).diff(current)
+        if mismatches:
+            changes.append(("update", name, body, current, mismatches))
+
+    if prune:
+        desired_names = {intention_name(item["source"], item["destination"]) for item in desired}
+        changes += reconcile.plan_deletes(
+            sorted(existing.items()), lambda name, _: name in desired_names or excluded(module, name)
+        )
+
+    return changes
+
+
+def apply_change(module, kind, change):
+    """applies a single change in a worker thread, returns the X-Consul-Index of the write and the response"""
+    action, name, body, before, _ = change
+    consul = ConsulAPI(ModuleShim({}, parent=module))
+    response = None
+    if kind == "policy":
+        if action == "create":
+            response = consul.create_acl_policy(json.dumps(body))
+        elif action == "update":
+            response = consul.update_acl_policy(before["ID"], json.dumps(dict(body, ID=before["ID"])))
+        else:
+            consul.delete_acl_policy(before["ID"])
+    elif kind == "token":
+        if action == "create":
+            response = consul.create_acl_token(json.dumps(body))
+        elif action == "update":
+            response = consul.update_acl_token(body["AccessorID"], json.dumps(body))
+        else:
+            consul.delete_acl_token(before["AccessorID"])
+    else:
+        source, destination = name.split(" -> ", 1)
+        if action == "delete":
+            consul.delete_connect_intention(source=source, destination=destination)
+        else:
+            consul.create_or_update_connect_intention(source=source, destination=destination, body=json.dumps(body))
+    return consul.last_index, response
+
+
+def run_module():
+    # define available arguments/parameters a user can pass to the module
+    module_args = {
+        "url": {
+            "type": "str",
+            "required": True,
+            "fallback": (env_fallback, ["CONSUL_HTTP_ADDR"]),
+        },
+        "validate_certs": {"type": "bool", "default": True},
+        "connection_timeout": {"type": "int", "default": 10},
+        "management_token": {
+            "type": "str",
+            "required": True,
+            "no_log": True,
+            "fallback": (env_fallback, ["CONSUL_HTTP_TOKEN"]),
+        },
+        "policies": {"type": "list", "elements": "dict", "options": POLICY_SPEC, "default": []},
+        "tokens": {"type": "list", "elements": "dict", "options": TOKEN_SPEC, "default": []},
+        "intentions": {"type": "list", "elements": "dict", "options": INTENTION_SPEC, "default": []},
+        "prune": {
+            "type": "list",
+            "elements": "str",
+            "choices": ["policies", "tokens", "intentions"],
+            "default": [],
+        },
+        "prune_exclude": {"type": "list", "elements": "str", "default": []},
+        "max_workers": {"type": "int", "default": DEFAULT_MAX_WORKERS},
+    }
+
+    # the AnsibleModule object
+    module = AnsibleModule(argument_spec=module_args, supports_check_mode=True)
+
+    # seed the final result dict in the object. Default nothing changed ;)
+    result = {
+        "changed": False,
+    }
+
+    start = time.monotonic()
+    keys = {
+        "policies": lambda item: item["name"],
+        "tokens": lambda item: item["description"],
+        "intentions": lambda item: intention_name(item["source"], item["destination"]),
+    }
+    for kind, key in keys.items():
+        names = [key(item) for item in module.params.get(kind)]
+        duplicates = sorted({name for name in names if names.count(name) > 1})
+        if duplicates:
+            module.fail_json(msg=f"{kind} are given more than once: {', '.join(duplicates)}")
+    for item in module.params.get("intentions"):
+        if not item.get("action") and not item.get("permissions"):
+            name = intention_name(item["source"], item["destination"])
+            module.fail_json(msg=f"intention {name} needs an action or permissions.")
+
+    # the ConsulAPI can init itself via the module args
+    consul = ConsulAPI(module)
+
+    prune = module.params.get("prune")
+    policy_changes, known_policies, policies_checked = plan_policies(
+        module, consul, module.params.get("policies"), "policies" in prune
+    )
+    token_changes = plan_tokens(module, consul, module.params.get("tokens"), "tokens" in prune)
+    intention_changes = plan_intentions(module, consul, module.params.get("intentions"), "intentions" in prune)
+
+    changes = (
+        [("policy", c) for c in policy_changes]
+        + [("token", c) for c in token_changes]
+        + [("intention", c) for c in intention_changes]
+    )
+    reconcile.report(result, changes)
+
+    created_tokens = {}
+
+    def applied(kind, change, outcome):
+        action, name, body, *_ = change
+        index, response = outcome
+        if kind == "policy":
+            if action == "delete":
+                known_policies.pop(name, None)
+            else:
+                known_policies[name] = reconcile.version((response or {}).get("ModifyIndex", index), body)
+        elif kind == "token" and action == "create" and response is not None:
+            created_tokens[name] = {
+                "AccessorID": response.get("AccessorID"),
+                "SecretID": response.get("SecretID"),
+            }
+
+    counts, errors = reconcile.apply(module, changes, lambda kind, change: apply_change(module, kind, change), applied)
+    if not module.check_mode:
+        result["changed"] = sum(counts.values()) > 0
+    if created_tokens:
+        result["created_tokens"] = created_tokens
+
+    consul.acl_policy_cache().save(known_policies)
+
+    result["stats"] = reconcile.stats(
+        module, ["policies", "tokens", "intentions"], policies_checked, counts, errors, start
+    )
+
+    if errors:
+        module.fail_json(msg="failed to reconcile consul acls: " + "; ".join(errors), **result)
+
+    module.exit_json(**result)
+
+
+def main():
+    run_module()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,221 @@
+#!/usr/bin/python
+# Copyright (c) George Bolo <gbolo@linuxctl.com>
+# SPDX-License-Identifier: MIT
+
+
+import base64
+import hashlib
+import time
+
+from ansible.module_utils.basic import AnsibleModule, env_fallback
+
+from ..module_utils.consul import ConsulAPI, chunk_txn_ops
+
+#
+# Writes many consul KV keys with as few requests as possible. The current
+# values are read with get-tree transaction operations, and only the keys that
+# differ are written, both packed into /v1/txn requests of up to 64
+# operations. Every transaction is atomic, a failed check-and-set rolls back
+# the whole chunk it is part of. KV often holds secrets, so unless hide_values
+# is false the diff shows the sha256 of the values rather than the values:
+#
+# - name: configure powerdns
+#   consul_kv_batch:
+#     prefix: pdns/db
+#     keys:
+#       - key: host
+#         value: postgres.service.consul
+#       - key: port
+#         value: "5432"
+#       - key: password
+#         state: absent
+#
+
+
+def kv_op(verb, key, **kwargs):
+    return {"KV": dict(Verb=verb, Key=key, **kwargs)}
+
+
+def encode(value):
+    return base64.b64encode(value.encode("utf-8")).decode("ascii")
+
+
+def decode(value):
+    if value is None:
+        return ""
+    return base64.b64decode(value).decode("utf-8", errors="replace")
+
+
+def read_keys(consul, keys):
+    """returns the existing KV entries under keys (as prefixes), keyed by key"""
+    existing = {}
+    transactions = 0
+    for chunk in chunk_txn_ops([kv_op("get-tree", key) for key in keys]):
+        response = consul.txn(chunk)
+        transactions += 1
+        if response.get("Errors"):
+            consul.module.fail_json(msg=f"could not read consul KV: {response['Errors']}")
+        for entry in response.get("Results") or []:
+            existing[entry["KV"]["Key"]] = entry["KV"]
+    return existing, transactions
+
+
+def plan_op(item, existing):
+    """returns the transaction operation needed to converge item, or None"""
+    key = item["key"]
+    cas = item.get("cas")
+
+    if item["state"] == "absent":
+        if item.get("recurse"):
+            if any(k.startswith(key) for k in existing):
+                return kv_op("delete-tree", key)
+            return None
+        if key not in existing:
+            return None
+        if cas is not None:
+            return kv_op("delete-cas", key, Index=cas)
+        return kv_op("delete", key)
+
+    current = existing.get(key)
+    flags = item.get("flags")
+    if (
+        current is not None
+        and decode(current.get("Value")) == item["value"]
+        and (flags is None or current.get("Flags", 0) == flags)
+    ):
+        return None
+    extra = {"Value": encode(item["value"])}
+    if flags is not None:
+        extra["Flags"] = flags
+    if cas is not None:
+        return kv_op("cas", key, Index=cas, **extra)
+    return kv_op("set", key, **extra)
+
+
+def shown(value, hide_values):
+    """returns value as it is shown in the diff"""
+    if not hide_values:
+        return value
+    return "sha256:" + hashlib.sha256(value.encode("utf-8")).hexdigest()
+
+
+def run_module():
+    # define available arguments/parameters a user can pass to the module
+    key_spec = {
+        "key": {"type": "str", "required": True},
+        "value": {"type": "str"},
+        "state": {
+            "type": "str",
+            "choices": ["present", "absent"],
+            "default": "present",
+        },
+        "cas": {"type": "int"},
+        "flags": {"type": "int"},
+        "recurse": {"type": "bool", "default": False},
+    }
+    module_args = {
+        "url": {
+            "type": "str",
+            "required": True,
+            "fallback": (env_fallback, ["CONSUL_HTTP_ADDR"]),
+        },
+        "validate_certs": {"type": "bool", "default": True},
+        "connection_timeout": {"type": "int", "default": 10},
+        "management_token": {
+            "type": "str",
+            "required": True,
+            "no_log": True,
+            "fallback": (env_fallback, ["CONSUL_HTTP_TOKEN"]),
+        },
+        "prefix": {"type": "str", "default": ""},
+        "hide_values": {"type": "bool", "default": True},
+        "keys": {
+            "type": "list",
+            "elements": "dict",
+            "options": key_spec,
+            "required": True,
+        },
+    }
+
+    # the AnsibleModule object
+    module = AnsibleModule(argument_spec=module_args, supports_check_mode=True)
+
+    # seed the final result dict in the object. Default nothing changed ;)
+    result = {
+        "changed": False,
+    }
+
+    # the ConsulAPI can init itself via the module args
+    consul = ConsulAPI(module)
+
+    start = time.monotonic()
+    prefix = module.params.get("prefix").strip("/")
+
+    items = []
+    seen = set()
+    for item in module.params.get("keys"):
+        item = dict(item)
+        if prefix:
+            item["key"] = f"{prefix}/{item['key'].lstrip('/')}"
+        if item["state"] == "present" and item.get("value") is None:
+            module.fail_json(msg=f"value is required for key {item['key']} with state present")
+        if item["key"] in seen:
+            module.fail_json(msg=f"key {item['key']} is given more than once")
+        seen.add(item["key"])
+        items.append(item)
+
+    hide_values = module.params.get("hide_values")
+    existing, transactions = read_keys(consul, [item["key"] for item in items])
+
+    ops = []
+    before = {}
+    after = {}
+    for item in items:
+        op = plan_op(item, existing)
+        if op is None:
+            continue
+        ops.append(op)
+        key = item["key"]
+        if key in existing:
+            before[key] = shown(decode(existing[key].get("Value")), hide_values)
+        if item["state"] == "present":
+            after[key] = shown(item["value"], hide_values)
+
+    result["changed"] = len(ops) > 0
+    result["changes"] = [{"key": op["KV"]["Key"], "verb": op["KV"]["Verb"]} for op in ops]
+    if ops:
+        result["diff"] = {"before": before, "after": after}
+
+    errors = []
+    committed = len(ops)
+    if ops and not module.check_mode:
+        committed = 0
+        for chunk in chunk_txn_ops(ops):
+            response = consul.txn(chunk)
+            transactions += 1
+            if not response.get("Errors"):
+                committed += len(chunk)
+            for error in response.get("Errors") or []:
+                errors.append(f"{chunk[error['OpIndex']]['KV']['Key']}: {error['What']}")
+        result["changed"] = committed > 0
+
+    result["stats"] = {
+        "keys": len(items),
+        "changed": committed,
+        "transactions": transactions,
+        "total_ms": round((time.monotonic() - start) * 1000, 1),
+    }
+
+    if errors:
+        # each transaction is atomic, only the chunks with errors were rolled back
+        module.fail_json(msg="consul KV transaction rolled back: " + "; ".join(errors), **result)
+
+    module.exit_json(**result)
+
+
+def main():
+    run_module()
+
+
+if __name__ == "__main__":
+    main()
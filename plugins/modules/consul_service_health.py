@@ -0,0 +1,158 @@
+#!/usr/bin/python
+# Copyright (c) George Bolo <gbolo@linuxctl.com>
+# SPDX-License-Identifier: MIT
+
+
+import time
+
+from ansible.module_utils.basic import AnsibleModule, env_fallback
+
+from ..module_utils.consul import ConsulAPI
+from ..module_utils.parallel import DEFAULT_MAX_WORKERS, ModuleShim, run_parallel
+
+#
+# Returns the healthy instances of many consul services at once, keyed by
+# service name. The services are fetched concurrently from
+# /v1/health/service/<name>, max_workers at a time, by default only the
+# instances whose health checks all pass.
+#
+# With wait, the module waits until every service has at least min_instances
+# healthy instances, or fails after timeout seconds. Instead of polling, every
+# service that is not healthy yet is watched with a blocking query, which
+# consul answers as soon as the health of the service changes. The watches
+# mostly idle, each one gets a thread of its own outside of max_workers:
+#
+# - name: wait for the infrastructure services to become healthy
+#   consul_service_health:
+#     services: "{{ consul_infrastructure_services | map(attribute='name') }}"
+#     wait: true
+#     timeout: 120
+#   register: service_health
+#
+# - name: show where powerdns runs
+#   debug:
+#     msg: "{{ service_health.services.powerdns | map(attribute='Service.Address') }}"
+#
+
+def fetch_service(module, name):
+    """fetches a service in a worker thread"""
+    consul = ConsulAPI(ModuleShim({}, parent=module))
+    instances = consul.get_health_service(name, passing=module.params.get("passing"))
+    return {"instances": instances, "index": consul.last_index, "seen": time.monotonic(), "requests": 1}
+
+
+def watch_service(module, name, fetched, deadline):
+    """watches a service in a worker thread from the index it was fetched at"""
+    consul = ConsulAPI(ModuleShim({}, parent=module))
+    instances, requests = consul.wait_for_health_service(
+        name,
+        module.params.get("min_instances"),
+        deadline,
+        passing=module.params.get("passing"),
+        index=fetched["index"],
+    )
+    return {"instances": instances, "seen": time.monotonic(), "requests": fetched["requests"] + requests}
+
+
+def run_module():
+    # define available arguments/parameters a user can pass to the module
+    module_args = {
+        "url": {
+            "type": "str",
+            "required": True,
+            "fallback": (env_fallback, ["CONSUL_HTTP_ADDR"]),
+        },
+        "validate_certs": {"type": "bool", "default": True},
+        "connection_timeout": {"type": "int", "default": 10},
+        "management_token": {
+            "type": "str",
+            "required": True,
+            "no_log": True,
+            "fallback": (env_fallback, ["CONSUL_HTTP_TOKEN"]),
+        },
+        "services": {"type": "list", "elements": "str", "required": True},
+        "passing": {"type": "bool", "default": True},
+        "min_instances": {"type": "int", "default": 1},
+        "wait": {"type": "bool", "default": False},
+        "timeout": {"type": "int", "default": 300},
+        "max_workers": {"type": "int", "default": DEFAULT_MAX_WORKERS},
+    }
+
+    # the AnsibleModule object
+    module = AnsibleModule(argument_spec=module_args, supports_check_mode=True)
+
+    # seed the final result dict in the object. Default nothing changed ;)
+    result = {
+        "changed": False,
+    }
+
+    start = time.monotonic()
+    deadline = start + module.params.get("timeout")
+    services = list(dict.fromkeys(module.params.get("services")))
+
+    outcomes = run_parallel(
+        lambda name: fetch_service(module, name),
+        services,
+        max_workers=module.params.get("max_workers"),
+    )
+
+    errors = []
+    fetched = {}
+    for outcome in outcomes:
+        if outcome.failed:
+            errors.append(f"{outcome.item}: {outcome.error}")
+        else:
+            fetched[outcome.item] = outcome.result
+
+    min_instances = module.params.get("min_instances")
+    if module.params.get("wait"):
+        # every service that is not healthy yet gets a watch of its own, they idle in blocking queries
+        watch = [name for name, f in fetched.items() if len(f["instances"]) < min_instances]
+        for outcome in run_parallel(
+            lambda name: watch_service(module, name, fetched[name], deadline),
+            watch,
+            max_workers=len(watch),
+        ):
+            if outcome.failed:
+                errors.append(f"{outcome.item}: {outcome.error}")
+                del fetched[outcome.item]
+            else:
+                fetched[outcome.item] = outcome.result
+
+    result["services"] = {}
+    unhealthy = []
+    time_to_healthy = {}
+    for name, f in fetched.items():
+        result["services"][name] = f["instances"]
+        if len(f["instances"]) >= min_instances:
+            time_to_healthy[name] = round((f["seen"] - start) * 1000, 1)
+        else:
+            unhealthy.append(name)
+    result["unhealthy"] = unhealthy
+    if module.params.get("wait"):
+        result["time_to_healthy_ms"] = time_to_healthy
+
+    result["stats"] = {
+        "services": len(services),
+        "healthy": len(services) - len(unhealthy) - len(errors),
+        "requests": sum(f["requests"] for f in fetched.values()),
+        "total_ms": round((time.monotonic() - start) * 1000, 1),
+    }
+
+    if errors:
+        module.fail_json(msg="failed to fetch consul services: " + "; ".join(errors), **result)
+    if module.params.get("wait") and unhealthy:
+        module.fail_json(
+            msg=f"timed out after {module.params.get('timeout')}s waiting for consul services: {', '.join(unhealthy)}",
+            **result,
+        )
+
+    module.exit_json(**result)
+
+
+def main():
+    run_module()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,335 @@
+#!/usr/bin/python
+# Copyright (c) George Bolo <gbolo@linuxctl.com>
+# SPDX-License-Identifier: MIT
+
+
+import ipaddress
+import time
+
+from ansible.module_utils.basic import AnsibleModule, env_fallback
+
+from ..module_utils.netbox import NetboxAPI
+from ..module_utils.parallel import DEFAULT_MAX_WORKERS, ModuleShim, run_parallel
+from ..module_utils.powerdns import PowerDNSAPI, canonical_name
+
+#
+# Syncs the DNS zones and active records of the netbox-dns plugin to a
+# PowerDNS authoritative server. The NetBox lists are paged max_workers pages
+# at a time, and the records are kept in a local state file (see
+# NetboxAPI.sync_dns_records), so after the first run only the records that
+# changed since are transferred. Then every zone is handled on its own,
+# max_workers at a time: its rrsets are read from PowerDNS with a single GET, compared in
+# memory and only the rrsets that differ are written, all in a single PATCH.
+# A zone that does not exist in PowerDNS yet is created with its rrsets in a
+# single POST. A run without changes makes no writes at all.
+#
+# With prune, the rrsets of a zone that are not in NetBox are deleted. The SOA
+# never is, neither is the NS rrset of the zone apex unless NetBox has one:
+#
+# - name: sync netbox dns to powerdns
+#   netbox_powerdns_sync:
+#     netbox_url: https://netbox.example.com
+#     netbox_token: "{{ netbox_token }}"
+#     powerdns_url: http://pdns.service.consul:8081/api/v1
+#     powerdns_api_key: "{{ powerdns_api_key }}"
+#     nameservers: [ns1.example.com]
+#     prune: true
+#
+
+# record types whose content is a domain name, or ends with one
+NAME_TYPES = ["CNAME", "NS", "PTR", "DNAME", "ALIAS"]
+NAME_SUFFIX_TYPES = ["MX", "SRV"]
+QUOTED_TYPES = ["TXT", "SPF"]
+
+DEFAULT_TTL = 3600
+
+
+def normalize_content(rtype, value):
+    """returns value in the canonical form the PowerDNS API returns records in"""
+    value = value.strip()
+    if rtype in NAME_TYPES:
+        return canonical_name(value)
+    if rtype in NAME_SUFFIX_TYPES:
+        fields = value.split()
+        if fields:
+            fields[-1] = canonical_name(fields[-1])
+        return " ".join(fields)
+    if rtype in QUOTED_TYPES and not value.startswith('"'):
+        return '"' + value.replace("\\", "\\\\").replace('"', '\\"') + '"'
+    if rtype == "AAAA":
+        try:
+            return str(ipaddress.IPv6Address(value))
+        except ValueError:
+            return value
+    return value
+
+
+def record_name(record, zone_name):
+    """returns the absolute, lower case owner name of a netbox record"""
+    if record.get("fqdn"):
+        return canonical_name(record["fqdn"].lower())
+    name = (record.get("name") or "@").lower()
+    if name == "@":
+        return canonical_name(zone_name)
+    return canonical_name(f"{name}.{zone_name}")
+
+
+def desired_rrsets(zone, records):
+    """
+    returns the rrsets of a netbox zone keyed by (name, type), as
+    {"ttl": ttl, "records": set of contents}. An rrset has a single TTL, the
+    lowest of its records is used.
+    """
+    zone_name = canonical_name(zone["name"].lower())
+    default_ttl = zone.get("default_ttl") or DEFAULT_TTL
+    rrsets = {}
+    for record in records:
+        rtype = record["type"].upper()
+        if rtype == "SOA":
+            continue
+        key = (record_name(record, zone_name), rtype)
+        ttl = record.get("ttl") or default_ttl
+        rrset = rrsets.setdefault(key, {"ttl": ttl, "records": set()})
+        rrset["ttl"] = min(rrset["ttl"], ttl)
+        rrset["records"].add(normalize_content(rtype, record["value"]))
+    return rrsets
+
+
+def existing_rrsets(pdns_zone):
+    """returns the rrsets of a PowerDNS zone in the same form as desired_rrsets, plus their disabled flag"""
+    rrsets = {}
+    for rrset in pdns_zone.get("rrsets") or []:
+        rtype = rrset["type"].upper()
+        records = rrset.get("records") or []
+        rrsets[(rrset["name"].lower(), rtype)] = {
+            "ttl": rrset.get("ttl"),
+            "records": {normalize_content(rtype, r["content"]) for r in records},
+            "disabled": any(r.get("disabled") for r in records),
+        }
+    return rrsets
+
+
+def rrset_body(key, rrset, changetype=None):
+    name, rtype = key
+    body = {
+        "name": name,
+        "type": rtype,
+        "ttl": rrset["ttl"],
+        "records": [{"content": content, "disabled": False} for content in sorted(rrset["records"])],
+    }
+    if changetype is not None:
+        body["changetype"] = changetype
+    return body
+
+
+def soa_rrset(zone):
+    """returns the SOA rrset of a netbox zone, or None when netbox has no SOA values for it"""
+    mname = zone.get("soa_mname")
+    if isinstance(mname, dict):
+        mname = mname.get("name")
+    if not mname or not zone.get("soa_rname"):
+        return None
+    fields = [canonical_name(mname), canonical_name(zone["soa_rname"])] + [
+        str(zone.get(f) or 0) for f in ("soa_serial", "soa_refresh", "soa_retry", "soa_expire", "soa_minimum")
+    ]
+    name = canonical_name(zone["name"].lower())
+    return rrset_body((name, "SOA"), {"ttl": zone.get("soa_ttl") or DEFAULT_TTL, "records": {" ".join(fields)}})
+
+
+def plan_zone(zone_name, desired, existing, prune):
+    """returns the rrsets to REPLACE and DELETE to converge a zone"""
+    replace = []
+    delete = []
+    for key, rrset in sorted(desired.items()):
+        current = existing.get(key)
+        if (
+            current is None
+            or current["disabled"]
+            or current["ttl"] != rrset["ttl"]
+            or current["records"] != rrset["records"]
+        ):
+            replace.append(rrset_body(key, rrset, changetype="REPLACE"))
+    if prune:
+        for key, rrset in sorted(existing.items()):
+            name, rtype = key
+            if key in desired or rtype == "SOA" or (rtype == "NS" and name == zone_name):
+                continue
+            delete.append({"name": name, "type": rtype, "changetype": "DELETE"})
+    return replace, delete
+
+
+def sync_zone(module, zone, desired):
+    """syncs a single zone in a worker thread, returns the change made (or needed in check mode), or None"""
+    pdns = PowerDNSAPI(ModuleShim({}, parent=module))
+    zone_name = canonical_name(zone["name"].lower())
+    pdns_zone = pdns.get_zone(zone_name)
+
+    if pdns_zone is None:
+        if not module.params.get("create_zones"):
+            return {"zone": zone_name, "action": "missing"}
+        rrsets = [rrset_body(key, rrset) for key, rrset in sorted(desired.items())]
+        soa = soa_rrset(zone)
+        if soa is not None:
+            rrsets.append(soa)
+        body = {"name": zone_name, "kind": module.params.get("zone_kind"), "rrsets": rrsets}
+        # powerdns needs the nameservers of a new zone unless it gets an apex NS rrset
+        if (zone_name, "NS") not in desired:
+            body["nameservers"] = [canonical_name(ns) for ns in module.params.get("nameservers")]
+        if not module.check_mode:
+            pdns.create_zone(body)
+        return {"zone": zone_name, "action": "create", "replace": rrsets}
+
+    existing = existing_rrsets(pdns_zone)
+    replace, delete = plan_zone(zone_name, desired, existing, module.params.get("prune"))
+    if not replace and not delete:
+        return None
+    if not module.check_mode:
+        pdns.patch_zone(zone_name, replace + delete)
+    before = {}
+    for rrset in replace + delete:
+        key = (rrset["name"], rrset["type"])
+        if key in existing:
+            before[key] = rrset_body(key, existing[key])
+    return {"zone": zone_name, "action": "update", "replace": replace, "delete": delete, "before": before}
+
+
+def run_module():
+    # define available arguments/parameters a user can pass to the module
+    module_args = {
+        "netbox_url": {
+            "type": "str",
+            "required": True,
+            "fallback": (env_fallback, ["NETBOX_API", "NETBOX_URL"]),
+        },
+        "netbox_token": {
+            "type": "str",
+            "required": True,
+            "no_log": True,
+            "fallback": (env_fallback, ["NETBOX_TOKEN"]),
+        },
+        "netbox_validate_certs": {"type": "bool", "default": True},
+        "powerdns_url": {
+            "type": "str",
+            "required": True,
+            "fallback": (env_fallback, ["PDNS_API_URL"]),
+        },
+        "powerdns_api_key": {
+            "type": "str",
+            "required": True,
+            "no_log": True,
+            "fallback": (env_fallback, ["PDNS_API_KEY"]),
+        },
+        "powerdns_server": {"type": "str", "default": "localhost"},
+        "powerdns_validate_certs": {"type": "bool", "default": True},
+        "connection_timeout": {"type": "int", "default": 10},
+        "zones": {"type": "list", "elements": "str", "default": []},
+        "create_zones": {"type": "bool", "default": True},
+        "zone_kind": {"type": "str", "choices": ["Native", "Master"], "default": "Native"},
+        "nameservers": {"type": "list", "elements": "str", "default": []},
+        "prune": {"type": "bool", "default": False},
+        "max_workers": {"type": "int", "default": DEFAULT_MAX_WORKERS},
+    }
+
+    # the AnsibleModule object
+    module = AnsibleModule(argument_spec=module_args, supports_check_mode=True)
+
+    # seed the final result dict in the object. Default nothing changed ;)
+    result = {
+        "changed": False,
+    }
+
+    # the NetboxAPI can init itself via the module args
+    netbox = NetboxAPI(module)
+
+    start = time.monotonic()
+    wanted = {canonical_name(z.lower()) for z in module.params.get("zones")}
+    zones = {}
+    for zone in netbox.iter_dns_zones(max_workers=module.params.get("max_workers")):
+        name = canonical_name(zone["name"].lower())
+        if not wanted or name in wanted:
+            zones[name] = zone
+    missing = sorted(wanted - set(zones))
+    if missing:
+        module.fail_json(msg=f"zones not found in netbox: {', '.join(missing)}")
+
+    record_cache = netbox.dns_record_cache()
+    state, record_changes = netbox.sync_dns_records(record_cache.load(), max_workers=module.params.get("max_workers"))
+    record_cache.save(state)
+
+    records = {name: [] for name in zones}
+    record_count = 0
+    for record in state["records"].values():
+        if (record.get("status") or "active") != "active":
+            continue
+        name = canonical_name(((record.get("zone") or {}).get("name") or "").lower())
+        if name in records:
+            records[name].append(record)
+            record_count += 1
+
+    outcomes = run_parallel(
+        lambda name: sync_zone(module, zones[name], desired_rrsets(zones[name], records[name])),
+        sorted(zones),
+        max_workers=module.params.get("max_workers"),
+    )
+
+    errors = []
+    changes = []
+    for outcome in outcomes:
+        if outcome.failed:
+            errors.append(f"{outcome.item}: {outcome.error}")
+        elif outcome.result is not None:
+            changes.append(outcome.result)
+
+    missing_zones = [c["zone"] for c in changes if c["action"] == "missing"]
+    if missing_zones:
+        module.warn(f"zones not in powerdns and create_zones is false: {', '.join(missing_zones)}")
+    changes = [c for c in changes if c["action"] != "missing"]
+
+    result["changed"] = len(changes) > 0
+    result["changes"] = [
+        {
+            "zone": c["zone"],
+            "action": c["action"],
+            "replaced": [f"{r['name']} {r['type']}" for r in c.get("replace", [])],
+            "deleted": [f"{r['name']} {r['type']}" for r in c.get("delete", [])],
+        }
+        for c in changes
+    ]
+    if changes:
+        result["diff"] = {
+            "before": {
+                f"{name} {rtype}": {"ttl": rrset["ttl"], "records": rrset["records"]}
+                for c in changes
+                for (name, rtype), rrset in c.get("before", {}).items()
+            },
+            "after": {
+                f"{r['name']} {r['type']}": {"ttl": r["ttl"], "records": r["records"]}
+                for c in changes
+                for r in c.get("replace", [])
+            },
+        }
+
+    result["stats"] = {
+        "zones": len(zones),
+        "records": record_count,
+        "records_changed": len(record_changes),
+        "zones_created": sum(1 for c in changes if c["action"] == "create"),
+        "zones_updated": sum(1 for c in changes if c["action"] == "update"),
+        "rrsets_replaced": sum(len(c.get("replace", [])) for c in changes),
+        "rrsets_deleted": sum(len(c.get("delete", [])) for c in changes),
+        "failed": len(errors),
+        "total_ms": round((time.monotonic() - start) * 1000, 1),
+    }
+
+    if errors:
+        module.fail_json(msg="failed to sync zones to powerdns: " + "; ".join(errors), **result)
+
+    module.exit_json(**result)
+
+
+def main():
+    run_module()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,280 @@
+#!/usr/bin/python
+# Copyright (c) George Bolo <gbolo@linuxctl.com>
+# SPDX-License-Identifier: MIT
+
+
+import json
+import time
+
+from ansible.module_utils.basic import AnsibleModule, env_fallback
+
+from ..module_utils import reconcile
+from ..module_utils.nomad import NomadAPI
+from ..module_utils.parallel import DEFAULT_MAX_WORKERS, ModuleShim
+from ..module_utils.utils import Comparator, del_none
+
+#
+# Reconciles the full set of nomad ACL policies and tokens in a single task.
+# The existing policies and tokens are listed once, the diff is computed in
+# memory and only the changes are applied, max_workers at a time. Policies
+# are compared without a GET when they were last written (or verified) by
+# this module from the same desired policy and their ModifyIndex did not move
+# since. Tokens are matched by name. With prune, policies and client tokens
+# that are not in the desired set are deleted (management tokens and the
+# token the module runs with never are):
+#
+# - name: nomad acls
+#   nomad_acl_reconcile:
+#     policies:
+#       - name: nomad-client
+#         description: Policy for nomad clients
+#         rules: "{{ lookup('file', 'nomad-client.hcl') }}"
+#     tokens:
+#       - name: traefik
+#         policies: [traefik-read]
+#     prune: [policies]
+#
+
+POLICY_SPEC = {
+    "name": {"type": "str", "required": True},
+    "description": {"type": "str"},
+    "rules": {"type": "str", "required": True},
+    "job_acl": {
+        "type": "dict",
+        "options": {
+            "namespace": {"type": "str", "default": ""},
+            "job_id": {"type": "str", "default": ""},
+            "group": {"type": "str", "default": ""},
+            "task": {"type": "str", "default": ""},
+        },
+    },
+}
+
+TOKEN_SPEC = {
+    "name": {"type": "str", "required": True},
+    "type": {"type": "str", "choices": ["client", "management"], "default": "client"},
+    "policies": {"type": "list", "elements": "str"},
+    "is_global": {"type": "bool", "default": False},
+    "expiration_ttl": {"type": "str"},
+}
+
+
+def policy_body(item):
+    job_acl = item.get("job_acl")
+    return del_none(
+        {
+            "Name": item["name"],
+            "Description": item.get("description"),
+            "Rules": item["rules"],
+            "JobACL": {
+                "Namespace": job_acl["namespace"],
+                "JobID": job_acl["job_id"],
+                "Group": job_acl["group"],
+                "Task": job_acl["task"],
+            }
+            if job_acl
+            else None,
+        }
+    )
+
+
+def token_body(item):
+    return del_none(
+        {
+            "Name": item["name"],
+            "Type": item["type"],
+            "Policies": item.get("policies"),
+            "Global": item["is_global"],
+        }
+    )
+
+
+def policy_diff(body, existing):
+    """returns the mismatches of the policy, see utils.Comparator.diff"""
+    # nomad returns a null JobACL for policies without one
+    return Comparator(body).diff(dict(existing, JobACL=existing.get("JobACL") or {}))
+
+
+def token_diff(body, existing):
+    """the Comparator ignores extra list elements, but a policy removed from the desired token is a change"""
+    mismatches = Comparator(body).diff(existing)
+    if sorted(existing.get("Policies") or []) != sorted(body.get("Policies") or []):
+        mismatches = [m for m in mismatches if not m["path"].startswith("Policies")]
+        mismatches.append({"path": "Policies", "desired": body.get("Policies"), "existing": existing.get("Policies")})
+    return mismatches
+
+
+def plan_policies(module, nomad, desired, prune):
+    """returns the policy changes, the known policy versions and the number of policies read"""
+    existing = {p["Name"]: p for p in nomad.get_acl_policies() or []}
+    known = nomad.acl_policy_cache().load() or {}
+
+    def get_policy(name, stub):
+        return NomadAPI(ModuleShim({}, parent=module)).get_acl_policy(name)
+
+    changes, checked = reconcile.plan_versioned(
+        module,
+        "nomad acl policy",
+        [(item["name"], policy_body(item)) for item in desired],
+        existing,
+        known,
+        get_policy,
+        policy_diff,
+    )
+
+    if prune:
+        desired_names = {item["name"] for item in desired}
+        changes += reconcile.plan_deletes(sorted(existing.items()), lambda name, _: name in desired_names)
+
+    return changes, known, checked
+
+
+def plan_tokens(module, nomad, desired, prune):
+    """returns the token changes as (action, name, body, before, mismatches)"""
+    existing = {}
+    unnamed = []
+    for token in nomad.get_acl_tokens():
+        if token.get("Name"):
+            # the first token wins when names are not unique
+            existing.setdefault(token["Name"], token)
+        else:
+            unnamed.append(token)
+
+    changes = []
+    for item in desired:
+        body = token_body(item)
+        current = existing.get(item["name"])
+        if current is None:
+            if item.get("expiration_ttl") is not None:
+                body["ExpirationTTL"] = item["expiration_ttl"]
+            changes.append(("create", item["name"], body, None, None))
+            continue
+        mismatches = token_diff(body, current)
+        if mismatches:
+            changes.append(("update", item["name"], dict(body, AccessorID=current["AccessorID"]), current, mismatches))
+
+    if prune:
+        names = {item["name"] for item in desired} | set(module.params.get("prune_exclude"))
+        self_token = nomad.get_self_token() or {}
+
+        def keep(_, token):
+            if token.get("Type") == "management" or token.get("AccessorID") == self_token.get("AccessorID"):
+                return True
+            return token.get("Name") in names
+
+        tokens = sorted(existing.values(), key=lambda t: t["Name"]) + unnamed
+        changes += reconcile.plan_deletes([(t.get("Name") or t["AccessorID"], t) for t in tokens], keep)
+
+    return changes
+
+
+def apply_change(module, kind, change):
+    """applies a single change in a worker thread, returns the X-Nomad-Index of the write and the response"""
+    action, name, body, before, _ = change
+    nomad = NomadAPI(ModuleShim({}, parent=module))
+    response = None
+    if kind == "policy":
+        if action == "delete":
+            nomad.delete_acl_policy(name)
+        else:
+            nomad.create_or_update_acl_policy(name, json.dumps(body))
+    elif action == "create":
+        response = nomad.create_acl_token(json.dumps(body))
+    elif action == "update":
+        response = nomad.update_acl_token(body["AccessorID"], json.dumps(body))
+    else:
+        nomad.delete_acl_token(before["AccessorID"])
+    return nomad.last_index, response
+
+
+def run_module():
+    # define available arguments/parameters a user can pass to the module
+    module_args = {
+        "url": {
+            "type": "str",
+            "required": True,
+            "fallback": (env_fallback, ["NOMAD_ADDR"]),
+        },
+        "validate_certs": {"type": "bool", "default": True},
+        "connection_timeout": {"type": "int", "default": 10},
+        "management_token": {
+            "type": "str",
+            "required": True,
+            "no_log": True,
+            "fallback": (env_fallback, ["NOMAD_TOKEN"]),
+        },
+        "policies": {"type": "list", "elements": "dict", "options": POLICY_SPEC, "default": []},
+        "tokens": {"type": "list", "elements": "dict", "options": TOKEN_SPEC, "default": []},
+        "prune": {"type": "list", "elements": "str", "choices": ["policies", "tokens"], "default": []},
+        "prune_exclude": {"type": "list", "elements": "str", "default": []},
+        "max_workers": {"type": "int", "default": DEFAULT_MAX_WORKERS},
+    }
+
+    # the AnsibleModule object
+    module = AnsibleModule(argument_spec=module_args, supports_check_mode=True)
+
+    # seed the final result dict in the object. Default nothing changed ;)
+    result = {
+        "changed": False,
+    }
+
+    start = time.monotonic()
+    for kind in ("policies", "tokens"):
+        names = [item["name"] for item in module.params.get(kind)]
+        duplicates = sorted({name for name in names if names.count(name) > 1})
+        if duplicates:
+            module.fail_json(msg=f"{kind} are given more than once: {', '.join(duplicates)}")
+    for item in module.params.get("tokens"):
+        if item["type"] == "client" and not item.get("policies"):
+            module.fail_json(msg=f"policies are required for nomad acl token {item['name']} of client type.")
+
+    # the NomadAPI can init itself via the module args
+    nomad = NomadAPI(module)
+
+    prune = module.params.get("prune")
+    policy_changes, known_policies, policies_checked = plan_policies(
+        module, nomad, module.params.get("policies"), "policies" in prune
+    )
+    token_changes = plan_tokens(module, nomad, module.params.get("tokens"), "tokens" in prune)
+
+    changes = [("policy", c) for c in policy_changes] + [("token", c) for c in token_changes]
+    reconcile.report(result, changes)
+
+    created_tokens = {}
+
+    def applied(kind, change, outcome):
+        action, name, body, *_ = change
+        index, response = outcome
+        if kind == "policy":
+            if action == "delete":
+                known_policies.pop(name, None)
+            else:
+                known_policies[name] = reconcile.version(index, body)
+        elif action == "create" and response is not None:
+            created_tokens[name] = {
+                "AccessorID": response.get("AccessorID"),
+                "SecretID": response.get("SecretID"),
+            }
+
+    counts, errors = reconcile.apply(module, changes, lambda kind, change: apply_change(module, kind, change), applied)
+    if not module.check_mode:
+        result["changed"] = sum(counts.values()) > 0
+    if created_tokens:
+        result["created_tokens"] = created_tokens
+
+    nomad.acl_policy_cache().save(known_policies)
+
+    result["stats"] = reconcile.stats(module, ["policies", "tokens"], policies_checked, counts, errors, start)
+
+    if errors:
+        module.fail_json(msg="failed to reconcile nomad acls: " + "; ".join(errors), **result)
+
+    module.exit_json(**result)
+
+
+def main():
+    run_module()
+
+
+if __name__ == "__main__":
+    main()
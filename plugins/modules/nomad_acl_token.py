@@ -59,7 +59,7 @@ def run_module():
     # if the acl token is of client type and present, then policies are required
     if module.params.get("type") == "client" and module.params.get("state") == "present":
         policies = module.params.get("policies")
-        if policies is None or policies.len() == 0:
+        if policies is None or len(policies) == 0:
             module.fail_json("policies are required for nomad acl tokens of client type.")
 
     # the NomadAPI can init itself via the module args
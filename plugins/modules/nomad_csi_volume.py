@@ -4,27 +4,236 @@
 
 
 import json
+import time
 
 from ansible.module_utils.basic import AnsibleModule, env_fallback
 
 from ..module_utils.nomad import NomadAPI
-from ..module_utils.utils import del_none, is_subset
+from ..module_utils.parallel import DEFAULT_MAX_WORKERS, APIError, ModuleShim, run_parallel
+from ..module_utils.reconcile import version
+from ..module_utils.utils import Comparator, del_none, is_subset
+
+#
+# Manages a single csi volume (id, name, plugin_id, ...), or many at once
+# with volumes. With volumes, the existing volumes of every namespace are
+# listed once and diffed in memory, and the missing ones are created in a
+# single request per namespace. The volume list does not carry the
+# parameters, capabilities or capacity of a volume, so an existing volume is
+# read with a GET unless this module created (or verified) it from the same
+# desired volume and its ModifyIndex did not move since. A run without
+# changes then takes a single request per namespace:
+#
+# - name: nomad csi volumes
+#   nomad_csi_volume:
+#     volumes:
+#       - id: gitlab-data
+#         name: gitlab-data
+#         plugin_id: nfs
+#         capabilities:
+#           - access_mode: multi-node-multi-writer
+#             attachment_mode: file-system
+#         parameters:
+#           share: /exports/gitlab-data
+#
+
+MOUNT_OPTIONS_SPEC = {
+    "fs_type": {"type": "str", "aliases": ["FSType"]},
+    "mount_flags": {"type": "list", "elements": "str", "aliases": ["MountFlags"]},
+}
+
+CAPABILITIES_SPEC = {
+    "access_mode": {"type": "str", "aliases": ["AccessMode"], "required": True},
+    "attachment_mode": {
+        "type": "str",
+        "aliases": ["AttachmentMode"],
+        "required": True,
+    },
+}
+
+VOLUME_SPEC = {
+    "state": {"type": "str", "choices": ["present", "absent"], "default": "present"},
+    "id": {"type": "str", "required": True},
+    "name": {"type": "str", "required": True},
+    "namespace": {"type": "str"},
+    "plugin_id": {"type": "str", "required": True},
+    "mount_options": {"type": "dict", "options": MOUNT_OPTIONS_SPEC},
+    "capabilities": {
+        "type": "list",
+        "required": True,
+        "elements": "dict",
+        "options": CAPABILITIES_SPEC,
+    },
+    "capacity_gb": {"type": "int"},
+    "parameters": {"type": "dict"},
+}
+
+
+def volume_body(item, namespace):
+    """returns the desired volume of a volume spec, see VOLUME_SPEC"""
+    desired_volume = del_none(
+        {
+            "ID": item.get("id"),
+            "Name": item.get("name"),
+            "Namespace": namespace,
+            "PluginID": item.get("plugin_id"),
+            "Parameters": item.get("parameters"),
+        }
+    )
+    if item.get("capabilities") is not None:
+        capabilities = []
+        for c in item.get("capabilities"):
+            capabilities.append(
+                {
+                    "AccessMode": c.get("access_mode"),
+                    "AttachmentMode": c.get("attachment_mode"),
+                }
+            )
+        desired_volume["RequestedCapabilities"] = capabilities
+
+    if item.get("mount_options") is not None:
+        desired_volume["MountOptions"] = del_none(
+            {
+                "FsType": item.get("mount_options").get("fs_type"),
+                "MountFlags": item.get("mount_options").get("mount_flags"),
+            }
+        )
+
+    if (item.get("capacity_gb") or 0) > 0:
+        # TODO: for now we set both the min and max to the same value.
+        #       add support for distinct values.
+        volume_size = item.get("capacity_gb") * 1024 * 1024 * 1024
+        desired_volume["RequestedCapacityMin"] = volume_size
+        desired_volume["RequestedCapacityMax"] = volume_size
+    return desired_volume
+
+
+def reconcile_namespace(module, namespace, items):
+    """
+    converges the volumes of a namespace, returns the volumes as (id, action, volume, mismatches),
+    the number of volumes that needed a GET and the errors
+    """
+    nomad = NomadAPI(ModuleShim({"namespace": namespace}, parent=module))
+    try:
+        existing = {v["ID"]: v for v in nomad.get_csi_volumes()}
+    except APIError as e:
+        return [], 0, [f"list {namespace}: {e.msg}"]
+    known = nomad.csi_volume_cache().load() or {}
+
+    volumes = []
+    errors = []
+    create = []
+    delete = []
+    to_check = []
+    for item in items:
+        body = volume_body(item, namespace)
+        stub = existing.get(item["id"])
+        if item["state"] == "absent":
+            if stub is not None:
+                delete.append(item["id"])
+        elif stub is None:
+            create.append(body)
+        elif known.get(item["id"]) != version(stub.get("ModifyIndex"), body):
+            to_check.append(body)
+        else:
+            volumes.append((item["id"], "unchanged", stub, None))
+
+    # NOTE: csi volumes CANNOT be modified after being created, a mismatch is only reported
+    def get_volume(volume_id):
+        return NomadAPI(ModuleShim({"namespace": namespace}, parent=module)).get_csi_volume(volume_id)
+
+    max_workers = module.params.get("max_workers")
+    for outcome in run_parallel(lambda body: get_volume(body["ID"]), to_check, max_workers=max_workers):
+        body = outcome.item
+        if outcome.failed:
+            errors.append(f"read {namespace}/{body['ID']}: {outcome.error}")
+            continue
+        current = outcome.result
+        if current is None:
+            create.append(body)
+            continue
+        mismatches = Comparator(body).diff(current)
+        if mismatches:
+            volumes.append((body["ID"], "mismatched", current, mismatches))
+        else:
+            known[body["ID"]] = version(current.get("ModifyIndex"), body)
+            volumes.append((body["ID"], "unchanged", current, None))
+
+    if create:
+        # the create endpoint takes any number of volumes, the id in its path is not used for them
+        try:
+            response = nomad.create_csi_volume(create[0]["ID"], json.dumps({"Volumes": create}))
+        except APIError as e:
+            errors.append(f"create {namespace}/{', '.join(body['ID'] for body in create)}: {e.msg}")
+            create = []
+            response = None
+        created = {v["ID"]: v for v in (response or {}).get("Volumes") or []}
+        for body in create:
+            volume = created.get(body["ID"], body)
+            if volume.get("ModifyIndex") is not None:
+                known[body["ID"]] = version(volume["ModifyIndex"], body)
+            volumes.append((body["ID"], "created", volume, None))
+
+    for outcome in run_parallel(
+        lambda volume_id: NomadAPI(ModuleShim({"namespace": namespace}, parent=module)).delete_csi_volume(volume_id),
+        delete,
+        max_workers=max_workers,
+    ):
+        if outcome.failed:
+            errors.append(f"delete {namespace}/{outcome.item}: {outcome.error}")
+            continue
+        known.pop(outcome.item, None)
+        volumes.append((outcome.item, "deleted", existing[outcome.item], None))
+
+    nomad.csi_volume_cache().save(known)
+    return volumes, len(to_check), errors
+
+
+def run_volumes(module, result):
+    """the multi volume mode, see the comment on top"""
+    start = time.monotonic()
+    namespaces = {}
+    for item in module.params.get("volumes"):
+        namespace = item.get("namespace") or module.params.get("namespace")
+        namespaces.setdefault(namespace, []).append(item)
+    for namespace, items in namespaces.items():
+        ids = [item["id"] for item in items]
+        duplicates = sorted({i for i in ids if ids.count(i) > 1})
+        if duplicates:
+            module.fail_json(msg=f"volumes are given more than once in namespace {namespace}: {', '.join(duplicates)}")
+
+    errors = []
+    checked = 0
+    result["volumes"] = []
+    for namespace, items in namespaces.items():
+        volumes, namespace_checked, namespace_errors = reconcile_namespace(module, namespace, items)
+        checked += namespace_checked
+        errors.extend(namespace_errors)
+        for volume_id, action, volume, mismatches in volumes:
+            entry = {"id": volume_id, "namespace": namespace, "action": action}
+            if mismatches:
+                entry["fields"] = [m["path"] for m in mismatches]
+            result["volumes"].append(entry)
+
+    actions = [v["action"] for v in result["volumes"]]
+    result["changed"] = "created" in actions or "deleted" in actions
+    result["mismatched"] = "mismatched" in actions
+    result["stats"] = {
+        "volumes": len(module.params.get("volumes")),
+        "checked": checked,
+        "created": actions.count("created"),
+        "deleted": actions.count("deleted"),
+        "failed": len(errors),
+        "total_ms": round((time.monotonic() - start) * 1000, 1),
+    }
+
+    if errors:
+        module.fail_json(msg="failed to converge nomad csi volumes: " + "; ".join(errors), **result)
+
+    module.exit_json(**result)
 
 
 def run_module():
     # define available arguments/parameters a user can pass to the module
-    mount_options_spec = {
-        "fs_type": {"type": "str", "aliases": ["FSType"]},
-        "mount_flags": {"type": "list", "elements": "str", "aliases": ["MountFlags"]},
-    }
-    capabilities_spec = {
-        "access_mode": {"type": "str", "aliases": ["AccessMode"], "required": True},
-        "attachment_mode": {
-            "type": "str",
-            "aliases": ["AttachmentMode"],
-            "required": True,
-        },
-    }
     module_args = {
         "state": {
             "type": "str",
@@ -44,23 +253,24 @@ def run_module():
             "no_log": True,
             "fallback": (env_fallback, ["NOMAD_TOKEN"]),
         },
-        "id": {"type": "str", "required": True},
-        "name": {"type": "str", "required": True},
+        "id": {"type": "str"},
+        "name": {"type": "str"},
         "namespace": {"type": "str", "default": "default"},
-        "plugin_id": {"type": "str", "required": True},
+        "plugin_id": {"type": "str"},
         "mount_options": {
             "type": "dict",
             "required": False,
-            "options": mount_options_spec,
+            "options": MOUNT_OPTIONS_SPEC,
         },
         "capabilities": {
             "type": "list",
-            "required": True,
             "elements": "dict",
-            "options": capabilities_spec,
+            "options": CAPABILITIES_SPEC,
         },
         "capacity_gb": {"type": "int", "required": False},
         "parameters": {"type": "dict", "required": False},
+        "volumes": {"type": "list", "elements": "dict", "options": VOLUME_SPEC},
+        "max_workers": {"type": "int", "default": DEFAULT_MAX_WORKERS},
     }
 
     # seed the final result dict in the object. Default nothing changed ;)
@@ -70,7 +280,17 @@ def run_module():
     }
 
     # the AnsibleModule object
-    module = AnsibleModule(argument_spec=module_args, supports_check_mode=False)
+    module = AnsibleModule(
+        argument_spec=module_args,
+        supports_check_mode=False,
+        required_one_of=[["id", "volumes"]],
+        mutually_exclusive=[["id", "volumes"]],
+        required_by={"id": ["name", "plugin_id", "capabilities"]},
+    )
+
+    if module.params.get("volumes") is not None:
+        run_volumes(module, result)
+        return
 
     # the NomadAPI can init itself via the module args
     nomad = NomadAPI(module)
@@ -81,40 +301,7 @@ def run_module():
     #       volume spec along with a mismatched bool that can be
     #       inspected by the caller.
 
-    desired_volume = del_none(
-        {
-            "ID": module.params.get("id"),
-            "Name": module.params.get("name"),
-            "Namespace": module.params.get("namespace"),
-            "PluginID": module.params.get("plugin_id"),
-            "Parameters": module.params.get("parameters"),
-        }
-    )
-    if module.params.get("capabilities") is not None:
-        capabilities = []
-        for c in module.params.get("capabilities"):
-            capabilities.append(
-                {
-                    "AccessMode": c.get("access_mode"),
-                    "AttachmentMode": c.get("attachment_mode"),
-                }
-            )
-        desired_volume["RequestedCapabilities"] = capabilities
-
-    if module.params.get("mount_options") is not None:
-        desired_volume["MountOptions"] = del_none(
-            {
-                "FsType": module.params.get("mount_options").get("fs_type"),
-                "MountFlags": module.params.get("mount_options").get("mount_flags"),
-            }
-        )
-
-    if module.params.get("capacity_gb") > 0:
-        # TODO: for now we set both the min and max to the same value.
-        #       add support for distinct values.
-        volume_size = module.params.get("capacity_gb") * 1024 * 1024 * 1024
-        desired_volume["RequestedCapacityMin"] = volume_size
-        desired_volume["RequestedCapacityMax"] = volume_size
+    desired_volume = volume_body(module.params, module.params.get("namespace"))
 
     volume_id = module.params.get("id")
     existing_volume = nomad.get_csi_volume(volume_id)
@@ -64,6 +64,10 @@ def run_module():
     # the NomadAPI can init itself via the module args
     nomad = NomadAPI(module)
 
+    # a job spec that is known to be in sync with the job only costs one GET
+    if module.params.get("state") == "present" and nomad.get_unchanged_job(module.params.get("hcl_spec")) is not None:
+        module.exit_json(**result)
+
     # parse the job to get the job ID
     # check if an existing job exists
     parsed_job = None
@@ -123,6 +127,10 @@ def run_module():
                     "after": module.params.get("hcl_spec"),
                 }
 
+        # the plan carries the JobModifyIndex it was made against
+        if plan["Diff"].get("Type") == "None":
+            nomad.remember_job_spec(module.params.get("hcl_spec"), parsed_job, plan.get("JobModifyIndex"))
+
         if plan["Diff"].get("Type") != "None":
             result["changed"] = True
             # exit now if in check mode
@@ -141,6 +149,11 @@ def run_module():
                     }
                 ),
             )
+            nomad.remember_job_spec(
+                module.params.get("hcl_spec"),
+                parsed_job,
+                result["submit_response"].get("JobModifyIndex"),
+            )
 
     module.exit_json(**result)
 
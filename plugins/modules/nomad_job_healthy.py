@@ -0,0 +1,269 @@
+#!/usr/bin/python
+# Copyright (c) George Bolo <gbolo@linuxctl.com>
+# SPDX-License-Identifier: MIT
+
+
+import queue
+import re
+import threading
+import time
+
+from ansible.module_utils.basic import AnsibleModule, env_fallback
+
+from ..module_utils.consul import ConsulAPI
+from ..module_utils.nomad import DEPLOYMENT_TERMINAL_STATUS, NomadAPI
+from ..module_utils.parallel import APIError, ModuleShim
+
+#
+# Waits until a nomad job is healthy: its deployment succeeded and every
+# consul service of the job has enough passing instances. By default the
+# services are the consul services of the job's groups and tasks, and each
+# needs as many passing instances as its groups have allocations.
+#
+# Nothing is polled: the deployment and every service are watched at the same
+# time, each with blocking queries in a thread of its own, which nomad and
+# consul answer as soon as something changes. The module returns as soon as
+# all of them are healthy, fails as soon as the deployment failed, and reports
+# when each one became healthy in time_to_healthy_ms:
+#
+# - name: deploy nomad job
+#   nomad_job:
+#     hcl_spec: "{{ lookup('file', 'traefik.nomad.hcl') }}"
+#   register: traefik_job
+#
+# - name: wait for traefik to become healthy
+#   nomad_job_healthy:
+#     name: traefik
+#     job_modify_index: "{{ traefik_job.submit_response.JobModifyIndex | default(omit) }}"
+#     consul_url: http://127.0.0.1:8500
+#     timeout: 300
+#
+
+# the runtime variables nomad interpolates in service names, by where they are resolved from
+INTERPOLATION = re.compile(r"\$\{(NOMAD_JOB_NAME|JOB|NOMAD_GROUP_NAME|TASKGROUP|NOMAD_TASK_NAME|TASK)\}")
+
+
+def service_name(name, job, group, task=None):
+    """returns a service name with the job, group and task names interpolated"""
+    values = {
+        "NOMAD_JOB_NAME": job.get("Name") or job.get("ID"),
+        "JOB": job.get("Name") or job.get("ID"),
+        "NOMAD_GROUP_NAME": group.get("Name"),
+        "TASKGROUP": group.get("Name"),
+        "NOMAD_TASK_NAME": (task or {}).get("Name"),
+        "TASK": (task or {}).get("Name"),
+    }
+    return INTERPOLATION.sub(lambda m: values[m.group(1)] or m.group(0), name)
+
+
+def job_services(job):
+    """
+    returns the consul services of a job as {name: allocations}, where allocations is the
+    count of the groups registering the service, and the names that could not be resolved
+    """
+    services = {}
+    unresolved = []
+    for group in job.get("TaskGroups") or []:
+        declared = [(service, None) for service in group.get("Services") or []]
+        for task in group.get("Tasks") or []:
+            declared.extend((service, task) for service in task.get("Services") or [])
+        names = set()
+        for service, task in declared:
+            if (service.get("Provider") or "consul") != "consul":
+                continue
+            name = service_name(service.get("Name") or "", job, group, task)
+            if not name or "${" in name:
+                unresolved.append(name or "(empty)")
+            else:
+                names.add(name)
+        for name in names:
+            services[name] = services.get(name, 0) + (group.get("Count") or 0)
+    return services, unresolved
+
+
+def expects_deployment(job):
+    """only service jobs get a deployment, and only when a group has an update strategy"""
+    if (job.get("Type") or "service") != "service":
+        return False
+    # nomad fills in the default update block, MaxParallel 0 disables deployments for a group
+    return any((group.get("Update") or {}).get("MaxParallel", 1) != 0 for group in job.get("TaskGroups") or [])
+
+
+def consul_shim(module):
+    """returns a module shim with the consul connection as the url and management_token ConsulAPI expects"""
+    return ModuleShim(
+        {
+            "url": module.params.get("consul_url"),
+            "management_token": module.params.get("consul_token"),
+            "validate_certs": module.params.get("consul_validate_certs"),
+        },
+        parent=module,
+    )
+
+
+def run_module():
+    # define available arguments/parameters a user can pass to the module
+    module_args = {
+        "url": {
+            "type": "str",
+            "required": True,
+            "fallback": (env_fallback, ["NOMAD_ADDR"]),
+        },
+        "validate_certs": {"type": "bool", "default": True},
+        "connection_timeout": {"type": "int", "default": 10},
+        "management_token": {
+            "type": "str",
+            "required": True,
+            "no_log": True,
+            "fallback": (env_fallback, ["NOMAD_TOKEN"]),
+        },
+        "consul_url": {
+            "type": "str",
+            "fallback": (env_fallback, ["CONSUL_HTTP_ADDR"]),
+        },
+        "consul_token": {
+            "type": "str",
+            "no_log": True,
+            "fallback": (env_fallback, ["CONSUL_HTTP_TOKEN"]),
+        },
+        "consul_validate_certs": {"type": "bool", "default": True},
+        "name": {"type": "str", "required": True},
+        "namespace": {"type": "str", "default": "default"},
+        "job_modify_index": {"type": "int"},
+        "wait_for_deployment": {"type": "bool", "default": True},
+        "services": {"type": "list", "elements": "str"},
+        "min_passing": {"type": "int"},
+        "timeout": {"type": "int", "default": 300},
+    }
+
+    # the AnsibleModule object
+    module = AnsibleModule(argument_spec=module_args, supports_check_mode=True)
+
+    # seed the final result dict in the object. Default nothing changed ;)
+    result = {
+        "changed": False,
+    }
+
+    # the NomadAPI can init itself via the module args
+    nomad = NomadAPI(module)
+
+    start = time.monotonic()
+    deadline = start + module.params.get("timeout")
+    job_id = module.params.get("name")
+
+    job = nomad.get_job(job_id)
+    if job is None:
+        module.fail_json(msg=f"nomad job {job_id} does not exist")
+    job_modify_index = module.params.get("job_modify_index")
+    if job_modify_index is None:
+        job_modify_index = job["JobModifyIndex"]
+
+    services, unresolved = job_services(job)
+    if unresolved:
+        module.warn(f"not waiting for services of nomad job {job_id} with unresolved names: {', '.join(unresolved)}")
+    if module.params.get("services") is not None:
+        services = {name: services.get(name, 1) for name in module.params.get("services")}
+    if module.params.get("min_passing") is not None:
+        services = dict.fromkeys(services, module.params.get("min_passing"))
+    if services and not module.params.get("consul_url"):
+        module.fail_json(msg=f"consul_url is required to wait for the services of nomad job {job_id}")
+
+    # every watch runs in a thread of its own and reports to the queue: (name, healthy, value, requests, error)
+    results = queue.Queue()
+
+    def watch(name, func):
+        try:
+            healthy, value, requests = func()
+            results.put((name, healthy, value, requests, None))
+        except APIError as e:
+            results.put((name, False, None, 0, e.msg))
+        except Exception as e:
+            # anything else would end the thread silently and leave the module waiting until the timeout
+            results.put((name, False, None, 0, f"{type(e).__name__}: {e}"))
+
+    def watch_deployment():
+        api = NomadAPI(ModuleShim({}, parent=module))
+        deployment, requests = api.wait_for_job_deployment(job_id, job_modify_index, deadline)
+        healthy = deployment is not None and DEPLOYMENT_TERMINAL_STATUS.get(deployment.get("Status"), False)
+        return healthy, deployment, requests
+
+    def watch_service(name, min_passing):
+        api = ConsulAPI(consul_shim(module))
+        instances, requests = api.wait_for_health_service(name, min_passing, deadline)
+        return len(instances) >= min_passing, instances, requests
+
+    watches = {}
+    if module.params.get("wait_for_deployment") and expects_deployment(job):
+        watches["deployment"] = watch_deployment
+    for name, min_passing in services.items():
+        watches[name] = lambda name=name, min_passing=min_passing: watch_service(name, min_passing)
+    for name, func in watches.items():
+        threading.Thread(target=watch, args=(name, func), daemon=True).start()
+
+    deployment = None
+    instances = {}
+    time_to_healthy = {}
+    errors = []
+    requests = 0
+    pending = set(watches)
+    while pending:
+        # every watch gives up at the deadline, its last request may take up to connection_timeout longer
+        remaining = deadline - time.monotonic() + 2 * module.params.get("connection_timeout")
+        try:
+            name, healthy, value, count, error = results.get(timeout=max(remaining, 0))
+        except queue.Empty:
+            break
+        pending.discard(name)
+        requests += count
+        if error is not None:
+            errors.append(f"{name}: {error}")
+            break
+        if name == "deployment":
+            deployment = value
+        else:
+            instances[name] = value
+        if healthy:
+            time_to_healthy[name] = round((time.monotonic() - start) * 1000, 1)
+        elif name == "deployment" and deployment is not None:
+            # a failed deployment will not become healthy, no need to wait for the services
+            break
+
+    result["deployment"] = (
+        {k: deployment.get(k) for k in ("ID", "Status", "StatusDescription")} if deployment is not None else None
+    )
+    result["services"] = {
+        name: {"passing": len(instances.get(name) or []), "required": min_passing}
+        for name, min_passing in services.items()
+    }
+    result["unhealthy"] = [name for name in watches if name not in time_to_healthy]
+    result["time_to_healthy_ms"] = time_to_healthy
+    result["stats"] = {
+        "services": len(services),
+        "requests": requests,
+        "total_ms": round((time.monotonic() - start) * 1000, 1),
+    }
+
+    if errors:
+        module.fail_json(msg=f"failed to wait for nomad job {job_id}: " + "; ".join(errors), **result)
+    if deployment is not None and "deployment" not in time_to_healthy:
+        if deployment.get("Status") in DEPLOYMENT_TERMINAL_STATUS:
+            module.fail_json(
+                msg=f"deployment {deployment['ID']} {deployment['Status']}: {deployment.get('StatusDescription')}",
+                **result,
+            )
+    if result["unhealthy"]:
+        module.fail_json(
+            msg=f"timed out after {module.params.get('timeout')}s waiting for nomad job {job_id}: "
+            + ", ".join(result["unhealthy"]),
+            **result,
+        )
+
+    module.exit_json(**result)
+
+
+def main():
+    run_module()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,217 @@
+#!/usr/bin/python
+# Copyright (c) George Bolo <gbolo@linuxctl.com>
+# SPDX-License-Identifier: MIT
+
+
+import time
+
+from ansible.module_utils.basic import AnsibleModule, env_fallback
+
+from ..module_utils.nomad import DEPLOYMENT_TERMINAL_STATUS, NomadAPI
+
+#
+# Waits for the evaluation of a job registration, and the deployment it
+# started, to finish. Instead of polling, the module subscribes to the nomad
+# event stream and reacts to the Evaluation and Deployment events as they
+# arrive:
+#
+# - name: deploy nomad job
+#   nomad_job:
+#     hcl_spec: "{{ lookup('file', 'traefik.nomad.hcl') }}"
+#   register: traefik_job
+#
+# - name: wait for the traefik deployment
+#   nomad_job_wait:
+#     name: traefik
+#     eval_id: "{{ traefik_job.submit_response.EvalID }}"
+#     job_modify_index: "{{ traefik_job.submit_response.JobModifyIndex }}"
+#     timeout: 300
+#   when: traefik_job.submit_response is defined
+#
+
+# status -> did it succeed
+EVALUATION_TERMINAL_STATUS = {"complete": True, "failed": False, "canceled": False}
+
+
+def summarize(obj):
+    if obj is None:
+        return None
+    return {k: obj.get(k) for k in ("ID", "Status", "StatusDescription")}
+
+
+class JobWatcher:
+    """JobWatcher tracks the evaluation and deployment of a job version"""
+
+    def __init__(self, job_id, eval_id, job_modify_index, wait_for_deployment):
+        self.job_id = job_id
+        self.eval_id = eval_id
+        self.job_modify_index = job_modify_index
+        self.wait_for_deployment = wait_for_deployment
+        self.evaluation = None
+        self.deployment = None
+        # evaluations are garbage collected after a while, see snapshot()
+        self.evaluation_collected = False
+
+    def update_evaluation(self, evaluation):
+        if evaluation is None or evaluation.get("JobID") != self.job_id:
+            return
+        if self.eval_id is None and evaluation.get("JobModifyIndex", 0) >= self.job_modify_index:
+            # without an eval_id, the first evaluation of this job version is followed
+            self.eval_id = evaluation["ID"]
+        if evaluation["ID"] == self.eval_id:
+            self.evaluation = evaluation
+
+    def update_deployment(self, deployment):
+        if deployment is None or deployment.get("JobID") != self.job_id:
+            return
+        if deployment.get("JobModifyIndex", 0) < self.job_modify_index:
+            return
+        if self.deployment is None or deployment["CreateIndex"] >= self.deployment["CreateIndex"]:
+            self.deployment = deployment
+
+    def outcome(self):
+        """returns None while still waiting, otherwise a tuple of (successful, message)"""
+        if self.evaluation is not None:
+            status = self.evaluation.get("Status")
+            if status not in EVALUATION_TERMINAL_STATUS:
+                return None
+            if not EVALUATION_TERMINAL_STATUS[status]:
+                return False, f"evaluation {self.eval_id} {status}: {self.evaluation.get('StatusDescription')}"
+            failed_groups = sorted((self.evaluation.get("FailedTGAllocs") or {}).keys())
+            if failed_groups:
+                return False, f"evaluation {self.eval_id} failed to place all allocations: {', '.join(failed_groups)}"
+        elif not self.evaluation_collected:
+            return None
+
+        # a deployment is created by the same plan that completes the evaluation,
+        # so by now it is either known or the job (e.g. a batch job) has none.
+        if not self.wait_for_deployment or self.deployment is None:
+            return True, f"nomad job {self.job_id} is evaluated"
+
+        status = self.deployment.get("Status")
+        if status not in DEPLOYMENT_TERMINAL_STATUS:
+            return None
+        message = f"deployment {self.deployment['ID']} {status}: {self.deployment.get('StatusDescription')}"
+        return DEPLOYMENT_TERMINAL_STATUS[status], message
+
+    def snapshot(self, nomad):
+        """reads the current state and returns the index the event stream continues from"""
+        evaluations = nomad.get_job_evaluations(self.job_id) or []
+        index = nomad.last_index or 0
+        for evaluation in sorted(evaluations, key=lambda e: e.get("CreateIndex", 0)):
+            self.update_evaluation(evaluation)
+        if self.evaluation is None and self.eval_id is not None:
+            self.update_evaluation(nomad.get_evaluation(self.eval_id))
+        # the evaluation is written together with the job, so if it is not
+        # there now it has been garbage collected long ago
+        self.evaluation_collected = self.evaluation is None
+        if self.wait_for_deployment:
+            self.update_deployment(nomad.get_job_deployment(self.job_id))
+            index = min(index, nomad.last_index or 0)
+        return index
+
+    def topics(self):
+        evaluation_topic = "Evaluation" if self.eval_id is None else f"Evaluation:{self.eval_id}"
+        if not self.wait_for_deployment:
+            return [evaluation_topic]
+        return [evaluation_topic, "Deployment"]
+
+
+def run_module():
+    # define available arguments/parameters a user can pass to the module
+    module_args = {
+        "url": {
+            "type": "str",
+            "required": True,
+            "fallback": (env_fallback, ["NOMAD_ADDR"]),
+        },
+        "validate_certs": {"type": "bool", "default": True},
+        "connection_timeout": {"type": "int", "default": 10},
+        "management_token": {
+            "type": "str",
+            "required": True,
+            "no_log": True,
+            "fallback": (env_fallback, ["NOMAD_TOKEN"]),
+        },
+        "name": {"type": "str", "required": True},
+        "namespace": {"type": "str", "default": "default"},
+        "eval_id": {"type": "str"},
+        "job_modify_index": {"type": "int"},
+        "wait_for_deployment": {"type": "bool", "default": True},
+        "timeout": {"type": "int", "default": 300},
+    }
+
+    # the AnsibleModule object
+    module = AnsibleModule(
+        argument_spec=module_args,
+        supports_check_mode=True,
+    )
+
+    # seed the final result dict in the object. Default nothing changed ;)
+    result = {
+        "changed": False,
+    }
+
+    # the NomadAPI can init itself via the module args
+    nomad = NomadAPI(module)
+
+    start = time.monotonic()
+    job_id = module.params.get("name")
+
+    job_modify_index = module.params.get("job_modify_index")
+    if job_modify_index is None:
+        job = nomad.get_job(job_id)
+        if job is None:
+            module.fail_json(msg=f"nomad job {job_id} does not exist")
+        job_modify_index = job["JobModifyIndex"]
+
+    watcher = JobWatcher(
+        job_id,
+        module.params.get("eval_id"),
+        job_modify_index,
+        module.params.get("wait_for_deployment"),
+    )
+
+    # take a snapshot first, the event stream then continues from its index
+    index = watcher.snapshot(nomad)
+
+    events = 0
+    outcome = watcher.outcome()
+    if outcome is None:
+        for batch in nomad.stream_events(watcher.topics(), index=index, timeout=module.params.get("timeout")):
+            for event in batch["Events"]:
+                events += 1
+                payload = event.get("Payload") or {}
+                if event.get("Topic") == "Evaluation":
+                    watcher.update_evaluation(payload.get("Evaluation"))
+                elif event.get("Topic") == "Deployment":
+                    watcher.update_deployment(payload.get("Deployment"))
+            outcome = watcher.outcome()
+            if outcome is not None:
+                break
+
+    result["evaluation"] = summarize(watcher.evaluation)
+    result["deployment"] = summarize(watcher.deployment)
+    result["events"] = events
+    result["elapsed_ms"] = round((time.monotonic() - start) * 1000, 1)
+
+    if outcome is None:
+        module.fail_json(
+            msg=f"timed out after {module.params.get('timeout')}s waiting for nomad job {job_id}",
+            **result,
+        )
+
+    successful, message = outcome
+    result["msg"] = message
+    if not successful:
+        module.fail_json(**result)
+
+    module.exit_json(**result)
+
+
+def main():
+    run_module()
+
+
+if __name__ == "__main__":
+    main()
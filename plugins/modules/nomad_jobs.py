@@ -0,0 +1,246 @@
+#!/usr/bin/python
+# Copyright (c) George Bolo <gbolo@linuxctl.com>
+# SPDX-License-Identifier: MIT
+
+
+import contextlib
+import glob
+import importlib.util
+import json
+import os
+import time
+
+from ansible.module_utils.basic import AnsibleModule, env_fallback
+
+from ..module_utils.nomad import NomadAPI
+from ..module_utils.parallel import DEFAULT_MAX_WORKERS, ModuleShim, run_parallel
+
+# import nomad_diff if it is available on the system
+_nomad_diff_available = False
+
+nomad_diff_spec = importlib.util.find_spec("nomad_diff")
+if nomad_diff_spec is not None:
+    import nomad_diff
+
+    _nomad_diff_available = True
+
+# a directory in paths is searched recursively for these
+JOB_FILE_PATTERN = "**/*.nomad.hcl"
+
+
+def expand_paths(paths):
+    """returns the sorted, de-duplicated list of job files matched by paths"""
+    files = set()
+    for path in paths:
+        if os.path.isdir(path):
+            path = os.path.join(path, JOB_FILE_PATTERN)
+        files.update(f for f in glob.glob(os.path.expanduser(path), recursive=True) if os.path.isfile(f))
+    return sorted(files)
+
+
+def deploy_job(module, job):
+    """parses, plans and (when there is a diff) registers a single job. Runs in a worker thread"""
+    timing = {}
+    nomad = NomadAPI(ModuleShim({"namespace": job["namespace"]}, parent=module))
+    result = {
+        "source": job["source"],
+        "namespace": job["namespace"],
+        "changed": False,
+    }
+
+    # a job spec that is known to be in sync with the job only costs one GET
+    start = time.monotonic()
+    unchanged_job = nomad.get_unchanged_job(job["hcl_spec"])
+    timing["lookup"] = time.monotonic() - start
+    if unchanged_job is not None:
+        result["id"] = unchanged_job["ID"]
+        result["timing_ms"] = {k: round(v * 1000, 1) for k, v in timing.items()}
+        return result
+
+    start = time.monotonic()
+    parsed_job = nomad.parse_job(json.dumps({"JobHCL": job["hcl_spec"]}))
+    job_id = parsed_job["ID"]
+    result["id"] = job_id
+    timing["parse"] = time.monotonic() - start
+
+    start = time.monotonic()
+    plan = nomad.plan_job(job_id, json.dumps({"Job": parsed_job, "Diff": True}))
+    timing["plan"] = time.monotonic() - start
+
+    # a plan without a diff is treated as a change
+    diff_type = (plan.get("Diff") or {}).get("Type")
+
+    # do a nice diff if the system has nomad_diff available, unchanged jobs have none to show
+    if _nomad_diff_available and plan.get("Diff") is not None and diff_type != "None":
+        with contextlib.suppress(Exception):
+            result["diff"] = {
+                "before_header": job_id,
+                "after_header": job_id,
+                "prepared": nomad_diff.format(plan["Diff"], colors=True, verbose=False),
+            }
+
+    if diff_type == "None":
+        # the plan carries the JobModifyIndex it was made against
+        nomad.remember_job_spec(job["hcl_spec"], parsed_job, plan.get("JobModifyIndex"))
+    else:
+        result["changed"] = True
+
+        # if nomad_diff is not available we can try to fallback to a manual diff
+        if result.get("diff") is None:
+            start = time.monotonic()
+            existing_job = nomad.get_job(job_id)
+            submission = None
+            if existing_job is not None:
+                submission = nomad.get_job_submission(job_id, existing_job.get("Version", 1))
+            result["diff"] = {
+                "before_header": job_id,
+                "after_header": job_id,
+                "before": submission.get("Source") if submission is not None else "",
+                "after": job["hcl_spec"],
+            }
+            timing["submission"] = time.monotonic() - start
+
+        if not module.check_mode:
+            start = time.monotonic()
+            result["submit_response"] = nomad.create_or_update_job(
+                job_id,
+                json.dumps(
+                    {
+                        "Job": parsed_job,
+                        "Submission": {
+                            "Format": "hcl2",
+                            "Source": job["hcl_spec"],
+                        },
+                    }
+                ),
+            )
+            nomad.remember_job_spec(job["hcl_spec"], parsed_job, result["submit_response"].get("JobModifyIndex"))
+            timing["register"] = time.monotonic() - start
+
+    result["timing_ms"] = {k: round(v * 1000, 1) for k, v in timing.items()}
+    return result
+
+
+def run_module():
+    # define available arguments/parameters a user can pass to the module
+    job_spec = {
+        "hcl_spec": {"type": "str", "required": True},
+        "namespace": {"type": "str"},
+    }
+    module_args = {
+        "url": {
+            "type": "str",
+            "required": True,
+            "fallback": (env_fallback, ["NOMAD_ADDR"]),
+        },
+        "validate_certs": {"type": "bool", "default": True},
+        "connection_timeout": {"type": "int", "default": 10},
+        "management_token": {
+            "type": "str",
+            "required": True,
+            "no_log": True,
+            "fallback": (env_fallback, ["NOMAD_TOKEN"]),
+        },
+        "namespace": {"type": "str", "default": "default"},
+        "jobs": {
+            "type": "list",
+            "elements": "dict",
+            "options": job_spec,
+            "default": [],
+        },
+        "paths": {"type": "list", "elements": "path", "default": []},
+        "max_workers": {"type": "int", "default": DEFAULT_MAX_WORKERS},
+    }
+
+    # the AnsibleModule object
+    module = AnsibleModule(
+        argument_spec=module_args,
+        supports_check_mode=True,
+        required_one_of=[["jobs", "paths"]],
+    )
+
+    # seed the final result dict in the object. Default nothing changed ;)
+    result = {
+        "changed": False,
+    }
+
+    start = time.monotonic()
+
+    jobs = []
+    for i, job in enumerate(module.params.get("jobs")):
+        jobs.append(
+            {
+                "source": f"jobs[{i}]",
+                "hcl_spec": job.get("hcl_spec"),
+                "namespace": job.get("namespace") or module.params.get("namespace"),
+            }
+        )
+    for path in expand_paths(module.params.get("paths")):
+        try:
+            with open(path, encoding="utf-8") as f:
+                hcl_spec = f.read()
+        except OSError as e:
+            module.fail_json(msg=f"could not read job file {path}: {str(e)}")
+        jobs.append(
+            {
+                "source": path,
+                "hcl_spec": hcl_spec,
+                "namespace": module.params.get("namespace"),
+            }
+        )
+
+    if len(jobs) == 0:
+        module.fail_json(msg="no nomad jobs were found in jobs or paths")
+
+    outcomes = run_parallel(
+        lambda job: deploy_job(module, job),
+        jobs,
+        max_workers=module.params.get("max_workers"),
+    )
+
+    result["jobs"] = []
+    diffs = []
+    failed = []
+    for outcome in outcomes:
+        if outcome.failed:
+            failed.append(outcome.item["source"])
+            result["jobs"].append(
+                {
+                    "source": outcome.item["source"],
+                    "namespace": outcome.item["namespace"],
+                    "changed": False,
+                    "failed": True,
+                    "msg": outcome.error,
+                }
+            )
+            continue
+        job_result = outcome.result
+        job_result["timing_ms"]["total"] = round(outcome.elapsed * 1000, 1)
+        if job_result.get("diff") is not None:
+            diffs.append(job_result.pop("diff"))
+        result["changed"] = result["changed"] or job_result["changed"]
+        result["jobs"].append(job_result)
+
+    if diffs:
+        result["diff"] = diffs
+
+    result["timing"] = {
+        "jobs": len(jobs),
+        "changed": sum(1 for j in result["jobs"] if j["changed"]),
+        "failed": len(failed),
+        "max_workers": module.params.get("max_workers"),
+        "total_ms": round((time.monotonic() - start) * 1000, 1),
+    }
+
+    if failed:
+        module.fail_json(msg="failed to deploy nomad jobs: " + ", ".join(failed), **result)
+
+    module.exit_json(**result)
+
+
+def main():
+    run_module()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+# SPDX-License-Identifier: MIT
+"""
+Shared helpers for the benchmark scripts
+"""
+
+from __future__ import annotations
+
+import statistics
+import sys
+import time
+from pathlib import Path
+from typing import Any, Callable
+
+REPO_ROOT = Path(__file__).resolve().parents[2]
+
+# the module_utils import their siblings by bare name (e.g. "import debug")
+sys.path.insert(0, str(REPO_ROOT / "plugins" / "module_utils"))
+
+
+class BenchModule:
+    """
+    The minimal AnsibleModule surface used by NomadAPI and ConsulAPI
+    """
+
+    def __init__(self, **params: Any):
+        self.params = params
+        self.check_mode = False
+
+    def fail_json(self, msg: str, **kwargs: Any) -> None:
+        raise RuntimeError(msg)
+
+    def warn(self, msg: str) -> None:
+        pass
+
+
+def timeit(func: Callable[[], Any], rounds: int) -> dict[str, float]:
+    """
+    Runs func rounds times and returns wall time statistics in milliseconds
+    """
+
+    samples = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - start) * 1000)
+    return {
+        "min_ms": round(min(samples), 3),
+        "median_ms": round(statistics.median(samples), 3),
+        "max_ms": round(max(samples), 3),
+    }
+
+
+def run_module(name: str, args: dict[str, Any], check_mode: bool = False) -> dict[str, Any]:
+    """
+    Runs plugins/modules/<name>.py in-process with the given module arguments
+    and returns its result. The process wide connection pools are dropped
+    first, so every call behaves like a fresh module process
+    """
+
+    import contextlib
+    import importlib
+    import io
+    import json
+
+    import transport
+    from ansible.module_utils import basic
+    from ansible.module_utils.common.text.converters import to_bytes
+
+    if str(REPO_ROOT) not in sys.path:
+        sys.path.insert(0, str(REPO_ROOT))
+
+    for pooled in transport._transports.values():
+        pooled.close()
+    transport._transports.clear()
+
+    basic._ANSIBLE_ARGS = to_bytes(json.dumps({"ANSIBLE_MODULE_ARGS": dict(args, _ansible_check_mode=check_mode)}))
+    basic._ANSIBLE_PROFILE = "legacy"
+    module = importlib.import_module(f"plugins.modules.{name}")
+
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output), contextlib.suppress(SystemExit):
+        module.main()
+    return json.loads(output.getvalue())
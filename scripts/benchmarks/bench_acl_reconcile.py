@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+# SPDX-License-Identifier: MIT
+"""
+Compares reconciling a set of ACL policies and tokens with one task per object
+(nomad_acl_policy/nomad_acl_token in a loop) against a single
+nomad_acl_reconcile task, for a converged set (the nightly run) and for a set
+where a tenth of the objects changed. With --consul, the same for consul ACL
+policies, tokens and connect intentions (consul_acl_policy/consul_acl_token/
+consul_connect_intention vs consul_acl_reconcile).
+
+Usage:
+    ./scripts/benchmarks/bench_acl_reconcile.py [--policies 50] [--tokens 200] [--latency 0.002]
+    ./scripts/benchmarks/bench_acl_reconcile.py --consul [--intentions 300]
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import tempfile
+import time
+import uuid
+from pathlib import Path
+from typing import Any, Callable
+
+from _common import REPO_ROOT, run_module
+from fake_server import MANAGEMENT_TOKEN, consul_server, nomad_server
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--policies", type=int, default=50)
+    parser.add_argument("--tokens", type=int, default=200)
+    parser.add_argument("--intentions", type=int, default=300)
+    parser.add_argument("--latency", type=float, default=0.002, help="server side latency per request in seconds")
+    parser.add_argument("--consul", action="store_true", help="reconcile consul policies, tokens and intentions")
+    args = parser.parse_args()
+
+    def desired(version: int) -> tuple[list[dict[str, Any]], list[dict[str, Any]]]:
+        """the synthetic policies and tokens, every tenth one changed when version is not 0"""
+        policies = [
+            {
+                "name": f"policy-{i}",
+                "description": f"synthetic policy {i}",
+                "rules": f'namespace "default" {{ policy = "read" }} # {i}'
+                + (f" v{version}" if version and i % 10 == 0 else ""),
+            }
+            for i in range(args.policies)
+        ]
+        tokens = [
+            {
+                "name": f"token-{i}",
+                "policies": [f"policy-{(i + (version if i % 10 == 0 else 0)) % args.policies}"],
+            }
+            for i in range(args.tokens)
+        ]
+        return policies, tokens
+
+    def per_object(base: dict[str, Any], version: int) -> None:
+        policies, tokens = desired(version)
+        for policy in policies:
+            run_module("nomad_acl_policy", dict(base, **policy))
+        for token in tokens:
+            run_module("nomad_acl_token", dict(base, **token))
+
+    def reconcile(base: dict[str, Any], version: int) -> None:
+        policies, tokens = desired(version)
+        result = run_module("nomad_acl_reconcile", dict(base, policies=policies, tokens=tokens))
+        assert not result.get("failed"), result
+
+    def consul_desired(version: int) -> dict[str, list[dict[str, Any]]]:
+        """the synthetic consul policies, tokens and intentions, every tenth one changed when version is not 0"""
+
+        def changed(i: int) -> bool:
+            return bool(version) and i % 10 == 0
+
+        return {
+            "policies": [
+                {
+                    "name": f"policy-{i}",
+                    "description": f"synthetic policy {i}" + (f" v{version}" if changed(i) else ""),
+                    "rules": f'service "service-{i}" {{ policy = "write" }}',
+                }
+                for i in range(args.policies)
+            ],
+            "tokens": [
+                {
+                    "description": f"token-{i}",
+                    "policies": [f"policy-{(i + (version if changed(i) else 0)) % args.policies}"],
+                }
+                for i in range(args.tokens)
+            ],
+            "intentions": [
+                {
+                    "source": f"service-{i}",
+                    "destination": f"service-{i + 1}",
+                    "action": "deny" if changed(i) else "allow",
+                }
+                for i in range(args.intentions)
+            ],
+        }
+
+    def consul_per_object(base: dict[str, Any], version: int) -> None:
+        desired = consul_desired(version)
+        for policy in desired["policies"]:
+            run_module("consul_acl_policy", dict(base, **policy))
+        for i, token in enumerate(desired["tokens"]):
+            policies = [{"name": name} for name in token["policies"]]
+            # consul_acl_token only finds a token by its accessor ID, these are the seeded ones
+            accessor_id = str(uuid.UUID(int=i + 1))
+            run_module(
+                "consul_acl_token",
+                dict(base, accessor_id=accessor_id, description=token["description"], policies=policies),
+            )
+        for intention in desired["intentions"]:
+            run_module("consul_connect_intention", dict(base, **intention))
+
+    def consul_reconcile(base: dict[str, Any], version: int) -> None:
+        result = run_module("consul_acl_reconcile", dict(base, **consul_desired(version)))
+        assert not result.get("failed"), result
+
+    results: dict[str, Any] = {"converged": {}, "tenth_changed": {}}
+    approaches: dict[str, Callable[[dict[str, Any], int], None]] = {"per_object": per_object, "reconcile": reconcile}
+    if args.consul:
+        approaches = {"per_object": consul_per_object, "reconcile": consul_reconcile}
+    for name, func in approaches.items():
+        # a fresh server and cache per approach, so one does not converge the other
+        with tempfile.TemporaryDirectory() as cache_dir:
+            os.environ["ANSIBLE_API_CACHE_DIR"] = cache_dir
+            if args.consul:
+                sizes = {"policies": args.policies, "tokens": args.tokens, "intentions": args.intentions}
+                server = consul_server(latency=args.latency, **sizes).start()
+            else:
+                server = nomad_server(latency=args.latency, policies=args.policies, tokens=args.tokens).start()
+            base = {"url": server.url, "management_token": MANAGEMENT_TOKEN}
+            func(base, 0)
+            for scenario, version in (("converged", 0), ("tenth_changed", 1)):
+                server.reset_stats()
+                start = time.perf_counter()
+                func(base, version)
+                results[scenario][name] = {
+                    "ms": round((time.perf_counter() - start) * 1000, 1),
+                    "requests": server.stats["requests"],
+                }
+            server.stop()
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    # make "plugins.modules.*" importable for run_module
+    os.chdir(Path(REPO_ROOT))
+    main()
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+# SPDX-License-Identifier: MIT
+"""
+Compares fetching many objects one after the other with NomadAPI/ConsulAPI
+against fetching them concurrently with AsyncNomadAPI/AsyncConsulAPI, the way
+an audit from the control node would.
+
+Usage:
+    ./scripts/benchmarks/bench_async.py [--objects 200] [--latency 0.005] [--concurrency 8]
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import time
+from typing import Any
+
+from _common import BenchModule
+from fake_server import MANAGEMENT_TOKEN, consul_server, nomad_server
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--objects", type=int, default=200, help="number of jobs and services to fetch")
+    parser.add_argument("--latency", type=float, default=0.005, help="server side latency per request in seconds")
+    parser.add_argument("--concurrency", type=int, default=8)
+    args = parser.parse_args()
+
+    import aio
+    import consul
+    import nomad
+
+    nomad_fake = nomad_server(latency=args.latency, jobs=args.objects).start()
+    consul_fake = consul_server(latency=args.latency, services=args.objects).start()
+    cases: list[tuple[str, Any, Any, str, list[str], dict[str, Any]]] = [
+        (
+            "nomad get_job",
+            nomad.NomadAPI,
+            aio.AsyncNomadAPI,
+            "get_job",
+            [f"job-{i}" for i in range(args.objects)],
+            {"url": nomad_fake.url, "management_token": MANAGEMENT_TOKEN},
+        ),
+        (
+            "consul get_service",
+            consul.ConsulAPI,
+            aio.AsyncConsulAPI,
+            "get_service",
+            [f"service-{i}" for i in range(args.objects)],
+            {"url": consul_fake.url, "management_token": MANAGEMENT_TOKEN},
+        ),
+    ]
+
+    results = {}
+    for name, sync_class, async_class, method, items, params in cases:
+        api = sync_class(BenchModule(**dict(aio.DEFAULT_PARAMS, **params)))
+        start = time.perf_counter()
+        for item in items:
+            getattr(api, method)(item)
+        serial = time.perf_counter() - start
+
+        async def fetch_all(async_class=async_class, params=params, method=method, items=items) -> list[Any]:
+            async with async_class(params, max_concurrency=args.concurrency) as client:
+                return await client.map(method, items)
+
+        start = time.perf_counter()
+        outcomes = asyncio.run(fetch_all())
+        concurrent = time.perf_counter() - start
+        assert not any(o.failed for o in outcomes)
+
+        results[name] = {
+            "objects": len(items),
+            "serial_ms": round(serial * 1000, 1),
+            "async_ms": round(concurrent * 1000, 1),
+            "speedup": round(serial / concurrent, 1),
+        }
+
+    nomad_fake.stop()
+    consul_fake.stop()
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
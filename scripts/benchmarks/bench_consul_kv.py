@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+# SPDX-License-Identifier: MIT
+"""
+Compares the KV write throughput of one PUT per key (what `consul kv put` in a
+shell loop does) with consul_kv_batch, which packs the writes into /v1/txn
+requests of up to 64 operations. Also times a no-op consul_kv_batch run, where
+only the get-tree reads are sent.
+
+Usage:
+    ./scripts/benchmarks/bench_consul_kv.py [--keys 1000] [--latency 0.002] [--rounds 3]
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import time
+from pathlib import Path
+
+from _common import REPO_ROOT, BenchModule, run_module
+from fake_server import MANAGEMENT_TOKEN, consul_server
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--keys", type=int, default=1000)
+    parser.add_argument("--latency", type=float, default=0.002, help="server side latency per request in seconds")
+    parser.add_argument("--rounds", type=int, default=3)
+    args = parser.parse_args()
+
+    import consul
+
+    server = consul_server(latency=args.latency).start()
+    params = {
+        "url": server.url,
+        "management_token": MANAGEMENT_TOKEN,
+        "validate_certs": True,
+        "connection_timeout": 10,
+    }
+
+    def run(name: str, write) -> dict[str, float]:  # type: ignore[no-untyped-def]
+        samples = []
+        server.reset_stats()
+        for round_number in range(args.rounds):
+            server.consul.kv.clear()
+            start = time.perf_counter()
+            write(round_number)
+            samples.append(time.perf_counter() - start)
+        best = min(samples)
+        return {
+            "min_ms": round(best * 1000, 1),
+            "keys_per_second": round(args.keys / best),
+            "requests_per_run": server.stats["requests"] / args.rounds,
+        }
+
+    def one_put_per_key(round_number: int) -> None:
+        api = consul.ConsulAPI(BenchModule(**params))
+        for i in range(args.keys):
+            api.put_kv(f"bench/key-{i}", f"value {i} {round_number}")
+
+    def keys(round_number: int) -> list[dict[str, str]]:
+        return [{"key": f"key-{i}", "value": f"value {i} {round_number}"} for i in range(args.keys)]
+
+    def batch(round_number: int) -> None:
+        result = run_module("consul_kv_batch", dict(params, prefix="bench", keys=keys(round_number)))
+        assert result["changed"], result
+
+    results = {
+        "put_per_key": run("put_per_key", one_put_per_key),
+        "consul_kv_batch": run("consul_kv_batch", batch),
+    }
+
+    # steady state: every key is already up to date
+    batch(0)
+    server.reset_stats()
+    start = time.perf_counter()
+    for _ in range(args.rounds):
+        result = run_module("consul_kv_batch", dict(params, prefix="bench", keys=keys(0)))
+        assert not result["changed"], result
+    results["consul_kv_batch_noop"] = {
+        "mean_ms": round((time.perf_counter() - start) * 1000 / args.rounds, 1),
+        "requests_per_run": server.stats["requests"] / args.rounds,
+    }
+
+    server.stop()
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    # make "plugins.modules.*" importable for run_module
+    os.chdir(Path(REPO_ROOT))
+    main()
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+# SPDX-License-Identifier: MIT
+"""
+Compares converging many csi volumes with one nomad_csi_volume task per
+volume (a GET each, a create request per missing volume) against a single
+nomad_csi_volume task with volumes (a list per namespace, one create request
+for all missing volumes), for creating them, a first no-op run and the no-op
+runs after it, which the volume cache answers from the list alone.
+
+Usage:
+    ./scripts/benchmarks/bench_csi_volumes.py [--volumes 50] [--latency 0.002]
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import tempfile
+import time
+from pathlib import Path
+from typing import Any
+
+from _common import REPO_ROOT, run_module
+from fake_server import MANAGEMENT_TOKEN, nomad_server
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--volumes", type=int, default=50)
+    parser.add_argument("--latency", type=float, default=0.002, help="server side latency per request in seconds")
+    args = parser.parse_args()
+
+    volumes = [
+        {
+            "id": f"volume-{i}",
+            "name": f"volume-{i}",
+            "plugin_id": "nfs",
+            "capabilities": [{"access_mode": "multi-node-multi-writer", "attachment_mode": "file-system"}],
+            "parameters": {"share": f"/exports/{i}"},
+        }
+        for i in range(args.volumes)
+    ]
+
+    def per_volume(url: str) -> None:
+        for volume in volumes:
+            result = run_module("nomad_csi_volume", dict(volume, url=url, management_token=MANAGEMENT_TOKEN))
+            assert not result.get("failed") and not result["mismatched"], result
+
+    def module(url: str) -> None:
+        result = run_module("nomad_csi_volume", {"url": url, "management_token": MANAGEMENT_TOKEN, "volumes": volumes})
+        assert not result.get("failed") and not result["mismatched"], result
+
+    results: dict[str, Any] = {"create": {}, "no_op": {}, "no_op_cached": {}}
+    for name, func in (("per_volume", per_volume), ("module", module)):
+        # a fresh nomad and volume cache per approach
+        with tempfile.TemporaryDirectory() as cache_dir:
+            os.environ["ANSIBLE_API_CACHE_DIR"] = cache_dir
+            server = nomad_server(latency=args.latency).start()
+            for scenario in results:
+                if scenario == "no_op":
+                    # as if the volumes were created by someone else
+                    for path in Path(cache_dir).glob("nomad-csi-volumes/*"):
+                        path.unlink()
+                server.reset_stats()
+                start = time.perf_counter()
+                func(server.url)
+                results[scenario][name] = {
+                    "ms": round((time.perf_counter() - start) * 1000, 1),
+                    "requests": server.stats["requests"],
+                }
+            assert len(server.nomad.volumes) == args.volumes  # type: ignore[attr-defined]
+            server.stop()
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    # make "plugins.modules.*" importable for run_module
+    os.chdir(Path(REPO_ROOT))
+    main()
@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+# SPDX-License-Identifier: MIT
+"""
+Compares utils.del_none with the original implementation (copy the top level
+dict, then strip copies of the nested dicts that were thrown away) and with
+stripping a deep copy in place, on a large Nomad job payload and a CSI volume
+with many capabilities, mount flags and parameters. Also reports the None
+values each one leaves behind and whether the input was modified.
+
+Usage:
+    ./scripts/benchmarks/bench_del_none.py [--size 200] [--rounds 20]
+"""
+
+from __future__ import annotations
+
+import argparse
+import copy
+import json
+from typing import Any
+
+from _common import timeit
+
+
+def original_del_none(d: dict[str, Any]) -> dict[str, Any]:
+    """
+    The del_none used before it cleaned nested dicts and lists
+    """
+
+    cloned = d.copy()
+    for key, value in list(cloned.items()):
+        if value is None:
+            del cloned[key]
+        elif isinstance(value, dict):
+            original_del_none(value)
+    return cloned
+
+
+def strip_in_place(value: Any) -> Any:
+    """
+    The two pass alternative: strip the None values from a deep copy in place
+    """
+
+    if isinstance(value, dict):
+        for key in [k for k, v in value.items() if v is None]:
+            del value[key]
+        for v in value.values():
+            strip_in_place(v)
+    elif isinstance(value, (list, tuple)):
+        for v in value:
+            strip_in_place(v)
+    return value
+
+
+def nomad_job(size: int) -> dict[str, Any]:
+    """a job with size task groups of 5 tasks, with the null fields the job parse endpoint returns"""
+    return {
+        "ID": "job-0",
+        "Name": "job-0",
+        "Namespace": "default",
+        "Type": "service",
+        "Priority": 50,
+        "Region": None,
+        "ParentID": None,
+        "Datacenters": ["dc1", "dc2"],
+        "Constraints": None,
+        "Affinities": None,
+        "Meta": {"owner": "platform", "tier": None},
+        "TaskGroups": [
+            {
+                "Name": f"group-{g}",
+                "Count": 3,
+                "Constraints": None,
+                "Networks": [{"Mode": "bridge", "DynamicPorts": [{"Label": "http", "To": 8080, "HostNetwork": None}]}],
+                "Services": [
+                    {
+                        "Name": f"service-{g}",
+                        "PortLabel": "http",
+                        "Tags": ["synthetic", f"group-{g}"],
+                        "Checks": [{"Type": "http", "Path": "/health", "Interval": 10000000000, "Header": None}],
+                        "Connect": None,
+                    }
+                ],
+                "Tasks": [
+                    {
+                        "Name": f"task-{t}",
+                        "Driver": "docker",
+                        "User": None,
+                        "Config": {"image": f"registry.local/app-{t}:1.0", "ports": ["http"], "args": None},
+                        "Env": {f"VAR_{i}": f"value-{i}" for i in range(10)},
+                        "Resources": {"CPU": 100, "MemoryMB": 256, "MemoryMaxMB": None, "Networks": None},
+                        "Templates": [{"DestPath": "local/app.env", "EmbeddedTmpl": "KEY=value", "Perms": None}],
+                        "Vault": None,
+                        "Lifecycle": None,
+                    }
+                    for t in range(5)
+                ],
+                "Update": None,
+                "Migrate": None,
+            }
+            for g in range(size)
+        ],
+        "Update": {"MaxParallel": 1, "Canary": None},
+        "Periodic": None,
+        "ParameterizedJob": None,
+    }
+
+
+def csi_volume(size: int) -> dict[str, Any]:
+    return {
+        "ID": "volume-0",
+        "Name": "volume-0",
+        "Namespace": "default",
+        "PluginID": "nfs",
+        "ExternalID": None,
+        "RequestedCapabilities": [
+            {"AccessMode": f"mode-{i}", "AttachmentMode": "file-system", "Topology": None} for i in range(size)
+        ],
+        "MountOptions": {"FsType": None, "MountFlags": [f"flag-{i}" for i in range(size)]},
+        "Parameters": {f"param-{i}": str(i) if i % 4 else None for i in range(size * 5)},
+        "Secrets": None,
+        "Context": {f"context-{i}": None for i in range(size)},
+    }
+
+
+def count_none_values(value: Any) -> int:
+    """counts the dict values that are None, at any depth"""
+    if isinstance(value, dict):
+        return sum(1 if v is None else count_none_values(v) for v in value.values())
+    if isinstance(value, (list, tuple)):
+        return sum(count_none_values(v) for v in value)
+    return 0
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size", type=int, default=200)
+    parser.add_argument("--rounds", type=int, default=20)
+    args = parser.parse_args()
+
+    from utils import del_none
+
+    results = {}
+    for name, factory in (("nomad_job", nomad_job), ("csi_volume", csi_volume)):
+        payload = factory(args.size)
+        before = json.dumps(payload, sort_keys=True)
+        original_input = copy.deepcopy(payload)
+        original_cleaned = original_del_none(original_input)
+        cleaned = del_none(payload)
+        results[name] = {
+            "payload_kb": round(len(before) / 1024, 1),
+            "original": {
+                **timeit(lambda p=payload: original_del_none(p), args.rounds),
+                "none_values_left": count_none_values(original_cleaned),
+                "modifies_input": json.dumps(original_input, sort_keys=True) != before,
+            },
+            "deepcopy_strip": timeit(lambda p=payload: strip_in_place(copy.deepcopy(p)), args.rounds),
+            "del_none": {
+                **timeit(lambda p=payload: del_none(p), args.rounds),
+                "none_values_left": count_none_values(cleaned),
+                "modifies_input": json.dumps(payload, sort_keys=True) != before,
+            },
+        }
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+# SPDX-License-Identifier: MIT
+"""
+Compares utils.is_subset with the original pairwise list comparison on large
+synthetic Consul tokens (many policy links), intentions (many permissions) and
+Nomad CSI volumes, and with a utils.Comparator compiled once from the desired
+object. Also times --objects small desired objects, each compared with its
+existing counterpart, as a bulk reconcile does.
+
+Usage:
+    ./scripts/benchmarks/bench_is_subset.py [--size 500] [--rounds 20] [--objects 2000]
+"""
+
+from __future__ import annotations
+
+import argparse
+import copy
+import json
+from typing import Any
+
+from _common import timeit
+
+
+def pairwise_is_subset(subset: Any, superset: Any) -> bool:
+    """
+    The list comparison is_subset used before it matched elements by key
+    """
+
+    if isinstance(subset, dict):
+        return all(key in superset and pairwise_is_subset(val, superset[key]) for key, val in subset.items())
+    elif isinstance(subset, list):
+        return all(any(pairwise_is_subset(subitem, superitem) for superitem in superset) for subitem in subset)
+    else:
+        return subset == superset
+
+
+def consul_token(size: int) -> dict[str, Any]:
+    return {
+        "AccessorID": "6a1253d2-1785-24fd-91c2-f8e78c745511",
+        "Description": "workload token",
+        "Policies": [{"ID": f"00000000-0000-0000-0000-{i:012d}", "Name": f"policy-{i}"} for i in range(size)],
+        "Roles": [{"ID": f"10000000-0000-0000-0000-{i:012d}", "Name": f"role-{i}"} for i in range(size // 10)],
+        "ServiceIdentities": [{"ServiceName": f"service-{i}", "Datacenters": ["dc1"]} for i in range(size // 10)],
+        "Local": False,
+    }
+
+
+def consul_intention(size: int) -> dict[str, Any]:
+    return {
+        "SourceType": "consul",
+        "Action": None,
+        "Permissions": [
+            {
+                "Action": "allow" if i % 2 else "deny",
+                "HTTP": {"PathPrefix": f"/api/v{i}", "Methods": ["GET", "HEAD", "POST"]},
+            }
+            for i in range(size)
+        ],
+    }
+
+
+def csi_volume(size: int) -> dict[str, Any]:
+    return {
+        "ID": "volume-0",
+        "Name": "volume-0",
+        "Namespace": "default",
+        "PluginID": "nfs",
+        "RequestedCapabilities": [
+            {"AccessMode": mode, "AttachmentMode": attachment}
+            for mode in ("single-node-writer", "single-node-reader-only", "multi-node-multi-writer")
+            for attachment in ("file-system", "block-device")
+        ],
+        "MountOptions": {"FsType": "ext4", "MountFlags": [f"flag-{i}" for i in range(size)]},
+        "Parameters": {f"param-{i}": str(i) for i in range(size)},
+    }
+
+
+def existing(desired: dict[str, Any]) -> dict[str, Any]:
+    """
+    What the API returns for desired: the same lists in reverse order plus server side fields
+    on the objects that have an identity
+    """
+
+    obj = copy.deepcopy(desired)
+    for key, value in obj.items():
+        if isinstance(value, list):
+            obj[key] = [dict(v, CreateIndex=1) if isinstance(v, dict) and "ID" in v else v for v in reversed(value)]
+    obj.update(CreateIndex=1, ModifyIndex=2, Hash="deadbeef")
+    return obj
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size", type=int, default=500)
+    parser.add_argument("--rounds", type=int, default=20)
+    parser.add_argument("--objects", type=int, default=2000)
+    args = parser.parse_args()
+
+    from utils import Comparator, is_subset
+
+    results: dict[str, Any] = {}
+    factories = {"consul_token": consul_token, "consul_intention": consul_intention, "csi_volume": csi_volume}
+    for name, factory in factories.items():
+        desired = factory(args.size)
+        actual = existing(desired)
+        comparator = Comparator(desired)
+        assert is_subset(desired, actual) == pairwise_is_subset(desired, actual) == comparator.matches(actual)
+        results[name] = {
+            "pairwise": timeit(lambda d=desired, a=actual: pairwise_is_subset(d, a), args.rounds),
+            "is_subset": timeit(lambda d=desired, a=actual: is_subset(d, a), args.rounds),
+            "compile": timeit(lambda d=desired: Comparator(d), args.rounds),
+            "compiled": timeit(lambda c=comparator, a=actual: c.matches(a), args.rounds),
+        }
+
+    # a bulk reconcile: many small desired objects, each compared with its existing counterpart
+    desired_objects = [consul_token(10) for _ in range(args.objects)]
+    actual_objects = [existing(d) for d in desired_objects]
+    comparators = [Comparator(d) for d in desired_objects]
+    results["bulk_small_objects"] = {
+        "is_subset": timeit(lambda: [is_subset(d, a) for d, a in zip(desired_objects, actual_objects)], args.rounds),
+        "compile": timeit(lambda: [Comparator(d) for d in desired_objects], args.rounds),
+        "compiled": timeit(lambda: [c.matches(a) for c, a in zip(comparators, actual_objects)], args.rounds),
+    }
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+# SPDX-License-Identifier: MIT
+"""
+Runs every module in plugins/modules against the fake Nomad/Consul (and
+NetBox/PowerDNS) servers and reports wall time, requests and connections per
+module run.
+
+Each scenario is a no-op run against an already converged object, which is
+what most of our nightly convergence runs look like.
+
+Usage:
+    ./scripts/benchmarks/bench_modules.py [--latency 0.002] [--rounds 20] [--size 1000] [--only nomad_acl_token]
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import tempfile
+from pathlib import Path
+from typing import Any
+
+from _common import REPO_ROOT, run_module, timeit
+from fake_server import MANAGEMENT_TOKEN, consul_server, netbox_server, nomad_server, powerdns_server
+
+JOB_HCL = 'job "job-0" { group "g" { count = 1 } }'
+
+
+def scenarios(nomad_url: str, consul_url: str, netbox_url: str, powerdns_url: str) -> dict[str, dict[str, Any]]:
+    """
+    Returns the module arguments to benchmark, keyed by module name
+    """
+
+    nomad = {"url": nomad_url, "management_token": MANAGEMENT_TOKEN}
+    consul = {"url": consul_url, "management_token": MANAGEMENT_TOKEN}
+    return {
+        "consul_acl_bootstrap": consul,
+        "consul_acl_get_token": dict(consul, accessor_id="00000000-0000-0000-0000-000000000001"),
+        "consul_acl_policy": dict(
+            consul,
+            name="policy-1",
+            description="synthetic policy 1",
+            rules='service "service-1" { policy = "write" }',
+        ),
+        "consul_acl_reconcile": dict(
+            consul,
+            policies=[
+                {
+                    "name": f"policy-{i}",
+                    "description": f"synthetic policy {i}",
+                    "rules": f'service "service-{i}" {{ policy = "write" }}',
+                }
+                for i in range(10)
+            ],
+            tokens=[{"description": f"token-{i}", "policies": [f"policy-{i % 10}"]} for i in range(10)],
+            intentions=[
+                {"source": f"service-{i}", "destination": f"service-{i + 1}", "action": "allow"} for i in range(10)
+            ],
+        ),
+        "consul_acl_token": dict(
+            consul,
+            accessor_id="00000000-0000-0000-0000-000000000001",
+            description="token-0",
+            policies=[{"name": "policy-0"}],
+        ),
+        "consul_connect_intention": dict(consul, source="service-0", destination="service-1", action="allow"),
+        "consul_get_service_detail": dict(consul, service_name="service-0"),
+        "consul_service_health": dict(consul, services=[f"service-{i}" for i in range(10)]),
+        "consul_kv_batch": dict(
+            consul,
+            prefix="synthetic",
+            keys=[{"key": f"key-{i}", "value": f"value {i}"} for i in range(100)],
+        ),
+        "netbox_powerdns_sync": {
+            "netbox_url": netbox_url,
+            "netbox_token": "netbox-token",
+            "powerdns_url": f"{powerdns_url}/api/v1",
+            "powerdns_api_key": "powerdns-key",
+        },
+        "nomad_acl_bootstrap": nomad,
+        "nomad_acl_policy": dict(
+            nomad,
+            name="policy-1",
+            description="synthetic policy 1",
+            rules='namespace "default" { policy = "read" } # 1',
+        ),
+        "nomad_acl_reconcile": dict(
+            nomad,
+            policies=[
+                {
+                    "name": f"policy-{i}",
+                    "description": f"synthetic policy {i}",
+                    "rules": f'namespace "default" {{ policy = "read" }} # {i}',
+                }
+                for i in range(10)
+            ],
+            tokens=[{"name": f"token-{i}", "policies": [f"policy-{i % 10}"]} for i in range(10)],
+        ),
+        "nomad_acl_token": dict(nomad, name="token-1", policies=["policy-1"]),
+        "nomad_csi_volume": dict(
+            nomad,
+            id="volume-0",
+            name="volume-0",
+            plugin_id="nfs",
+            capabilities=[{"access_mode": "multi-node-multi-writer", "attachment_mode": "file-system"}],
+            capacity_gb=0,
+            parameters={"share": "/exports/0"},
+        ),
+        "nomad_job": dict(nomad, hcl_spec=JOB_HCL),
+        "nomad_job_healthy": dict(
+            nomad,
+            name="job-0",
+            consul_url=consul_url,
+            consul_token=MANAGEMENT_TOKEN,
+            timeout=10,
+        ),
+        "nomad_job_parse": dict(nomad, hcl_spec=JOB_HCL),
+        "nomad_job_wait": dict(nomad, name="job-0"),
+        "nomad_jobs": dict(
+            nomad,
+            jobs=[{"hcl_spec": f'job "job-{i}" {{ group "g" {{ count = 1 }} }}'} for i in range(10)],
+        ),
+        "nomad_namespace": dict(nomad, name="namespace-1", description="synthetic 1"),
+        "nomad_scheduler": dict(nomad, preemption_config={"system_scheduler_enabled": True}),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--latency", type=float, default=0.0, help="server side latency per request in seconds")
+    parser.add_argument("--rounds", type=int, default=20)
+    parser.add_argument("--size", type=int, default=1000, help="number of tokens, policies, volumes, services, ...")
+    parser.add_argument("--only", action="append", help="only benchmark these modules")
+    args = parser.parse_args()
+
+    size = args.size
+    nomad = nomad_server(
+        latency=args.latency, tokens=size, policies=max(size // 10, 2), namespaces=10, volumes=size, jobs=10
+    ).start()
+    consul = consul_server(
+        latency=args.latency, tokens=size, policies=max(size // 10, 2), services=size, intentions=size, keys=size
+    ).start()
+    netbox = netbox_server(latency=args.latency, zones=10, records=size).start()
+    # the requests of netbox_powerdns_sync are counted on the powerdns side
+    powerdns = powerdns_server(latency=args.latency).start()
+
+    modules = sorted(p.stem for p in (REPO_ROOT / "plugins" / "modules").glob("*.py"))
+    cases = scenarios(nomad.url, consul.url, netbox.url, powerdns.url)
+    missing = [m for m in modules if m not in cases]
+    if missing:
+        print(f"no benchmark scenario for: {', '.join(missing)}")
+
+    results = {}
+    with tempfile.TemporaryDirectory() as cache_dir:
+        os.environ["ANSIBLE_API_CACHE_DIR"] = cache_dir
+        for name in modules:
+            if name not in cases or (args.only and name not in args.only):
+                continue
+            server = {"nomad": nomad, "consul": consul, "netbox": powerdns}[name.split("_")[0]]
+
+            # converge once, so the timed runs are steady state no-ops
+            first = run_module(name, cases[name])
+            if first.get("failed"):
+                results[name] = {"failed": first.get("msg")}
+                continue
+
+            server.reset_stats()
+            timing = timeit(lambda name=name: run_module(name, cases[name]), args.rounds)
+            results[name] = {
+                **timing,
+                "requests_per_run": server.stats["requests"] / args.rounds,
+                "connections_per_run": server.stats["connections"] / args.rounds,
+            }
+
+    nomad.stop()
+    consul.stop()
+    netbox.stop()
+    powerdns.stop()
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    # make "plugins.modules.*" importable for run_module
+    os.chdir(Path(REPO_ROOT))
+    main()
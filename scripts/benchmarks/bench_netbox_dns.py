@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+# SPDX-License-Identifier: MIT
+"""
+Compares syncing netbox-dns zones and records to PowerDNS the way
+playbooks/infrastructure/netbox/dns/sync-to-powerdns.yml does (a POST per
+zone, a PATCH per record, each a separate HTTP call) against a single
+netbox_powerdns_sync task, for a full sync into an empty PowerDNS, a no-op
+run and a run where a tenth of the A records changed in NetBox.
+
+Usage:
+    ./scripts/benchmarks/bench_netbox_dns.py [--zones 20] [--records 5000] [--latency 0.002]
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import tempfile
+import time
+import urllib.error
+import urllib.request
+from pathlib import Path
+from typing import Any, Callable
+
+from _common import REPO_ROOT, run_module
+from fake_server import FakeServer, netbox_server, powerdns_server
+
+API_KEY = "changeme"
+
+
+def call(url: str, method: str = "GET", body: Any = None) -> Any:
+    """a single uri task: a new connection, one request"""
+    data = json.dumps(body).encode() if body is not None else None
+    headers = {"Content-Type": "application/json", "X-API-Key": API_KEY}
+    request = urllib.request.Request(url, data=data, method=method, headers=headers)
+    try:
+        with urllib.request.urlopen(request) as response:
+            payload = response.read()
+    except urllib.error.HTTPError as e:
+        # the playbook accepts a 409 for zones that exist
+        if e.code != 409:
+            raise
+        return None
+    return json.loads(payload) if payload else None
+
+
+def per_record(netbox: FakeServer, pdns_url: str) -> None:
+    zones = call(f"{netbox.url}/api/plugins/netbox-dns/zones/?limit=1000")["results"]
+    records = call(f"{netbox.url}/api/plugins/netbox-dns/records/?limit=1000&status=active")
+    results = records["results"]
+    while records["next"]:
+        records = call(records["next"])
+        results.extend(records["results"])
+    for zone in zones:
+        soa = f"{zone['soa_mname']['name']}. {zone['soa_rname']}. 1 43200 7200 2419200 3600"
+        rrsets = [{"name": f"{zone['name']}.", "type": "SOA", "ttl": 3600, "records": [{"content": soa}]}]
+        body = {"name": f"{zone['name']}.", "kind": "Native", "nameservers": ["ns1.example.com."], "rrsets": rrsets}
+        call(f"{pdns_url}/servers/localhost/zones", "POST", body)
+    for record in results:
+        value = record["value"]
+        if record["type"] in ("NS", "CNAME") and not value.endswith("."):
+            value += "."
+        if record["type"] == "TXT":
+            value = f'"{value}"'
+        rrset = {
+            "name": record["fqdn"],
+            "type": record["type"],
+            "changetype": "REPLACE",
+            "ttl": record["ttl"] or 3600,
+            "records": [{"content": value, "disabled": False}],
+        }
+        call(f"{pdns_url}/servers/localhost/zones/{record['zone']['name']}.", "PATCH", {"rrsets": [rrset]})
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--zones", type=int, default=20)
+    parser.add_argument("--records", type=int, default=5000)
+    parser.add_argument("--latency", type=float, default=0.002, help="server side latency per request in seconds")
+    args = parser.parse_args()
+
+    def module(netbox: FakeServer, pdns_url: str) -> None:
+        result = run_module(
+            "netbox_powerdns_sync",
+            {
+                "netbox_url": netbox.url,
+                "netbox_token": "token",
+                "powerdns_url": pdns_url,
+                "powerdns_api_key": API_KEY,
+            },
+        )
+        assert not result.get("failed"), result
+
+    results: dict[str, Any] = {"full_sync": {}, "no_op": {}, "tenth_changed": {}}
+    approaches: dict[str, Callable[[FakeServer, str], None]] = {"per_record": per_record, "module": module}
+    for name, func in approaches.items():
+        # a fresh netbox record state per approach
+        with tempfile.TemporaryDirectory() as cache_dir:
+            os.environ["ANSIBLE_API_CACHE_DIR"] = cache_dir
+            netbox = netbox_server(latency=args.latency, zones=args.zones, records=args.records).start()
+            pdns = powerdns_server(latency=args.latency).start()
+            for scenario in results:
+                if scenario == "tenth_changed":
+                    fake = netbox.netbox  # type: ignore[attr-defined]
+                    for record in [r for r in fake.records if r["type"] == "A"][::10]:
+                        fake.update_record(record, value=record["value"].replace("10.", "172.", 1))
+                netbox.reset_stats()
+                pdns.reset_stats()
+                writes = pdns.powerdns.writes  # type: ignore[attr-defined]
+                start = time.perf_counter()
+                func(netbox, f"{pdns.url}/api/v1")
+                results[scenario][name] = {
+                    "ms": round((time.perf_counter() - start) * 1000, 1),
+                    "netbox_requests": netbox.stats["requests"],
+                    "powerdns_requests": pdns.stats["requests"],
+                    "powerdns_writes": pdns.powerdns.writes - writes,  # type: ignore[attr-defined]
+                }
+            netbox.stop()
+            pdns.stop()
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    # make "plugins.modules.*" importable for run_module
+    os.chdir(Path(REPO_ROOT))
+    main()
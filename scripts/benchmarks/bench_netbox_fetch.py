@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+# SPDX-License-Identifier: MIT
+"""
+Compares fetching all netbox-dns records with NetboxAPI: one unpaginated
+request (what the DNS playbooks do, which netbox caps at MAX_PAGE_SIZE),
+following the "next" links page by page, fetching the pages concurrently, and
+a delta pull with sync_dns_records after a hundred records changed and ten
+were deleted.
+
+Usage:
+    ./scripts/benchmarks/bench_netbox_fetch.py [--records 20000] [--latency 0.02] [--max-workers 8]
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+from typing import Any
+
+from _common import BenchModule, timeit
+from fake_server import netbox_server
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--zones", type=int, default=20)
+    parser.add_argument("--records", type=int, default=20000)
+    parser.add_argument("--latency", type=float, default=0.02, help="server side latency per request in seconds")
+    parser.add_argument("--max-workers", type=int, default=8)
+    parser.add_argument("--rounds", type=int, default=5)
+    args = parser.parse_args()
+
+    from netbox import URL_DNS_RECORDS, NetboxAPI
+
+    server = netbox_server(latency=args.latency, zones=args.zones, records=args.records).start()
+    api = NetboxAPI(
+        BenchModule(netbox_url=server.url, netbox_token="token", netbox_validate_certs=True, connection_timeout=30)
+    )
+    fake = server.netbox  # type: ignore[attr-defined]
+
+    results: dict[str, Any] = {}
+
+    def measure(name: str, func: Any) -> None:
+        server.reset_stats()
+        count = len(func())
+        results[name] = {
+            **timeit(func, args.rounds),
+            "records": count,
+            "requests": server.stats["requests"] // (args.rounds + 1),
+        }
+
+    unpaginated = f"{server.url}/api/plugins/netbox-dns/records/"
+    measure("unpaginated", lambda: api.api_request(url=unpaginated, method="GET")["results"])
+    measure("sequential_pages", lambda: api.get_dns_records())
+    measure("concurrent_pages", lambda: api.get_dns_records(max_workers=args.max_workers))
+
+    state, _ = api.sync_dns_records(max_workers=args.max_workers)
+    for record in fake.records[:100]:
+        fake.update_record(record, ttl=300)
+    for record in fake.records[-10:]:
+        fake.delete_record(record)
+    measure("delta", lambda: api.sync_dns_records(state, max_workers=args.max_workers)[1])
+
+    # a converged state, nothing changed since
+    state, _ = api.sync_dns_records(state, max_workers=args.max_workers)
+    measure("delta_no_changes", lambda: api.sync_dns_records(state, max_workers=args.max_workers)[0]["records"])
+    results["delta_no_changes"]["records"] = 0
+
+    assert len(state["records"]) == len(fake.records)
+    assert api.count(URL_DNS_RECORDS.format(url=server.url, limit=1)) == len(fake.records)
+    server.stop()
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+# SPDX-License-Identifier: MIT
+"""
+Runs a no-op nomad_job task while the fake Nomad server answers every request
+with a 500 for --outage seconds (a leader election), without retries and with
+the default retry policy of retry.py. Also times the failover from a dead
+first server in a comma separated url list, for the first run and for the
+following runs that go straight to the remembered server.
+
+Usage:
+    ./scripts/benchmarks/bench_retry.py [--outage 1.0] [--rounds 10]
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import tempfile
+import time
+from pathlib import Path
+from typing import Any
+
+from _common import REPO_ROOT, run_module
+from fake_server import MANAGEMENT_TOKEN, nomad_server
+
+JOB_HCL = 'job "job-0" { group "g" { count = 1 } }'
+
+# nothing listens on port 1, connections are refused right away
+DEAD_SERVER = "http://127.0.0.1:1"
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--outage", type=float, default=1.0, help="seconds the server answers with a 500")
+    parser.add_argument("--rounds", type=int, default=10)
+    args = parser.parse_args()
+
+    server = nomad_server(jobs=1).start()
+    params = {"url": server.url, "management_token": MANAGEMENT_TOKEN, "hcl_spec": JOB_HCL}
+
+    results: dict[str, Any] = {}
+    with tempfile.TemporaryDirectory() as cache_dir:
+        os.environ["ANSIBLE_API_CACHE_DIR"] = cache_dir
+        # remember the job spec, so the timed runs are a single GET
+        run_module("nomad_job", params)
+
+        for name, retries in (("no_retries", "0"), ("default_policy", None)):
+            if retries is None:
+                os.environ.pop("ANSIBLE_API_RETRIES", None)
+            else:
+                os.environ["ANSIBLE_API_RETRIES"] = retries
+            failed = 0
+            samples = []
+            for _ in range(args.rounds):
+                server.outage(args.outage)
+                start = time.perf_counter()
+                result = run_module("nomad_job", params)
+                samples.append(time.perf_counter() - start)
+                failed += bool(result.get("failed"))
+            results[f"leader_election_{name}"] = {
+                "failed_runs": failed,
+                "runs": args.rounds,
+                "mean_ms": round(sum(samples) * 1000 / len(samples), 1),
+            }
+
+        server.outage(0)
+        failover = dict(params, url=f"{DEAD_SERVER},{server.url}")
+        samples = []
+        for _ in range(args.rounds):
+            start = time.perf_counter()
+            result = run_module("nomad_job", failover)
+            samples.append(time.perf_counter() - start)
+            assert not result.get("failed"), result
+        results["failover"] = {
+            "first_run_ms": round(samples[0] * 1000, 1),
+            "following_runs_mean_ms": round(sum(samples[1:]) * 1000 / max(len(samples) - 1, 1), 1),
+        }
+
+    server.stop()
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    # make "plugins.modules.*" importable for run_module
+    os.chdir(Path(REPO_ROOT))
+    main()
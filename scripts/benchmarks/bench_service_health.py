@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+# SPDX-License-Identifier: MIT
+"""
+Compares reading the health of many consul services one task per service
+(consul_get_service_detail in a loop) against a single consul_service_health
+task, and waiting for services that become healthy one after another with an
+until/retries/delay polling loop per service against consul_service_health
+with wait, which watches them with blocking queries.
+
+Usage:
+    ./scripts/benchmarks/bench_service_health.py [--services 50] [--latency 0.002] [--delay 2]
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import threading
+import time
+import urllib.request
+from pathlib import Path
+from typing import Any
+
+from _common import REPO_ROOT, run_module
+from fake_server import MANAGEMENT_TOKEN, consul_server
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--services", type=int, default=50)
+    parser.add_argument("--unhealthy", type=int, default=10, help="services that become healthy during the wait")
+    parser.add_argument("--latency", type=float, default=0.002, help="server side latency per request in seconds")
+    parser.add_argument("--delay", type=float, default=2.0, help="delay between the retries of the polling loop")
+    parser.add_argument("--heal-every", type=float, default=0.3, help="seconds between two services becoming healthy")
+    args = parser.parse_args()
+
+    server = consul_server(latency=args.latency, services=args.services).start()
+    fake = server.consul  # type: ignore[attr-defined]
+    base = {"url": server.url, "management_token": MANAGEMENT_TOKEN}
+    names = [f"service-{i}" for i in range(args.services)]
+    results: dict[str, Any] = {"read": {}, "wait": {}}
+
+    def measure(scenario: str, name: str, func: Any) -> None:
+        server.reset_stats()
+        start = time.perf_counter()
+        func()
+        results[scenario][name] = {
+            "ms": round((time.perf_counter() - start) * 1000, 1),
+            "requests": server.stats["requests"],
+        }
+
+    def per_service() -> None:
+        for name in names:
+            run_module("consul_get_service_detail", dict(base, service_name=name))
+
+    def module() -> None:
+        result = run_module("consul_service_health", dict(base, services=names))
+        assert not result.get("failed") and not result["unhealthy"], result
+
+    measure("read", "per_service", per_service)
+    measure("read", "module", module)
+
+    def break_and_heal() -> threading.Thread:
+        """makes the first services critical, then heals them one after another"""
+        unhealthy = names[: args.unhealthy]
+        for name in unhealthy:
+            for n in range(3):
+                fake.set_health(f"{name}-{n}", "critical")
+
+        def heal() -> None:
+            for name in unhealthy:
+                time.sleep(args.heal_every)
+                fake.set_health(f"{name}-0", "passing")
+
+        thread = threading.Thread(target=heal, daemon=True)
+        thread.start()
+        return thread
+
+    def polling() -> None:
+        """a uri task with until/retries/delay per service"""
+        for name in names:
+            request = urllib.request.Request(
+                f"{server.url}/v1/health/service/{name}?passing=true",
+                headers={"X-Consul-Token": MANAGEMENT_TOKEN},
+            )
+            while True:
+                with urllib.request.urlopen(request) as response:
+                    if json.loads(response.read()):
+                        break
+                time.sleep(args.delay)
+
+    time_to_healthy: list[float] = []
+
+    def waiting() -> None:
+        result = run_module("consul_service_health", dict(base, services=names, wait=True, timeout=120))
+        assert not result.get("failed"), result
+        time_to_healthy.append(max(result["time_to_healthy_ms"].values()))
+
+    for name, func in (("polling", polling), ("module", waiting)):
+        thread = break_and_heal()
+        measure("wait", name, func)
+        thread.join()
+    # when the last service was seen healthy, the service became healthy at unhealthy * heal_every
+    results["wait"]["module"]["time_to_healthy_ms"] = time_to_healthy[0]
+
+    server.stop()
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    # make "plugins.modules.*" importable for run_module
+    os.chdir(Path(REPO_ROOT))
+    main()
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+# SPDX-License-Identifier: MIT
+"""
+Compares reading a large list endpoint (nomad acl tokens) in one piece, the
+way api_request does, against NomadAPI.iter_list, which decodes the items
+while the response is being read. Reports wall time and peak memory (via
+tracemalloc) of walking the whole list, and of finding a token by name near
+the start of it. The server runs in a child process, so its memory is not
+counted.
+
+Usage:
+    ./scripts/benchmarks/bench_stream_list.py [--tokens 50000]
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import multiprocessing
+import os
+import time
+import tracemalloc
+from typing import Any, Callable
+
+from _common import BenchModule
+from fake_server import MANAGEMENT_TOKEN, nomad_server
+
+
+def serve(tokens: int, urls: multiprocessing.Queue) -> None:  # type: ignore[type-arg]
+    server = nomad_server(tokens=tokens, policies=10)
+    urls.put(server.url)
+    server.serve_forever()
+
+
+def measure(func: Callable[[], Any]) -> dict[str, float]:
+    tracemalloc.start()
+    start = time.perf_counter()
+    func()
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {"ms": round(elapsed * 1000, 1), "peak_mb": round(peak / 1024 / 1024, 2)}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tokens", type=int, default=50000)
+    args = parser.parse_args()
+
+    # find_acl_token_by_name only stops early when there is no name index cache
+    os.environ["ANSIBLE_API_CACHE_DIR"] = ""
+    import nomad
+
+    urls: multiprocessing.Queue = multiprocessing.Queue()  # type: ignore[type-arg]
+    child = multiprocessing.Process(target=serve, args=(args.tokens, urls), daemon=True)
+    child.start()
+    server_url = urls.get()
+    api = nomad.NomadAPI(
+        BenchModule(
+            url=server_url,
+            management_token=MANAGEMENT_TOKEN,
+            namespace="default",
+            validate_certs=True,
+            connection_timeout=30,
+        )
+    )
+    url = nomad.URL_ACL_TOKENS.format(url=server_url)
+
+    def buffered_find() -> None:
+        tokens = api.api_request(url=url, method="GET")
+        assert any(t["Name"] == "token-10" for t in tokens)
+
+    results = {
+        "buffered_walk": measure(lambda: len(api.api_request(url=url, method="GET"))),
+        "streamed_walk": measure(lambda: sum(1 for _ in api.iter_list(url))),
+        "buffered_find": measure(buffered_find),
+        "streamed_find": measure(lambda: api.find_acl_token_by_name("token-10")),
+    }
+    child.terminate()
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+# SPDX-License-Identifier: MIT
+"""
+Compares the handshakes and wall time of a nomad_job style update (parse, get,
+plan, submission, register) when NomadAPI goes through open_url versus the
+pooled keep-alive transport.
+
+Usage:
+    ./scripts/benchmarks/bench_transport.py [--tls] [--latency 0.002] [--rounds 50]
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import tempfile
+
+from _common import BenchModule, timeit
+from fake_server import nomad_server, self_signed_cert
+
+
+def nomad_job_update(api) -> None:  # type: ignore[no-untyped-def]
+    parsed = api.parse_job(json.dumps({"JobHCL": 'job "job-0" { group "g" { count = 2 } }'}))
+    existing = api.get_job(parsed["ID"])
+    api.plan_job(parsed["ID"], json.dumps({"Job": parsed, "Diff": True}))
+    api.get_job_submission(parsed["ID"], existing.get("Version", 1))
+    api.create_or_update_job(parsed["ID"], json.dumps({"Job": parsed}))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tls", action="store_true", help="serve the stand-in API over TLS")
+    parser.add_argument("--latency", type=float, default=0.0, help="server side latency per request in seconds")
+    parser.add_argument("--rounds", type=int, default=50)
+    args = parser.parse_args()
+
+    import nomad
+    import transport
+
+    with tempfile.TemporaryDirectory() as tmp:
+        certfile, keyfile = self_signed_cert(tmp) if args.tls else (None, None)
+        server = nomad_server(latency=args.latency, certfile=certfile, keyfile=keyfile, jobs=1).start()
+        params = {
+            "url": server.url,
+            "management_token": "bench",
+            "namespace": "default",
+            "validate_certs": False,
+            "connection_timeout": 10,
+        }
+
+        results = {}
+        for name, make_transport in (
+            ("open_url", lambda: transport.OpenUrlTransport(validate_certs=False)),
+            ("pooled", lambda: transport.PooledTransport(validate_certs=False)),
+        ):
+            server.reset_stats()
+
+            # a module run is a fresh process, so every round gets a fresh transport
+            def module_run(make_transport=make_transport) -> None:  # type: ignore[no-untyped-def]
+                api = nomad.NomadAPI(BenchModule(**params))
+                api.transport = make_transport()
+                nomad_job_update(api)
+                api.transport.close()
+
+            timing = timeit(module_run, args.rounds)
+            results[name] = {
+                **timing,
+                "connections_per_run": server.stats["connections"] / args.rounds,
+                "tls_handshakes_per_run": server.stats["tls_handshakes"] / args.rounds,
+                "requests_per_run": server.stats["requests"] / args.rounds,
+            }
+        server.stop()
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+# SPDX-License-Identifier: MIT
+"""
+Compares waiting for a freshly registered nomad job to become healthy the way
+playbooks/infrastructure/nomad/job-deploy.yml did (an until/retries/delay
+loop on the deployment, then one per consul service of the job) against a
+single nomad_job_healthy task, which watches the deployment and the services
+at the same time with blocking queries. The deployment succeeds after
+--deploy-delay seconds, the instances of the services pass their health
+checks one after another every --heal-every seconds.
+
+Usage:
+    ./scripts/benchmarks/bench_wait_healthy.py [--services 3] [--delay 5] [--deploy-delay 7]
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import threading
+import time
+import urllib.request
+from pathlib import Path
+from typing import Any
+
+from _common import REPO_ROOT, run_module
+from fake_server import MANAGEMENT_TOKEN, consul_server, nomad_server
+
+INSTANCES = 3
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--services", type=int, default=3)
+    parser.add_argument("--latency", type=float, default=0.002, help="server side latency per request in seconds")
+    parser.add_argument("--delay", type=float, default=5.0, help="delay between the retries of the polling loop")
+    parser.add_argument("--deploy-delay", type=float, default=7.0, help="seconds until the deployment succeeds")
+    parser.add_argument("--heal-every", type=float, default=0.5, help="seconds between two instances passing")
+    args = parser.parse_args()
+
+    nomad = nomad_server(latency=args.latency).start()
+    consul = consul_server(latency=args.latency, services=args.services, instances=INSTANCES).start()
+    fake_nomad = nomad.nomad  # type: ignore[attr-defined]
+    fake_consul = consul.consul  # type: ignore[attr-defined]
+    fake_nomad.deploy_delay = args.deploy_delay
+    names = [f"service-{i}" for i in range(args.services)]
+    job = {
+        "ID": "web",
+        "Name": "web",
+        "Namespace": "default",
+        "Type": "service",
+        "TaskGroups": [
+            {
+                "Name": "web",
+                "Count": INSTANCES,
+                "Services": [{"Name": name, "Provider": "consul"} for name in names[:1]],
+                "Tasks": [{"Name": "server", "Services": [{"Name": name} for name in names[1:]]}],
+            }
+        ],
+    }
+
+    def call(url: str, token: str, body: Any = None) -> Any:
+        """a single uri task"""
+        data = json.dumps(body).encode() if body is not None else None
+        headers = {"X-Nomad-Token": token, "X-Consul-Token": token}
+        with urllib.request.urlopen(urllib.request.Request(url, data=data, headers=headers)) as response:
+            return json.loads(response.read())
+
+    def deploy() -> threading.Thread:
+        """registers the job, its instances become critical and then pass one after another"""
+        for name in names:
+            for n in range(INSTANCES):
+                fake_consul.set_health(f"{name}-{n}", "critical")
+        call(f"{nomad.url}/v1/job/web", MANAGEMENT_TOKEN, {"Job": job})
+
+        def heal() -> None:
+            for n in range(INSTANCES):
+                for name in names:
+                    time.sleep(args.heal_every)
+                    fake_consul.set_health(f"{name}-{n}", "passing")
+
+        thread = threading.Thread(target=heal, daemon=True)
+        thread.start()
+        return thread
+
+    def polling() -> None:
+        while True:
+            deployment = call(f"{nomad.url}/v1/job/web/deployment", MANAGEMENT_TOKEN)
+            if deployment and deployment["Status"] == "successful":
+                break
+            time.sleep(args.delay)
+        for name in names:
+            while len(call(f"{consul.url}/v1/health/service/{name}?passing=true", MANAGEMENT_TOKEN)) < INSTANCES:
+                time.sleep(args.delay)
+
+    time_to_healthy: dict[str, float] = {}
+
+    def module() -> None:
+        result = run_module(
+            "nomad_job_healthy",
+            {
+                "url": nomad.url,
+                "management_token": MANAGEMENT_TOKEN,
+                "consul_url": consul.url,
+                "consul_token": MANAGEMENT_TOKEN,
+                "name": "web",
+                "timeout": 120,
+            },
+        )
+        assert not result.get("failed"), result
+        time_to_healthy.update(result["time_to_healthy_ms"])
+
+    results: dict[str, Any] = {}
+    for name, func in (("polling", polling), ("module", module)):
+        thread = deploy()
+        nomad.reset_stats()
+        consul.reset_stats()
+        start = time.perf_counter()
+        func()
+        results[name] = {
+            "ms": round((time.perf_counter() - start) * 1000, 1),
+            "nomad_requests": nomad.stats["requests"],
+            "consul_requests": consul.stats["requests"],
+        }
+        thread.join()
+    # the last instance passes at services * instances * heal_every, the deployment succeeds at deploy_delay
+    results["module"]["time_to_healthy_ms"] = time_to_healthy
+
+    nomad.stop()
+    consul.stop()
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    # make "plugins.modules.*" importable for run_module
+    os.chdir(Path(REPO_ROOT))
+    main()
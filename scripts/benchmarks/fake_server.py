@@ -0,0 +1,1610 @@
+#!/usr/bin/env python3
+# SPDX-License-Identifier: MIT
+"""
+A local stand-in for the Nomad/Consul HTTP API (and the NetBox/PowerDNS ones),
+used to benchmark the clients in plugins/module_utils and the modules in
+plugins/modules without a live cluster.
+
+The server speaks HTTP/1.1 with keep-alive (optionally over TLS), keeps its
+objects in memory, answers blocking queries (?index=&wait=) and counts the
+connections and TLS handshakes it accepts, so benchmarks can report how many
+handshakes and requests a module run costs.
+
+Usage:
+    ./scripts/benchmarks/fake_server.py nomad --latency 0.002 --tokens 5000
+    ./scripts/benchmarks/fake_server.py consul --services 500
+"""
+
+from __future__ import annotations
+
+import argparse
+import base64
+import copy
+import json
+import re
+import ssl
+import sys
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from collections.abc import Iterator
+from typing import Any, Callable
+from urllib.parse import parse_qs, unquote, urlencode, urlsplit
+
+# a handler returns (status, payload) or (status, payload, extra headers).
+# A payload that is an iterator of bytes is streamed with chunked encoding
+Handler = Callable[["FakeRequest"], tuple]
+
+MANAGEMENT_TOKEN = "00000000-0000-0000-0000-00000000beef"
+DEFAULT_BLOCKING_WAIT = 300.0
+
+
+def parse_wait(value: str | None) -> float:
+    """
+    Converts a Nomad/Consul wait duration (e.g. 10ms, 5s, 1m) into seconds
+    """
+
+    if not value:
+        return DEFAULT_BLOCKING_WAIT
+    match = re.fullmatch(r"(\d+(?:\.\d+)?)(ms|s|m|h)?", value)
+    if match is None:
+        return DEFAULT_BLOCKING_WAIT
+    scale = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}[match.group(2) or "s"]
+    return float(match.group(1)) * scale
+
+
+class FakeRequest:
+    """
+    A parsed request as seen by a route handler
+    """
+
+    def __init__(self, method: str, path: str, query: dict[str, list[str]], params: dict[str, str], body: bytes):
+        self.method = method
+        self.path = path
+        self.query = query
+        self.params = params
+        self.body = body
+
+    def arg(self, name: str, default: str | None = None) -> str | None:
+        values = self.query.get(name)
+        return values[0] if values else default
+
+    def json(self) -> Any:
+        return json.loads(self.body) if self.body else None
+
+
+class FakeServer(ThreadingHTTPServer):
+    """
+    Threaded HTTP server that dispatches requests to registered route handlers.
+    Every response carries the current raft index in index_header, and GET
+    requests with ?index= block until a write moves the index past it
+    """
+
+    daemon_threads = True
+    # modules open several connections at once, keep them out of the SYN retry path
+    request_queue_size = 128
+
+    def __init__(
+        self,
+        latency: float = 0.0,
+        certfile: str | None = None,
+        keyfile: str | None = None,
+        index_header: str = "X-Nomad-Index",
+    ):
+        super().__init__(("127.0.0.1", 0), _RequestHandler)
+        self.latency = latency
+        self.index_header = index_header
+        self.index = 1
+        self.routes: list[tuple[str, re.Pattern[str], Handler, bool]] = []
+        self.stats = {"connections": 0, "tls_handshakes": 0, "tls_sessions_reused": 0, "requests": 0, "errors": 0}
+        self._stats_lock = threading.Lock()
+        self._changed = threading.Condition()
+        self._thread: threading.Thread | None = None
+        self._outage: tuple[float, int, dict[str, str]] | None = None
+        self.scheme = "http"
+        if certfile:
+            self.scheme = "https"
+            context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+            context.load_cert_chain(certfile, keyfile)
+            self.socket = context.wrap_socket(self.socket, server_side=True, do_handshake_on_connect=False)
+
+    @property
+    def url(self) -> str:
+        return f"{self.scheme}://127.0.0.1:{self.server_address[1]}"
+
+    def route(self, method: str, pattern: str, handler: Handler, blocking: bool = True) -> None:
+        """
+        Registers a handler for a method and a path pattern. Path patterns can
+        contain {name} placeholders which are matched against a single segment,
+        and {name*} placeholders which match the rest of the path. Routes are
+        matched in registration order. GET routes answer blocking queries
+        unless blocking is False
+        """
+
+        regex = re.sub(r"\{(\w+)\*\}", r"(?P<\1>.+)", pattern)
+        regex = re.sub(r"\{(\w+)\}", r"(?P<\1>[^/]+)", regex)
+        self.routes.append((method, re.compile(f"^{regex}$"), handler, blocking))
+
+    def bump(self) -> int:
+        """
+        Moves the raft index forward and wakes up blocking queries
+        """
+
+        with self._changed:
+            self.index += 1
+            self._changed.notify_all()
+            return self.index
+
+    def outage(self, seconds: float, status: int = 500, retry_after: float | None = None) -> None:
+        """
+        Answers every request with status for the next seconds, like a
+        cluster that is electing a leader
+        """
+
+        headers = {"Retry-After": str(retry_after)} if retry_after is not None else {}
+        self._outage = (time.monotonic() + seconds, status, headers)
+
+    def count(self, key: str, amount: int = 1) -> None:
+        with self._stats_lock:
+            self.stats[key] += amount
+
+    def reset_stats(self) -> None:
+        with self._stats_lock:
+            for key in self.stats:
+                self.stats[key] = 0
+
+    def get_request(self):  # type: ignore[no-untyped-def]
+        sock, addr = super().get_request()
+        self.count("connections")
+        if isinstance(sock, ssl.SSLSocket):
+            sock.do_handshake()
+            self.count("tls_handshakes")
+            if sock.session_reused:
+                self.count("tls_sessions_reused")
+        return sock, addr
+
+    def handle_error(self, request, client_address):  # type: ignore[no-untyped-def]
+        # clients that hang up early (e.g. after a streamed list) are expected
+        if isinstance(sys.exc_info()[1], ConnectionError):
+            return
+        super().handle_error(request, client_address)
+
+    def _block(self, request: FakeRequest) -> None:
+        try:
+            index = int(request.arg("index", "0") or 0)
+        except ValueError:
+            return
+        deadline = time.monotonic() + parse_wait(request.arg("wait"))
+        with self._changed:
+            while self.index <= index:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return
+                self._changed.wait(remaining)
+
+    def dispatch(self, method: str, raw_path: str, body: bytes) -> tuple[int, Any, dict[str, str]]:
+        self.count("requests")
+        if self.latency:
+            time.sleep(self.latency)
+        outage = self._outage
+        if outage is not None and time.monotonic() < outage[0]:
+            self.count("errors")
+            return outage[1], "No cluster leader", outage[2]
+        parts = urlsplit(raw_path)
+        for route_method, regex, handler, blocking in self.routes:
+            match = regex.match(parts.path)
+            if route_method == method and match:
+                request = FakeRequest(method, parts.path, parse_qs(parts.query), match.groupdict(), body)
+                if method == "GET" and blocking and request.arg("index"):
+                    self._block(request)
+                status, payload, *extra = handler(request)
+                return status, payload, extra[0] if extra else {}
+        return 404, "not found", {}
+
+    def start(self) -> FakeServer:
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.shutdown()
+        self.server_close()
+
+
+class _RequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # like the Go servers, so headers and body written separately are not held back by Nagle
+    disable_nagle_algorithm = True
+    server: FakeServer
+
+    def log_message(self, format: str, *args: Any) -> None:  # noqa: A002
+        pass
+
+    def _handle(self) -> None:
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length) if length else b""
+        status, payload, headers = self.server.dispatch(self.command, self.path, body)
+        if isinstance(payload, Iterator):
+            self._stream(status, payload, headers)
+            return
+        if isinstance(payload, str | bytes):
+            data = payload.encode() if isinstance(payload, str) else payload
+            content_type = "text/plain"
+        else:
+            data = json.dumps(payload).encode()
+            content_type = "application/json"
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.send_header(self.server.index_header, str(self.server.index))
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.end_headers()
+        try:
+            self.wfile.write(data)
+        except OSError:
+            # the client stopped reading (e.g. a streamed list it was done with)
+            self.close_connection = True
+
+    def _stream(self, status: int, chunks: Iterator[bytes], headers: dict[str, str]) -> None:
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.send_header(self.server.index_header, str(self.server.index))
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.end_headers()
+        try:
+            for chunk in chunks:
+                self.wfile.write(b"%x\r\n%s\r\n" % (len(chunk), chunk))
+            self.wfile.write(b"0\r\n\r\n")
+        except OSError:
+            # the client went away
+            self.close_connection = True
+
+    do_GET = _handle
+    do_POST = _handle
+    do_PUT = _handle
+    do_DELETE = _handle
+    do_PATCH = _handle
+
+
+def _page(request: FakeRequest, items: list[Any], key: str) -> tuple:
+    """
+    Applies Nomad style per_page/next_token pagination to a sorted list
+    """
+
+    next_token = request.arg("next_token")
+    if next_token:
+        items = [i for i in items if str(i[key]) >= next_token]
+    per_page = int(request.arg("per_page", "0") or 0)
+    if per_page and len(items) > per_page:
+        return 200, items[:per_page], {"X-Nomad-NextToken": str(items[per_page][key])}
+    return 200, items
+
+
+#
+# Nomad
+#
+class FakeNomad:
+    """
+    In-memory Nomad state behind the endpoints in plugins/module_utils/nomad.py
+    """
+
+    def __init__(self, server: FakeServer):
+        self.server = server
+        self.lock = threading.Lock()
+        self.policies: dict[str, dict[str, Any]] = {}
+        self.tokens: dict[str, dict[str, Any]] = {}
+        self.namespaces: dict[str, dict[str, Any]] = {"default": {"Name": "default", "Description": ""}}
+        self.volumes: dict[tuple[str, str], dict[str, Any]] = {}
+        self.jobs: dict[tuple[str, str], dict[str, Any]] = {}
+        self.submissions: dict[tuple[str, str, int], dict[str, Any]] = {}
+        self.evaluations: dict[str, dict[str, Any]] = {}
+        self.deployments: dict[str, dict[str, Any]] = {}
+        self.nodes: dict[str, dict[str, Any]] = {}
+        self.events: list[dict[str, Any]] = []
+        self.events_changed = threading.Condition()
+        # a registered job is evaluated after eval_delay, and its deployment
+        # succeeds deploy_delay later. Idle event streams get a heartbeat
+        self.eval_delay = 0.05
+        self.deploy_delay = 0.2
+        self.heartbeat = 10.0
+        self.bootstrapped = True
+        self.scheduler = {
+            "SchedulerAlgorithm": "binpack",
+            "MemoryOversubscriptionEnabled": False,
+            "RejectJobRegistration": False,
+            "PauseEvalBroker": False,
+            "PreemptionConfig": {
+                "SystemSchedulerEnabled": True,
+                "SysBatchSchedulerEnabled": False,
+                "BatchSchedulerEnabled": False,
+                "ServiceSchedulerEnabled": False,
+            },
+        }
+        self.tokens["management"] = {
+            "AccessorID": "management",
+            "SecretID": MANAGEMENT_TOKEN,
+            "Name": "Bootstrap Token",
+            "Type": "management",
+            "Policies": None,
+            "Global": True,
+        }
+
+        r = server.route
+        r("GET", "/v1/acl/policies", self.list_policies)
+        r("GET", "/v1/acl/policy/{name}", self.get_policy)
+        r("POST", "/v1/acl/policy/{name}", self.put_policy)
+        r("DELETE", "/v1/acl/policy/{name}", self.delete_policy)
+        r("GET", "/v1/acl/tokens", self.list_tokens)
+        r("GET", "/v1/acl/token/self", self.self_token)
+        r("POST", "/v1/acl/token", self.create_token)
+        r("GET", "/v1/acl/token/{id}", self.get_token)
+        r("POST", "/v1/acl/token/{id}", self.update_token)
+        r("DELETE", "/v1/acl/token/{id}", self.delete_token)
+        r("POST", "/v1/acl/bootstrap", self.acl_bootstrap)
+        r("GET", "/v1/namespaces", self.list_namespaces)
+        r("GET", "/v1/namespace/{name}", self.get_namespace)
+        r("POST", "/v1/namespace/{name}", self.put_namespace)
+        r("DELETE", "/v1/namespace/{name}", self.delete_namespace)
+        r("GET", "/v1/operator/scheduler/configuration", self.get_scheduler)
+        r("PUT", "/v1/operator/scheduler/configuration", self.put_scheduler)
+        r("GET", "/v1/volumes", self.list_volumes)
+        r("GET", "/v1/volume/csi/{id}", self.get_volume)
+        r("PUT", "/v1/volume/csi/{id}/create", self.create_volume)
+        r("DELETE", "/v1/volume/csi/{id}/delete", self.delete_volume)
+        r("GET", "/v1/jobs", self.list_jobs)
+        r("POST", "/v1/jobs/parse", self.parse_job)
+        r("POST", "/v1/job/{id}/plan", self.plan_job)
+        r("GET", "/v1/job/{id}/submission", self.get_submission)
+        r("GET", "/v1/job/{id}/evaluations", self.list_job_evaluations)
+        r("GET", "/v1/job/{id}/deployment", self.get_job_deployment)
+        r("GET", "/v1/job/{id}", self.get_job)
+        r("POST", "/v1/job/{id}", self.register_job)
+        r("DELETE", "/v1/job/{id}", self.delete_job)
+        r("GET", "/v1/evaluation/{id}", self.get_evaluation)
+        r("GET", "/v1/nodes", self.list_nodes)
+        r("GET", "/v1/node/{id}", self.get_node)
+        r("GET", "/v1/event/stream", self.event_stream, blocking=False)
+
+    def seed(
+        self,
+        tokens: int = 0,
+        policies: int = 0,
+        namespaces: int = 0,
+        volumes: int = 0,
+        jobs: int = 0,
+        nodes: int = 0,
+    ) -> None:
+        """
+        Fills the state with synthetic objects: policy-N, token-N, namespace-N,
+        volume-N (in the default namespace), job-N and the client nodes node-N
+        """
+
+        for i in range(policies):
+            self.policies[f"policy-{i}"] = self._stamp(
+                {
+                    "Name": f"policy-{i}",
+                    "Description": f"synthetic policy {i}",
+                    "Rules": f'namespace "default" {{ policy = "read" }} # {i}',
+                }
+            )
+        for i in range(tokens):
+            accessor = str(uuid.UUID(int=i + 1))
+            self.tokens[accessor] = {
+                "AccessorID": accessor,
+                "SecretID": str(uuid.uuid4()),
+                "Name": f"token-{i}",
+                "Type": "client",
+                "Policies": [f"policy-{i % max(policies, 1)}"],
+                "Global": False,
+            }
+        for i in range(namespaces):
+            self.namespaces[f"namespace-{i}"] = {"Name": f"namespace-{i}", "Description": f"synthetic {i}"}
+        for i in range(volumes):
+            self.volumes[("default", f"volume-{i}")] = self._volume(
+                {
+                    "ID": f"volume-{i}",
+                    "Name": f"volume-{i}",
+                    "Namespace": "default",
+                    "PluginID": "nfs",
+                    "RequestedCapabilities": [
+                        {"AccessMode": "multi-node-multi-writer", "AttachmentMode": "file-system"}
+                    ],
+                    "Parameters": {"share": f"/exports/{i}"},
+                }
+            )
+        for i in range(jobs):
+            job = self._register(self.parse(f'job "job-{i}" {{ group "g" {{ count = 1 }} }}', "default"), f"job {i}")
+            # seeded jobs are deployed already
+            deployment = self._deployment(job)
+            deployment.update(Status="successful", StatusDescription="Deployment completed successfully")
+            self.deployments[deployment["ID"]] = self._stamp(deployment)
+        for i in range(nodes):
+            node_id = str(uuid.UUID(int=i + 1))
+            self.nodes[node_id] = self._stamp(
+                {
+                    "ID": node_id,
+                    "Name": f"node-{i}",
+                    "Datacenter": f"dc{i % 2 + 1}",
+                    "NodeClass": "storage" if i % 4 == 0 else "compute",
+                    "NodePool": "default",
+                    "HTTPAddr": f"10.0.{i // 250}.{i % 250 + 1}:4646",
+                    "Status": "ready",
+                    "SchedulingEligibility": "eligible",
+                    "Drain": False,
+                    "DrainStrategy": None,
+                    "Attributes": {
+                        "kernel.name": "linux",
+                        "os.name": "ubuntu",
+                        "nomad.version": "1.9.3",
+                        "unique.network.ip-address": f"10.0.{i // 250}.{i % 250 + 1}",
+                        **{f"synthetic.attr{n}": str(n) for n in range(80)},
+                    },
+                    "Meta": {"rack": f"rack-{i % 8}"},
+                    "Drivers": {
+                        name: {"Detected": True, "Healthy": True, "HealthDescription": "Healthy"}
+                        for name in ("docker", "exec", "raw_exec")
+                    },
+                }
+            )
+
+    def _stamp(self, obj: dict[str, Any]) -> dict[str, Any]:
+        index = self.server.bump()
+        obj.setdefault("CreateIndex", index)
+        obj["ModifyIndex"] = index
+        return obj
+
+    # ACL policies
+    def list_policies(self, req: FakeRequest) -> tuple:
+        stub_keys = ("Name", "Description", "CreateIndex", "ModifyIndex")
+        return 200, [{k: p.get(k) for k in stub_keys} for p in self.policies.values()]
+
+    def get_policy(self, req: FakeRequest) -> tuple:
+        policy = self.policies.get(req.params["name"])
+        return (200, policy) if policy else (404, "ACL policy not found")
+
+    def put_policy(self, req: FakeRequest) -> tuple:
+        body = req.json()
+        with self.lock:
+            policy = self.policies.get(req.params["name"], {})
+            policy.update(body, Name=req.params["name"])
+            self.policies[req.params["name"]] = self._stamp(policy)
+        return 200, ""
+
+    def delete_policy(self, req: FakeRequest) -> tuple:
+        with self.lock:
+            self.policies.pop(req.params["name"], None)
+            self.server.bump()
+        return 200, ""
+
+    # ACL tokens
+    def _stub(self, token: dict[str, Any]) -> dict[str, Any]:
+        return {k: v for k, v in token.items() if k != "SecretID"}
+
+    def list_tokens(self, req: FakeRequest) -> tuple:
+        tokens = sorted((self._stub(t) for t in self.tokens.values()), key=lambda t: t["AccessorID"])
+        return _page(req, tokens, "AccessorID")
+
+    def self_token(self, req: FakeRequest) -> tuple:
+        if not self.bootstrapped:
+            return 404, "ACL token not found"
+        return 200, self.tokens["management"]
+
+    def get_token(self, req: FakeRequest) -> tuple:
+        token = self.tokens.get(req.params["id"])
+        return (200, token) if token else (404, "ACL token not found")
+
+    def create_token(self, req: FakeRequest) -> tuple:
+        token = req.json()
+        token["AccessorID"] = str(uuid.uuid4())
+        token["SecretID"] = str(uuid.uuid4())
+        with self.lock:
+            self.tokens[token["AccessorID"]] = self._stamp(token)
+        return 200, token
+
+    def update_token(self, req: FakeRequest) -> tuple:
+        with self.lock:
+            token = self.tokens.get(req.params["id"])
+            if token is None:
+                return 404, "ACL token not found"
+            token.update(req.json())
+            self._stamp(token)
+        return 200, token
+
+    def delete_token(self, req: FakeRequest) -> tuple:
+        with self.lock:
+            self.tokens.pop(req.params["id"], None)
+            self.server.bump()
+        return 200, ""
+
+    def acl_bootstrap(self, req: FakeRequest) -> tuple:
+        if self.bootstrapped:
+            return 400, "ACL bootstrap already done"
+        self.bootstrapped = True
+        secret = (req.json() or {}).get("BootstrapSecret") or MANAGEMENT_TOKEN
+        self.tokens["management"]["SecretID"] = secret
+        return 200, self.tokens["management"]
+
+    # Namespaces
+    def list_namespaces(self, req: FakeRequest) -> tuple:
+        return 200, list(self.namespaces.values())
+
+    def get_namespace(self, req: FakeRequest) -> tuple:
+        namespace = self.namespaces.get(req.params["name"])
+        return (200, namespace) if namespace else (404, "namespace not found")
+
+    def put_namespace(self, req: FakeRequest) -> tuple:
+        with self.lock:
+            namespace = req.json()
+            namespace["Name"] = req.params["name"]
+            self.namespaces[req.params["name"]] = self._stamp(namespace)
+        return 200, ""
+
+    def delete_namespace(self, req: FakeRequest) -> tuple:
+        with self.lock:
+            self.namespaces.pop(req.params["name"], None)
+            self.server.bump()
+        return 200, ""
+
+    # Operator
+    def get_scheduler(self, req: FakeRequest) -> tuple:
+        return 200, {"SchedulerConfig": self.scheduler, "Index": self.server.index}
+
+    def put_scheduler(self, req: FakeRequest) -> tuple:
+        with self.lock:
+            self.scheduler.update(req.json())
+            self.server.bump()
+        return 200, {"Updated": True, "Index": self.server.index}
+
+    # CSI volumes
+    def _volume(self, volume: dict[str, Any]) -> dict[str, Any]:
+        volume = copy.deepcopy(volume)
+        volume.setdefault("Namespace", "default")
+        volume.setdefault("Schedulable", True)
+        volume.setdefault("AccessMode", "")
+        volume.setdefault("AttachmentMode", "")
+        volume.setdefault("MountOptions", None)
+        volume.setdefault("Secrets", None)
+        volume.setdefault("Context", {})
+        volume.setdefault("Topologies", None)
+        volume.setdefault("ControllerRequired", False)
+        volume.setdefault("Provider", volume.get("PluginID"))
+        return self._stamp(volume)
+
+    def list_volumes(self, req: FakeRequest) -> tuple:
+        namespace = req.arg("namespace", "default")
+        stubs = [
+            {k: v for k, v in vol.items() if k not in ("Parameters", "Secrets", "Context", "MountOptions")}
+            for (ns, _), vol in sorted(self.volumes.items())
+            if namespace in (ns, "*")
+        ]
+        return _page(req, stubs, "ID")
+
+    def get_volume(self, req: FakeRequest) -> tuple:
+        volume = self.volumes.get((req.arg("namespace", "default"), req.params["id"]))
+        return (200, volume) if volume else (404, "volume not found")
+
+    def create_volume(self, req: FakeRequest) -> tuple:
+        namespace = req.arg("namespace", "default")
+        created = []
+        with self.lock:
+            for volume in req.json().get("Volumes", []):
+                volume["Namespace"] = namespace
+                volume = self._volume(volume)
+                self.volumes[(namespace, volume["ID"])] = volume
+                created.append(volume)
+        return 200, {"Volumes": created, "Warnings": ""}
+
+    def delete_volume(self, req: FakeRequest) -> tuple:
+        with self.lock:
+            self.volumes.pop((req.arg("namespace", "default"), req.params["id"]), None)
+            self.server.bump()
+        return 200, ""
+
+    # Jobs
+    def parse(self, hcl: str, namespace: str) -> dict[str, Any]:
+        match = re.search(r'job\s+"([^"]+)"', hcl)
+        job_id = match.group(1) if match else "example"
+        count = re.search(r"count\s*=\s*(\d+)", hcl)
+        declared = re.search(r'namespace\s*=\s*"([^"]+)"', hcl)
+        return {
+            "ID": job_id,
+            "Name": job_id,
+            "Namespace": declared.group(1) if declared else namespace,
+            "Type": "service",
+            "Datacenters": ["*"],
+            "TaskGroups": [{"Name": "g", "Count": int(count.group(1)) if count else 1}],
+            "Meta": {"source_length": str(len(hcl))},
+        }
+
+    def _register(self, job: dict[str, Any], source: str) -> dict[str, Any]:
+        key = (job["Namespace"], job["ID"])
+        with self.lock:
+            existing = self.jobs.get(key)
+            version = existing["Version"] + 1 if existing else 0
+            job = dict(job, Version=version, Stop=False, Status="running")
+            self._stamp(job)
+            job["JobModifyIndex"] = job["ModifyIndex"]
+            self.jobs[key] = job
+            self.submissions[(job["Namespace"], job["ID"], version)] = {
+                "Source": source,
+                "Format": "hcl2",
+                "JobID": job["ID"],
+                "Namespace": job["Namespace"],
+                "Version": version,
+            }
+        return job
+
+    def _spec(self, job: dict[str, Any] | None) -> dict[str, Any] | None:
+        if job is None:
+            return None
+        return {k: job.get(k) for k in ("ID", "Name", "Namespace", "Type", "Datacenters", "TaskGroups", "Meta")}
+
+    def list_jobs(self, req: FakeRequest) -> tuple:
+        namespace = req.arg("namespace", "default")
+        stubs = [
+            {k: job[k] for k in ("ID", "Name", "Namespace", "Type", "Status", "Stop", "JobModifyIndex", "ModifyIndex")}
+            for (ns, _), job in sorted(self.jobs.items())
+            if namespace in (ns, "*")
+        ]
+        return _page(req, stubs, "ID")
+
+    def parse_job(self, req: FakeRequest) -> tuple:
+        return 200, self.parse(req.json()["JobHCL"], req.arg("namespace", "default"))
+
+    def plan_job(self, req: FakeRequest) -> tuple:
+        job = req.json()["Job"]
+        existing = self.jobs.get((job.get("Namespace") or req.arg("namespace", "default"), req.params["id"]))
+        if existing is None or existing["Stop"]:
+            diff_type = "Added"
+        elif self._spec(existing) == self._spec(job):
+            diff_type = "None"
+        else:
+            diff_type = "Edited"
+        return 200, {
+            "Diff": {"Type": diff_type, "ID": req.params["id"], "Fields": None, "Objects": None, "TaskGroups": None},
+            "JobModifyIndex": existing["JobModifyIndex"] if existing else 0,
+            "Annotations": {"DesiredTGUpdates": {}},
+        }
+
+    def get_submission(self, req: FakeRequest) -> tuple:
+        key = (req.arg("namespace", "default"), req.params["id"], int(req.arg("version", "0") or 0))
+        submission = self.submissions.get(key)
+        return (200, submission) if submission else (404, "job source not found")
+
+    def get_job(self, req: FakeRequest) -> tuple:
+        job = self.jobs.get((req.arg("namespace", "default"), req.params["id"]))
+        return (200, job) if job else (404, "job not found")
+
+    def register_job(self, req: FakeRequest) -> tuple:
+        body = req.json()
+        source = (body.get("Submission") or {}).get("Source", "")
+        job = self._register(body["Job"], source)
+        evaluation = self._evaluate(job)
+        return 200, {
+            "EvalID": evaluation["ID"],
+            "EvalCreateIndex": evaluation["CreateIndex"],
+            "JobModifyIndex": job["JobModifyIndex"],
+            "Warnings": "",
+        }
+
+    def delete_job(self, req: FakeRequest) -> tuple:
+        key = (req.arg("namespace", "default"), req.params["id"])
+        with self.lock:
+            if key not in self.jobs:
+                return 404, "job not found"
+            if req.arg("purge") in ("true", "True"):
+                del self.jobs[key]
+            else:
+                self.jobs[key]["Stop"] = True
+            index = self.server.bump()
+        return 200, {"EvalID": str(uuid.uuid4()), "EvalCreateIndex": index, "JobModifyIndex": index}
+
+    # Evaluations, deployments and the event stream
+    def publish(self, topic: str, event_type: str, obj: dict[str, Any]) -> None:
+        """
+        Stamps obj with a new index and appends an event for it
+        """
+
+        with self.events_changed:
+            self._stamp(obj)
+            self.events.append(
+                {
+                    "Topic": topic,
+                    "Type": event_type,
+                    "Key": obj["ID"],
+                    "Namespace": obj["Namespace"],
+                    "Index": obj["ModifyIndex"],
+                    "Payload": {topic: copy.deepcopy(obj)},
+                }
+            )
+            self.events_changed.notify_all()
+
+    def _later(self, delay: float, func: Callable[..., None], *args: Any) -> None:
+        timer = threading.Timer(delay, func, args=args)
+        timer.daemon = True
+        timer.start()
+
+    def _evaluate(self, job: dict[str, Any]) -> dict[str, Any]:
+        evaluation = {
+            "ID": str(uuid.uuid4()),
+            "Namespace": job["Namespace"],
+            "JobID": job["ID"],
+            "JobModifyIndex": job["JobModifyIndex"],
+            "Type": job["Type"],
+            "TriggeredBy": "job-register",
+            "Status": "pending",
+            "StatusDescription": "",
+            "DeploymentID": "",
+            "FailedTGAllocs": None,
+        }
+        with self.lock:
+            self.evaluations[evaluation["ID"]] = evaluation
+            self.publish("Evaluation", "EvaluationUpdated", evaluation)
+        self._later(self.eval_delay, self._complete_evaluation, evaluation, job)
+        return evaluation
+
+    def _deployment(self, job: dict[str, Any]) -> dict[str, Any]:
+        return {
+            "ID": str(uuid.uuid4()),
+            "Namespace": job["Namespace"],
+            "JobID": job["ID"],
+            "JobVersion": job["Version"],
+            "JobModifyIndex": job["JobModifyIndex"],
+            "JobCreateIndex": job["CreateIndex"],
+            "Status": "running",
+            "StatusDescription": "Deployment is running",
+        }
+
+    def _complete_evaluation(self, evaluation: dict[str, Any], job: dict[str, Any]) -> None:
+        with self.lock:
+            if job["Type"] == "service":
+                deployment = self._deployment(job)
+                self.deployments[deployment["ID"]] = deployment
+                self.publish("Deployment", "DeploymentStatusUpdate", deployment)
+                evaluation["DeploymentID"] = deployment["ID"]
+                self._later(self.deploy_delay, self._complete_deployment, deployment)
+            evaluation["Status"] = "complete"
+            self.publish("Evaluation", "EvaluationUpdated", evaluation)
+
+    def _complete_deployment(self, deployment: dict[str, Any]) -> None:
+        with self.lock:
+            deployment["Status"] = "successful"
+            deployment["StatusDescription"] = "Deployment completed successfully"
+            self.publish("Deployment", "DeploymentStatusUpdate", deployment)
+
+    def list_job_evaluations(self, req: FakeRequest) -> tuple:
+        namespace = req.arg("namespace", "default")
+        evaluations = [
+            e for e in self.evaluations.values() if e["JobID"] == req.params["id"] and e["Namespace"] == namespace
+        ]
+        return 200, sorted(evaluations, key=lambda e: e["CreateIndex"], reverse=True)
+
+    def get_job_deployment(self, req: FakeRequest) -> tuple:
+        namespace = req.arg("namespace", "default")
+        deployments = [
+            d for d in self.deployments.values() if d["JobID"] == req.params["id"] and d["Namespace"] == namespace
+        ]
+        return 200, max(deployments, key=lambda d: d["CreateIndex"], default=None)
+
+    def get_evaluation(self, req: FakeRequest) -> tuple:
+        evaluation = self.evaluations.get(req.params["id"])
+        return (200, evaluation) if evaluation else (404, "eval not found")
+
+    # Nodes
+    def list_nodes(self, req: FakeRequest) -> tuple:
+        return 200, [
+            {
+                "ID": node["ID"],
+                "Name": node["Name"],
+                "Address": node["HTTPAddr"].split(":")[0],
+                "Datacenter": node["Datacenter"],
+                "NodeClass": node["NodeClass"],
+                "NodePool": node["NodePool"],
+                "Version": node["Attributes"]["nomad.version"],
+                "Drain": node["Drain"],
+                "SchedulingEligibility": node["SchedulingEligibility"],
+                "Status": node["Status"],
+                "Drivers": node["Drivers"],
+                "CreateIndex": node["CreateIndex"],
+                "ModifyIndex": node["ModifyIndex"],
+            }
+            for node in self.nodes.values()
+        ]
+
+    def get_node(self, req: FakeRequest) -> tuple:
+        node = self.nodes.get(req.params["id"])
+        return (200, node) if node else (404, "node not found")
+
+    def update_node(self, node_id: str, **fields: Any) -> None:
+        """changes a node the way a drain or an eligibility toggle would"""
+        with self.lock:
+            self._stamp(self.nodes[node_id]).update(fields)
+
+    def event_stream(self, req: FakeRequest) -> tuple:
+        index = int(req.arg("index", "0") or 0)
+        namespace = req.arg("namespace", "default")
+        topics: dict[str, set[str]] = {}
+        for topic in req.query.get("topic", ["*"]):
+            name, _, key = topic.partition(":")
+            topics.setdefault(name, set()).add(key or "*")
+
+        def matches(event: dict[str, Any]) -> bool:
+            keys = topics.get(event["Topic"], set()) | topics.get("*", set())
+            return (
+                event["Index"] >= index
+                and namespace in (event["Namespace"], "*")
+                and ("*" in keys or event["Key"] in keys)
+            )
+
+        def stream() -> Iterator[bytes]:
+            position = 0
+            while True:
+                with self.events_changed:
+                    if position == len(self.events):
+                        self.events_changed.wait(self.heartbeat)
+                    events = [e for e in self.events[position:] if matches(e)]
+                    position = len(self.events)
+                if not events:
+                    yield b"{}\n"
+                    continue
+                batches: dict[int, list[dict[str, Any]]] = {}
+                for event in events:
+                    batches.setdefault(event["Index"], []).append(event)
+                for batch_index, batch in batches.items():
+                    yield json.dumps({"Index": batch_index, "Events": batch}).encode() + b"\n"
+
+        return 200, stream()
+
+
+#
+# Consul
+#
+class FakeConsul:
+    """
+    In-memory Consul state behind the endpoints in plugins/module_utils/consul.py
+    """
+
+    def __init__(self, server: FakeServer):
+        self.server = server
+        self.lock = threading.Lock()
+        self.policies: dict[str, dict[str, Any]] = {
+            "00000000-0000-0000-0000-000000000001": {
+                "ID": "00000000-0000-0000-0000-000000000001",
+                "Name": "global-management",
+                "Description": "Builtin Policy that grants unlimited access",
+                "Rules": "",
+            }
+        }
+        self.tokens: dict[str, dict[str, Any]] = {}
+        self.intentions: dict[tuple[str, str], dict[str, Any]] = {}
+        self.services: dict[str, list[dict[str, Any]]] = {}
+        # the status of the health check of a service instance, by ServiceID. Passing when not set
+        self.health: dict[str, str] = {}
+        self.kv: dict[str, dict[str, Any]] = {}
+        self.bootstrapped = True
+        self.tokens["management"] = {
+            "AccessorID": "management",
+            "SecretID": MANAGEMENT_TOKEN,
+            "Description": "Bootstrap Token (Global Management)",
+            "Policies": [{"ID": "00000000-0000-0000-0000-000000000001", "Name": "global-management"}],
+            "Local": False,
+        }
+
+        r = server.route
+        r("GET", "/v1/acl/policies", self.list_policies)
+        r("GET", "/v1/acl/policy/name/{name}", self.get_policy_by_name)
+        r("PUT", "/v1/acl/policy", self.create_policy)
+        r("GET", "/v1/acl/policy/{id}", self.get_policy)
+        r("PUT", "/v1/acl/policy/{id}", self.update_policy)
+        r("DELETE", "/v1/acl/policy/{id}", self.delete_policy)
+        r("PUT", "/v1/acl/bootstrap", self.acl_bootstrap)
+        r("GET", "/v1/acl/tokens", self.list_tokens)
+        r("GET", "/v1/acl/token/self", self.self_token)
+        r("PUT", "/v1/acl/token", self.create_token)
+        r("GET", "/v1/acl/token/{id}", self.get_token)
+        r("PUT", "/v1/acl/token/{id}", self.update_token)
+        r("DELETE", "/v1/acl/token/{id}", self.delete_token)
+        r("GET", "/v1/connect/intentions/exact", self.get_intention)
+        r("PUT", "/v1/connect/intentions/exact", self.put_intention)
+        r("DELETE", "/v1/connect/intentions/exact", self.delete_intention)
+        r("GET", "/v1/connect/intentions", self.list_intentions)
+        r("GET", "/v1/catalog/services", self.list_services)
+        r("GET", "/v1/catalog/service/{name}", self.get_service)
+        r("GET", "/v1/health/service/{name}", self.get_health_service)
+        r("GET", "/v1/catalog/nodes", self.list_nodes)
+        r("GET", "/v1/health/state/{state}", self.get_health_state)
+        r("GET", "/v1/kv/{key*}", self.get_kv)
+        r("PUT", "/v1/kv/{key*}", self.put_kv)
+        r("DELETE", "/v1/kv/{key*}", self.delete_kv)
+        r("PUT", "/v1/txn", self.txn)
+
+    def seed(
+        self,
+        tokens: int = 0,
+        policies: int = 0,
+        intentions: int = 0,
+        services: int = 0,
+        instances: int = 3,
+        keys: int = 0,
+    ) -> None:
+        """
+        Fills the state with synthetic objects: policy-N, token-N (linked to up
+        to 10 policies), service-N with instances each, intentions between
+        consecutive services and the KV keys synthetic/key-N
+        """
+
+        for i in range(policies):
+            policy_id = str(uuid.UUID(int=i + 100))
+            self.policies[policy_id] = {
+                "ID": policy_id,
+                "Name": f"policy-{i}",
+                "Description": f"synthetic policy {i}",
+                "Rules": f'service "service-{i}" {{ policy = "write" }}',
+                "Datacenters": None,
+                "CreateIndex": 1,
+                "ModifyIndex": 1,
+            }
+        policy_links = [{"ID": p["ID"], "Name": p["Name"]} for p in self.policies.values()]
+        for i in range(tokens):
+            accessor = str(uuid.UUID(int=i + 1))
+            self.tokens[accessor] = {
+                "AccessorID": accessor,
+                "SecretID": str(uuid.uuid4()),
+                "Description": f"token-{i}",
+                "Policies": policy_links[i % len(policy_links) :][:10],
+                "Local": False,
+            }
+        for i in range(services):
+            self.services[f"service-{i}"] = [
+                {
+                    "ID": f"service-{i}-{n}",
+                    "Node": f"node-{n}",
+                    "Address": f"10.0.{n}.1",
+                    "Datacenter": "dc1",
+                    "ServiceID": f"service-{i}-{n}",
+                    "ServiceName": f"service-{i}",
+                    "ServiceAddress": f"10.0.{n}.1",
+                    "ServicePort": 20000 + i,
+                    "ServiceTags": ["synthetic", f"shard-{i % 4}"],
+                    "ServiceMeta": {},
+                    "NodeMeta": {"role": "client"},
+                }
+                for n in range(instances)
+            ]
+        for i in range(intentions):
+            source, destination = f"service-{i}", f"service-{i + 1}"
+            self.intentions[(source, destination)] = self._intention(
+                source, destination, {"Action": "allow", "SourceType": "consul"}
+            )
+        for i in range(keys):
+            self._kv_set(f"synthetic/key-{i}", base64.b64encode(f"value {i}".encode()).decode(), 0, 1)
+        self.server.bump()
+
+    def _intention(self, source: str, destination: str, body: dict[str, Any]) -> dict[str, Any]:
+        intention = dict(body, SourceName=source, DestinationName=destination, SourceType="consul")
+        intention.setdefault("Precedence", 9)
+        intention.setdefault("Permissions", None)
+        index = self.server.index
+        intention.setdefault("CreateIndex", index)
+        intention["ModifyIndex"] = index
+        return intention
+
+    def _stamp(self, obj: dict[str, Any]) -> dict[str, Any]:
+        index = self.server.bump()
+        obj.setdefault("CreateIndex", index)
+        obj["ModifyIndex"] = index
+        return obj
+
+    # ACL policies
+    def list_policies(self, req: FakeRequest) -> tuple:
+        return 200, [{k: v for k, v in p.items() if k != "Rules"} for p in self.policies.values()]
+
+    def _policy_by_name(self, name: str) -> dict[str, Any] | None:
+        return next((p for p in self.policies.values() if p["Name"] == name), None)
+
+    def get_policy_by_name(self, req: FakeRequest) -> tuple:
+        policy = self._policy_by_name(req.params["name"])
+        return (200, policy) if policy else (404, "ACL not found")
+
+    def get_policy(self, req: FakeRequest) -> tuple:
+        policy = self.policies.get(req.params["id"])
+        return (200, policy) if policy else (404, "ACL not found")
+
+    def create_policy(self, req: FakeRequest) -> tuple:
+        policy = req.json()
+        with self.lock:
+            if self._policy_by_name(policy["Name"]) is not None:
+                return 500, "Invalid Policy: A Policy with Name already exists"
+            policy["ID"] = str(uuid.uuid4())
+            self.policies[policy["ID"]] = self._stamp(policy)
+        return 200, policy
+
+    def update_policy(self, req: FakeRequest) -> tuple:
+        with self.lock:
+            policy = self.policies.get(req.params["id"])
+            if policy is None:
+                return 404, "ACL not found"
+            policy.update(req.json(), ID=req.params["id"])
+            self._stamp(policy)
+        return 200, policy
+
+    def delete_policy(self, req: FakeRequest) -> tuple:
+        with self.lock:
+            self.policies.pop(req.params["id"], None)
+            self.server.bump()
+        return 200, "true"
+
+    # ACL tokens
+    def acl_bootstrap(self, req: FakeRequest) -> tuple:
+        if self.bootstrapped:
+            return 403, "Permission denied: ACL bootstrap no longer allowed"
+        self.bootstrapped = True
+        secret = (req.json() or {}).get("BootstrapSecret") or MANAGEMENT_TOKEN
+        self.tokens["management"]["SecretID"] = secret
+        return 200, self.tokens["management"]
+
+    def list_tokens(self, req: FakeRequest) -> tuple:
+        return 200, [{k: v for k, v in t.items() if k != "SecretID"} for t in self.tokens.values()]
+
+    def self_token(self, req: FakeRequest) -> tuple:
+        if not self.bootstrapped:
+            return 403, "ACL not found"
+        return 200, self.tokens["management"]
+
+    def get_token(self, req: FakeRequest) -> tuple:
+        token = self.tokens.get(req.params["id"])
+        return (200, token) if token else (403, "ACL not found")
+
+    def create_token(self, req: FakeRequest) -> tuple:
+        token = req.json()
+        token.setdefault("AccessorID", str(uuid.uuid4()))
+        token.setdefault("SecretID", str(uuid.uuid4()))
+        with self.lock:
+            self.tokens[token["AccessorID"]] = token
+            self.server.bump()
+        return 200, token
+
+    def update_token(self, req: FakeRequest) -> tuple:
+        with self.lock:
+            token = self.tokens.get(req.params["id"])
+            if token is None:
+                return 403, "ACL not found"
+            token.update(req.json())
+            self.server.bump()
+        return 200, token
+
+    def delete_token(self, req: FakeRequest) -> tuple:
+        with self.lock:
+            self.tokens.pop(req.params["id"], None)
+            self.server.bump()
+        return 200, "true"
+
+    # Connect intentions
+    def _intention_key(self, req: FakeRequest) -> tuple[str, str]:
+        return req.arg("source", "") or "", req.arg("destination", "") or ""
+
+    def list_intentions(self, req: FakeRequest) -> tuple:
+        return 200, list(self.intentions.values())
+
+    def get_intention(self, req: FakeRequest) -> tuple:
+        intention = self.intentions.get(self._intention_key(req))
+        return (200, intention) if intention else (404, "Intention not found")
+
+    def put_intention(self, req: FakeRequest) -> tuple:
+        source, destination = self._intention_key(req)
+        with self.lock:
+            self.server.bump()
+            self.intentions[(source, destination)] = self._intention(source, destination, req.json())
+        return 200, True
+
+    def delete_intention(self, req: FakeRequest) -> tuple:
+        with self.lock:
+            self.intentions.pop(self._intention_key(req), None)
+            self.server.bump()
+        return 200, True
+
+    # Catalog
+    def list_services(self, req: FakeRequest) -> tuple:
+        return 200, {
+            name: sorted({tag for instance in instances for tag in instance["ServiceTags"]})
+            for name, instances in self.services.items()
+        }
+
+    def get_service(self, req: FakeRequest) -> tuple:
+        return 200, self.services.get(req.params["name"], [])
+
+    def set_health(self, service_id: str, status: str) -> None:
+        """sets the status of the health check of a service instance and wakes up blocking queries"""
+        with self.lock:
+            self.health[service_id] = status
+            self.server.bump()
+
+    def get_health_service(self, req: FakeRequest) -> tuple:
+        entries = []
+        for instance in self.services.get(req.params["name"], []):
+            status = self.health.get(instance["ServiceID"], "passing")
+            if req.arg("passing") not in (None, "false") and status != "passing":
+                continue
+            entries.append(
+                {
+                    "Node": {"Node": instance["Node"], "Address": instance["Address"], "Meta": instance["NodeMeta"]},
+                    "Service": {
+                        "ID": instance["ServiceID"],
+                        "Service": instance["ServiceName"],
+                        "Tags": instance["ServiceTags"],
+                        "Address": instance["ServiceAddress"],
+                        "Port": instance["ServicePort"],
+                        "Meta": instance["ServiceMeta"],
+                    },
+                    "Checks": [
+                        {"Node": instance["Node"], "CheckID": "serfHealth", "Status": "passing"},
+                        {
+                            "Node": instance["Node"],
+                            "CheckID": f"service:{instance['ServiceID']}",
+                            "Status": status,
+                            "ServiceID": instance["ServiceID"],
+                        },
+                    ],
+                }
+            )
+        return 200, entries
+
+    def _instances_by_node(self) -> dict[str, list[dict[str, Any]]]:
+        nodes: dict[str, list[dict[str, Any]]] = {}
+        for instances in self.services.values():
+            for instance in instances:
+                nodes.setdefault(instance["Node"], []).append(instance)
+        return nodes
+
+    def list_nodes(self, req: FakeRequest) -> tuple:
+        """the nodes the service instances are on"""
+        return 200, [
+            {
+                "Node": node,
+                "Address": instances[0]["Address"],
+                "Datacenter": instances[0]["Datacenter"],
+                "TaggedAddresses": {"lan": instances[0]["Address"]},
+                "Meta": instances[0]["NodeMeta"],
+            }
+            for node, instances in self._instances_by_node().items()
+        ]
+
+    def get_health_state(self, req: FakeRequest) -> tuple:
+        """the serf health check of every node and the health check of every service instance"""
+        checks = []
+        for node, instances in self._instances_by_node().items():
+            if req.params["state"] in ("any", "passing"):
+                checks.append({"Node": node, "CheckID": "serfHealth", "Status": "passing", "ServiceID": ""})
+            for instance in instances:
+                status = self.health.get(instance["ServiceID"], "passing")
+                if req.params["state"] in ("any", status):
+                    checks.append(
+                        {
+                            "Node": node,
+                            "CheckID": f"service:{instance['ServiceID']}",
+                            "Status": status,
+                            "ServiceID": instance["ServiceID"],
+                            "ServiceName": instance["ServiceName"],
+                            "ServiceTags": instance["ServiceTags"],
+                        }
+                    )
+        return 200, checks
+
+    # KV and transactions
+    def _kv_set(self, key: str, value: str | None, flags: int, index: int) -> dict[str, Any]:
+        entry = self.kv.get(key)
+        if entry is None:
+            entry = {"Key": key, "CreateIndex": index, "LockIndex": 0}
+            self.kv[key] = entry
+        entry.update(Value=value, Flags=flags, ModifyIndex=index)
+        return entry
+
+    def _kv_tree(self, prefix: str) -> list[dict[str, Any]]:
+        return [self.kv[k] for k in sorted(self.kv) if k.startswith(prefix)]
+
+    def _cas_ok(self, key: str, cas: int) -> bool:
+        entry = self.kv.get(key)
+        return entry is None if cas == 0 else entry is not None and entry["ModifyIndex"] == cas
+
+    def get_kv(self, req: FakeRequest) -> tuple:
+        key = unquote(req.params["key"])
+        entries = self._kv_tree(key) if req.arg("recurse") else [e for e in [self.kv.get(key)] if e]
+        return (200, entries) if entries else (404, "")
+
+    def put_kv(self, req: FakeRequest) -> tuple:
+        key = unquote(req.params["key"])
+        with self.lock:
+            cas = req.arg("cas")
+            if cas is not None and not self._cas_ok(key, int(cas)):
+                return 200, False
+            value = base64.b64encode(req.body).decode() if req.body else None
+            self._kv_set(key, value, int(req.arg("flags", "0") or 0), self.server.bump())
+        return 200, True
+
+    def delete_kv(self, req: FakeRequest) -> tuple:
+        key = unquote(req.params["key"])
+        with self.lock:
+            cas = req.arg("cas")
+            if cas is not None and not self._cas_ok(key, int(cas)):
+                return 200, False
+            for entry in self._kv_tree(key) if req.arg("recurse") else [e for e in [self.kv.get(key)] if e]:
+                del self.kv[entry["Key"]]
+            self.server.bump()
+        return 200, True
+
+    def txn(self, req: FakeRequest) -> tuple:
+        ops = req.json()
+        if len(ops) > 64:
+            return 413, f"Transaction contains too many operations ({len(ops)} > 64)"
+        with self.lock:
+            snapshot = copy.deepcopy(self.kv)
+            index = self.server.index + 1
+            results: list[dict[str, Any]] = []
+            errors: list[dict[str, Any]] = []
+            for i, op in enumerate(ops):
+                kv = op["KV"]
+                verb, key = kv["Verb"], kv["Key"]
+                entry = self.kv.get(key)
+                if verb in ("cas", "delete-cas", "check-index") and not self._cas_ok(key, kv.get("Index", 0)):
+                    errors.append({"OpIndex": i, "What": f'failed to {verb} key "{key}", index is stale'})
+                elif verb in ("get", "check-index") and entry is None:
+                    errors.append({"OpIndex": i, "What": f'key "{key}" doesn\'t exist'})
+                elif verb == "check-not-exists" and entry is not None:
+                    errors.append({"OpIndex": i, "What": f'key "{key}" exists'})
+                elif verb in ("set", "cas"):
+                    entry = self._kv_set(key, kv.get("Value"), kv.get("Flags", 0), index)
+                    results.append({"KV": dict(entry, Value=None)})
+                elif verb in ("get", "check-index"):
+                    results.append({"KV": entry})
+                elif verb == "get-tree":
+                    results.extend({"KV": e} for e in self._kv_tree(key))
+                elif verb in ("delete", "delete-cas"):
+                    self.kv.pop(key, None)
+                elif verb == "delete-tree":
+                    for e in self._kv_tree(key):
+                        del self.kv[e["Key"]]
+            if errors:
+                self.kv = snapshot
+                return 409, {"Results": None, "Errors": errors}
+            if self.kv != snapshot:
+                self.server.bump()
+        return 200, {"Results": copy.deepcopy(results), "Errors": None}
+
+
+#
+# NetBox (netbox-dns plugin)
+#
+class FakeNetbox:
+    """
+    In-memory netbox-dns state behind the endpoints in plugins/module_utils/netbox.py
+    """
+
+    def __init__(self, server: FakeServer):
+        self.server = server
+        self.zones: list[dict[str, Any]] = []
+        self.records: list[dict[str, Any]] = []
+        self._clock = 0
+
+        r = server.route
+        r("GET", "/api/plugins/netbox-dns/zones/", self.list_zones)
+        r("GET", "/api/plugins/netbox-dns/records/", self.list_records)
+
+    def seed(self, zones: int = 0, records: int = 0) -> None:
+        """
+        Fills the state with the zones zone-N.example.com, each with an apex NS
+        record and an even share of records: mostly A records host-M, every
+        tenth one a CNAME, every 25th an MX and every 50th a TXT
+        """
+
+        for z in range(zones):
+            name = f"zone-{z}.example.com"
+            zone = {
+                "id": z + 1,
+                "name": name,
+                "status": "active",
+                "default_ttl": 3600,
+                "soa_ttl": 3600,
+                "soa_mname": {"id": 1, "name": "ns1.example.com"},
+                "soa_rname": f"hostmaster.{name}",
+                "soa_serial": 1,
+                "soa_refresh": 43200,
+                "soa_retry": 7200,
+                "soa_expire": 2419200,
+                "soa_minimum": 3600,
+            }
+            self.zones.append(zone)
+            self.add_record(zone, "@", "NS", "ns1.example.com")
+            for i in range(records // max(zones, 1)):
+                if i % 50 == 49:
+                    self.add_record(zone, f"host-{i}", "TXT", f"v=spf1 ip4:10.{z % 256}.0.0/16 -all")
+                elif i % 25 == 24:
+                    self.add_record(zone, f"host-{i}", "MX", f"10 host-{i - 1}.{name}.")
+                elif i % 10 == 9:
+                    self.add_record(zone, f"alias-{i}", "CNAME", f"host-{i - 1}.{name}.")
+                else:
+                    self.add_record(zone, f"host-{i}", "A", f"10.{z % 256}.{i // 256 % 256}.{i % 256}")
+
+    def add_record(self, zone: dict[str, Any], name: str, rtype: str, value: str, ttl: int | None = None) -> dict:
+        fqdn = f"{zone['name']}." if name == "@" else f"{name}.{zone['name']}."
+        record = {
+            "id": self.records[-1]["id"] + 1 if self.records else 1,
+            "name": name,
+            "fqdn": fqdn,
+            "zone": {"id": zone["id"], "name": zone["name"]},
+            "type": rtype,
+            "value": value,
+            "ttl": ttl,
+            "status": "active",
+            "last_updated": self._now(),
+        }
+        self.records.append(record)
+        return record
+
+    def update_record(self, record: dict[str, Any], **fields: Any) -> None:
+        record.update(fields, last_updated=self._now())
+
+    def delete_record(self, record: dict[str, Any]) -> None:
+        self.records.remove(record)
+
+    def _now(self) -> str:
+        """a timestamp in the format of netbox that moves forward on every write"""
+        self._clock += 1
+        seconds, micro = divmod(self._clock, 1000000)
+        return time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(1700000000 + seconds)) + f".{micro:06d}Z"
+
+    def _page(self, req: FakeRequest, items: list[Any]) -> tuple:
+        """applies the netbox id filters and ordering, and limit/offset pagination with an absolute next link"""
+        ids = {int(i) for i in req.query.get("id", [])}
+        after = int(req.arg("id__gt", "0") or 0)
+        last = req.arg("id__lte")
+        items = [
+            item
+            for item in items
+            if (not ids or item["id"] in ids) and item["id"] > after and (last is None or item["id"] <= int(last))
+        ]
+        items = sorted(items, key=lambda item: item["id"], reverse=req.arg("ordering") == "-id")
+        limit = min(int(req.arg("limit", "50") or 50), 1000)
+        offset = int(req.arg("offset", "0") or 0)
+        results = items[offset : offset + limit]
+        next_link = None
+        if offset + limit < len(items):
+            query = {k: v[0] for k, v in req.query.items()}
+            query.update(limit=str(limit), offset=str(offset + limit))
+            next_link = f"{self.server.url}{req.path}?{urlencode(query)}"
+        return 200, {"count": len(items), "next": next_link, "previous": None, "results": results}
+
+    def list_zones(self, req: FakeRequest) -> tuple:
+        return self._page(req, self.zones)
+
+    def list_records(self, req: FakeRequest) -> tuple:
+        status = req.arg("status")
+        since = req.arg("last_updated__gte")
+        records = [
+            r
+            for r in self.records
+            if (status is None or r["status"] == status) and (since is None or r["last_updated"] >= since)
+        ]
+        status, page = self._page(req, records)
+        if req.arg("brief"):
+            page["results"] = [{k: r[k] for k in ("id", "name", "type", "value")} for r in page["results"]]
+        return status, page
+
+
+#
+# PowerDNS
+#
+class FakePowerDNS:
+    """
+    In-memory PowerDNS state behind the endpoints in plugins/module_utils/powerdns.py,
+    served under /api/v1 like the real API
+    """
+
+    def __init__(self, server: FakeServer):
+        self.server = server
+        self.lock = threading.Lock()
+        self.zones: dict[str, dict[str, Any]] = {}
+        self.writes = 0
+
+        r = server.route
+        r("POST", "/api/v1/servers/{server}/zones", self.create_zone)
+        r("GET", "/api/v1/servers/{server}/zones/{zone}", self.get_zone)
+        r("PATCH", "/api/v1/servers/{server}/zones/{zone}", self.patch_zone)
+
+    def _zone(self, zone: dict[str, Any]) -> dict[str, Any]:
+        rrsets = [dict(rrset, comments=[]) for rrset in zone["rrsets"].values()]
+        return {
+            "id": zone["name"],
+            "name": zone["name"],
+            "kind": zone["kind"],
+            "serial": zone["serial"],
+            "rrsets": rrsets,
+        }
+
+    def get_zone(self, req: FakeRequest) -> tuple:
+        zone = self.zones.get(req.params["zone"].lower())
+        return (200, self._zone(zone)) if zone else (404, {"error": "Not Found"})
+
+    def create_zone(self, req: FakeRequest) -> tuple:
+        body = req.json()
+        name = body["name"].lower()
+        with self.lock:
+            if name in self.zones:
+                return 409, {"error": f"Domain '{name}' already exists"}
+            rrsets = {(r["name"].lower(), r["type"]): r for r in body.get("rrsets") or []}
+            if (name, "SOA") not in rrsets:
+                content = f"a.misconfigured.dns.server.invalid. hostmaster.{name} 0 10800 3600 604800 3600"
+                rrsets[(name, "SOA")] = {"name": name, "type": "SOA", "ttl": 3600, "records": [{"content": content}]}
+            if (name, "NS") not in rrsets:
+                if not body.get("nameservers"):
+                    return 422, {"error": "Nameservers list must be given for zones without an NS record"}
+                records = [{"content": ns, "disabled": False} for ns in body["nameservers"]]
+                rrsets[(name, "NS")] = {"name": name, "type": "NS", "ttl": 3600, "records": records}
+            self.zones[name] = {"name": name, "kind": body.get("kind", "Native"), "serial": 1, "rrsets": rrsets}
+            self.writes += 1
+        return 201, self._zone(self.zones[name])
+
+    def patch_zone(self, req: FakeRequest) -> tuple:
+        with self.lock:
+            zone = self.zones.get(req.params["zone"].lower())
+            if zone is None:
+                return 404, {"error": "Not Found"}
+            rrsets = dict(zone["rrsets"])
+            for rrset in req.json().get("rrsets") or []:
+                key = (rrset["name"].lower(), rrset["type"])
+                if not key[0].endswith(zone["name"]):
+                    return 422, {"error": f"RRset {rrset['name']} IN {rrset['type']}: Name is out of zone"}
+                if rrset["changetype"] == "DELETE":
+                    rrsets.pop(key, None)
+                elif rrset["changetype"] == "REPLACE":
+                    rrsets[key] = {k: rrset[k] for k in ("name", "type", "ttl", "records")}
+                else:
+                    return 422, {"error": f"Changetype not understood: {rrset['changetype']}"}
+            zone["rrsets"] = rrsets
+            zone["serial"] += 1
+            self.writes += 1
+        return 204, ""
+
+
+def nomad_server(
+    latency: float = 0.0,
+    certfile: str | None = None,
+    keyfile: str | None = None,
+    **sizes: int,
+) -> FakeServer:
+    """
+    Returns a fake Nomad server, seeded with FakeNomad.seed(**sizes). The state
+    is reachable as server.nomad
+    """
+
+    server = FakeServer(latency=latency, certfile=certfile, keyfile=keyfile, index_header="X-Nomad-Index")
+    server.nomad = FakeNomad(server)  # type: ignore[attr-defined]
+    server.nomad.seed(**sizes)  # type: ignore[attr-defined]
+    return server
+
+
+def consul_server(
+    latency: float = 0.0,
+    certfile: str | None = None,
+    keyfile: str | None = None,
+    **sizes: int,
+) -> FakeServer:
+    """
+    Returns a fake Consul server, seeded with FakeConsul.seed(**sizes). The
+    state is reachable as server.consul
+    """
+
+    server = FakeServer(latency=latency, certfile=certfile, keyfile=keyfile, index_header="X-Consul-Index")
+    server.consul = FakeConsul(server)  # type: ignore[attr-defined]
+    server.consul.seed(**sizes)  # type: ignore[attr-defined]
+    return server
+
+
+def netbox_server(latency: float = 0.0, **sizes: int) -> FakeServer:
+    """
+    Returns a fake NetBox server, seeded with FakeNetbox.seed(**sizes). The
+    state is reachable as server.netbox
+    """
+
+    server = FakeServer(latency=latency)
+    server.netbox = FakeNetbox(server)  # type: ignore[attr-defined]
+    server.netbox.seed(**sizes)  # type: ignore[attr-defined]
+    return server
+
+
+def powerdns_server(latency: float = 0.0) -> FakeServer:
+    """
+    Returns an empty fake PowerDNS server, its API url is server.url + "/api/v1".
+    The state is reachable as server.powerdns
+    """
+
+    server = FakeServer(latency=latency)
+    server.powerdns = FakePowerDNS(server)  # type: ignore[attr-defined]
+    return server
+
+
+def self_signed_cert(directory: str) -> tuple[str, str]:
+    """
+    Writes a self-signed certificate for 127.0.0.1 into directory and returns
+    the (certfile, keyfile) paths
+    """
+
+    import datetime
+    import ipaddress
+    from pathlib import Path
+
+    from cryptography import x509
+    from cryptography.hazmat.primitives import hashes, serialization
+    from cryptography.hazmat.primitives.asymmetric import ec
+    from cryptography.x509.oid import NameOID
+
+    key = ec.generate_private_key(ec.SECP256R1())
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, "127.0.0.1")])
+    now = datetime.datetime.now(datetime.timezone.utc)
+    cert = (
+        x509.CertificateBuilder()
+        .subject_name(name)
+        .issuer_name(name)
+        .public_key(key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(now)
+        .not_valid_after(now + datetime.timedelta(days=1))
+        .add_extension(x509.SubjectAlternativeName([x509.IPAddress(ipaddress.ip_address("127.0.0.1"))]), False)
+        .sign(key, hashes.SHA256())
+    )
+
+    certfile = Path(directory) / "cert.pem"
+    keyfile = Path(directory) / "key.pem"
+    certfile.write_bytes(cert.public_bytes(serialization.Encoding.PEM))
+    keyfile.write_bytes(
+        key.private_bytes(
+            serialization.Encoding.PEM,
+            serialization.PrivateFormat.PKCS8,
+            serialization.NoEncryption(),
+        )
+    )
+    return str(certfile), str(keyfile)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("kind", choices=["nomad", "consul"])
+    parser.add_argument("--latency", type=float, default=0.0, help="server side latency per request in seconds")
+    parser.add_argument("--tokens", type=int, default=100)
+    parser.add_argument("--policies", type=int, default=20)
+    parser.add_argument("--namespaces", type=int, default=5, help="nomad only")
+    parser.add_argument("--volumes", type=int, default=50, help="nomad only")
+    parser.add_argument("--jobs", type=int, default=40, help="nomad only")
+    parser.add_argument("--services", type=int, default=100, help="consul only")
+    parser.add_argument("--intentions", type=int, default=100, help="consul only")
+    args = parser.parse_args()
+
+    if args.kind == "nomad":
+        server = nomad_server(
+            latency=args.latency,
+            tokens=args.tokens,
+            policies=args.policies,
+            namespaces=args.namespaces,
+            volumes=args.volumes,
+            jobs=args.jobs,
+        )
+    else:
+        server = consul_server(
+            latency=args.latency,
+            tokens=args.tokens,
+            policies=args.policies,
+            services=args.services,
+            intentions=args.intentions,
+        )
+    print(f"fake {args.kind} listening on {server.url} (token: {MANAGEMENT_TOKEN})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()